@@ -0,0 +1,122 @@
+"""Benchmark the pipelined loader against transforming first and loading afterwards.
+
+Usage (from the repository root):
+    python benchmarks/bench_async_load.py --rows 1000000 --chunksize 100000
+    python benchmarks/bench_async_load.py --dsn postgresql://localhost/iam_etl_bench --connections 1 4
+
+The sequential run is what run_all.py does with --chunksize: transform_stream writes every
+chunk, then the chunks are loaded. The pipelined run loads each chunk while the next one is
+transformed (etl/async_load.py). Both load with the same loader, so the difference is the
+overlap. With --dsn, iam_policies is TRUNCATED before every run, so use a scratch database;
+without it every chunk's COPY and merge are simulated as --latency-ms of network time each.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from etl.async_load import load_pipelined
+from etl.extract import iter_chunks
+from etl.transform import transform_stream
+
+
+class SimulatedCursor:
+    def __init__(self, latency):
+        self.latency = latency
+        self.rowcount = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def copy(self, query):
+        return self
+
+    async def write(self, data):
+        self.rowcount = data.count('\n')
+        await asyncio.sleep(self.latency / 2)
+
+    async def execute(self, query):
+        await asyncio.sleep(self.latency / 2)
+
+
+class SimulatedConnection:
+    """An async connection whose statements only wait: the network and database time of a load."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def transaction(self):
+        return SimulatedCursor(0)
+
+    pipeline = transaction
+
+    async def execute(self, query):
+        pass
+
+    def cursor(self):
+        return SimulatedCursor(self.latency)
+
+    async def close(self):
+        pass
+
+
+def truncate(dsn):
+    import psycopg
+    with psycopg.connect(dsn) as conn:
+        conn.execute("TRUNCATE iam_policies;")
+
+
+def run(args, connections, pipelined):
+    connect = None
+    if args.dsn:
+        truncate(args.dsn)
+    else:
+        async def connect():
+            return SimulatedConnection(args.latency_ms / 1000)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        transform = lambda on_chunk: transform_stream(iter_chunks(args.rows, args.chunksize), output_dir=output_dir,
+                                                      snapshot_level='off', on_chunk=on_chunk)
+        start = time.perf_counter()
+        if pipelined:
+            _, stats = asyncio.run(load_pipelined(transform, dsn=args.dsn, connections=connections, connect=connect))
+        else:
+            chunks = []
+            transform(chunks.append)  # Everything is transformed (and written) before the load starts
+
+            def replay(on_chunk):
+                for chunk in chunks:
+                    on_chunk(chunk)
+            _, stats = asyncio.run(load_pipelined(replay, dsn=args.dsn, connections=connections, connect=connect))
+        stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipelined loader")
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Rows to transform and load')
+    parser.add_argument('--chunksize', type=int, default=100_000, help='Rows per chunk')
+    parser.add_argument('--connections', type=int, nargs='+', default=[1], help='Connection counts to benchmark')
+    parser.add_argument('--dsn', help='Load into this (scratch) database instead of simulating it')
+    parser.add_argument('--latency-ms', type=float, default=200.0, help='Simulated load time per chunk without --dsn')
+    args = parser.parse_args()
+
+    for connections in args.connections:
+        sequential = run(args, connections, pipelined=False)
+        pipelined = run(args, connections, pipelined=True)
+        print(f"{args.rows:>12,} rows, {connections} connection(s) | sequential: {sequential['seconds']:8.2f}s | "
+              f"pipelined: {pipelined['seconds']:8.2f}s ({sequential['seconds'] / pipelined['seconds']:.2f}x) | "
+              f"transform: {pipelined['transform_seconds']:.2f}s, load: {pipelined['load_seconds']:.2f}s | "
+              f"overlap efficiency: {pipelined['overlap_efficiency']:.0%} | "
+              f"chunk latency avg/max: {pipelined['chunk_latency_avg']:.2f}s/{pipelined['chunk_latency_max']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
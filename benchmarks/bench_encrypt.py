@@ -0,0 +1,94 @@
+"""Benchmark the row-by-row vs. columnar encryption paths of transform_data.
+
+Usage (from the repository root):
+    python benchmarks/bench_encrypt.py --rows 1000000 10000000
+    python benchmarks/bench_encrypt.py --rows 1000000 --aes-workers 1 2 4 8
+
+With --aes-workers the AES-GCM engine (etl/encryption.py) is timed at each worker count
+and reported as MB/s of plaintext and rows/s, in total and per core. A random key is used
+unless IAM_ETL_ENCRYPTION_KEY is set.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from etl.encryption import EncryptionEngine, KEY_ENV, generate_key
+from etl.transform import encode_data, encrypt_columns, ciphertext_column, ENCRYPTED_COLUMNS
+
+
+def make_frame(n_rows, seed=42):
+    """Build a frame with the same shape of data as extract_data."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'monthly_rate': rng.choice([50, 120, 320, 520], size=n_rows),
+        'login_count': rng.integers(20, 800, size=n_rows),
+        'last_login_days': rng.integers(1, 400, size=n_rows),
+        'data_type': rng.choice(['encrypted', 'non-encrypted'], size=n_rows, p=[0.3, 0.7]),
+    })
+
+
+def encrypt_row_by_row(df):
+    """The previous implementation: one df.apply(axis=1) per column."""
+    for column in ENCRYPTED_COLUMNS:
+        df[column] = df.apply(
+            lambda row: encode_data(row[column]) if row['data_type'] == 'encrypted' else row[column], axis=1)
+    return df
+
+
+def plaintext_mb(df):
+    """Size of the values that get encrypted, as encode_data would write them."""
+    encrypted = df[df['data_type'] == 'encrypted']
+    return sum(encrypted[column].astype(str).str.len().sum() for column in ENCRYPTED_COLUMNS) / 2**20
+
+
+def verify(df, engine, sample=1000):
+    """Decrypt a sample of the ciphertexts and compare them with the original values."""
+    original = make_frame(len(df))
+    rows = df.index[df['data_type'] == 'encrypted'][:sample]
+    for column in ENCRYPTED_COLUMNS:
+        decrypted = engine.decrypt(df.loc[rows, ciphertext_column(column)].tolist(), column)
+        if list(decrypted) != original.loc[rows, column].astype(str).tolist():
+            raise AssertionError(f"Decrypted '{column}' values do not match the originals")
+
+
+def timed(func, df):
+    start = time.perf_counter()
+    func(df)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark encryption in transform_data")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000], help='Row counts to benchmark')
+    parser.add_argument('--skip-row-by-row', action='store_true', help='Only time the columnar path (the old path takes minutes at 10M rows)')
+    parser.add_argument('--aes-workers', type=int, nargs='*', default=[], help='Also time AES-GCM encryption with these worker counts')
+    args = parser.parse_args()
+    key = os.environ.get(KEY_ENV) or generate_key()
+
+    for n_rows in args.rows:
+        columnar = timed(encrypt_columns, make_frame(n_rows))
+        line = f"{n_rows:>12,} rows | columnar: {columnar:8.2f}s ({n_rows / columnar:,.0f} rows/s)"
+        if not args.skip_row_by_row:
+            row_by_row = timed(encrypt_row_by_row, make_frame(n_rows))
+            line += f" | row-by-row: {row_by_row:8.2f}s | speedup: {row_by_row / columnar:.1f}x"
+        print(line)
+
+        megabytes = plaintext_mb(make_frame(n_rows))
+        for workers in args.aes_workers:
+            df = make_frame(n_rows)
+            with EncryptionEngine(key, workers=workers) as engine:
+                seconds = timed(lambda frame: encrypt_columns(frame, engine=engine), df)
+                verify(df, engine)
+            print(f"{'':>12}      | aes-gcm x{workers:<2}: {seconds:8.2f}s | {megabytes / seconds:8.2f} MB/s "
+                  f"({megabytes / seconds / workers:.2f} per core) | {n_rows / seconds:,.0f} rows/s "
+                  f"({n_rows / seconds / workers:,.0f} per core)")
+
+
+if __name__ == "__main__":
+    main()
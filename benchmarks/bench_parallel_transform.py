@@ -0,0 +1,56 @@
+"""Benchmark transform_data against the multi-process transform at 1..N workers.
+
+Usage (from the repository root):
+    python benchmarks/bench_parallel_transform.py --rows 1000000 --workers 1 2 4 8
+
+Every run writes to its own temporary directory with snapshots off; each parallel result
+is checked to be identical to the single-process one. Speedup and efficiency are relative
+to transform_data, so they include the cost of sharing the input and merging the outputs.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from etl.extract import iter_chunks
+from etl.parallel_transform import transform_parallel
+from etl.transform import transform_data
+
+
+def timed(func, df, **kwargs):
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        result = func(df.copy(), output_dir=output_dir, snapshot_level='off', **kwargs)
+        return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parallel transform")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000], help='Row counts to benchmark')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1], help='Worker counts to time')
+    parser.add_argument('--skip-verify', action='store_true', help="Don't compare the outputs with transform_data")
+    args = parser.parse_args()
+    print(f"{os.cpu_count()} CPUs available")
+
+    for n_rows in args.rows:
+        df = pd.concat(iter_chunks(n_rows, 1_000_000))
+        baseline, expected = timed(transform_data, df)
+        print(f"{n_rows:>12,} rows | transform_data: {baseline:8.2f}s ({n_rows / baseline:,.0f} rows/s)")
+        for workers in sorted(set(args.workers)):
+            seconds, result = timed(transform_parallel, df, workers=workers)
+            if not args.skip_verify:
+                for left, right in zip(expected, result):
+                    assert_frame_equal(left, right, check_exact=True)
+            speedup = baseline / seconds
+            print(f"{'':>12} {workers:>4} workers | {seconds:8.2f}s ({n_rows / seconds:,.0f} rows/s) | "
+                  f"speedup: {speedup:.2f}x | efficiency: {speedup / workers:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Benchmark extract_data, transform_data and the bulk loader at several data scales.
+
+Usage (from the repository root):
+    python benchmarks/bench_pipeline.py                           # 1K, 100K, 1M and 10M rows
+    python benchmarks/bench_pipeline.py --sizes 1000 100000 --save-baseline
+    python benchmarks/bench_pipeline.py --dsn postgresql://localhost/iam_etl_bench
+
+Each run is compared with the stored baseline (benchmarks/baselines.json) and the script
+exits with status 1 when any benchmark's rows/sec dropped by more than --threshold.
+Without --dsn the loader writes to an in-process fake cursor that records statements,
+which measures everything the loader does except the database itself.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from etl.extract import extract_data
+from etl.load import bulk_load
+from etl.metrics import PipelineMetrics
+from etl.transform import transform_data
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000, 10_000_000]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+
+class RecordingCursor:
+    """Stands in for a psycopg2 cursor: records statements and drains COPY buffers."""
+
+    def __init__(self):
+        self.statements = []
+        self.copied_bytes = 0
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+
+    def copy_expert(self, query, buffer):
+        self.statements.append(query)
+        self.copied_bytes += len(buffer.read())
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.cur = RecordingCursor()
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _connect(dsn):
+    if dsn is None:
+        return RecordingConnection()
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE iam_policies (
+                policy_id text PRIMARY KEY, user_id text, role text, plan_type text,
+                monthly_rate integer, premium boolean, region text, login_count integer, last_login_days integer,
+                loaded_at timestamptz
+            );
+        """)
+    conn.commit()
+    return conn
+
+
+def run_size(n_rows, workdir, dsn=None, snapshot_level='off'):
+    """Run extract, transform and load once at n_rows and return rows/sec per benchmark."""
+    metrics = PipelineMetrics()
+    with metrics.stage('extract', rows_in=n_rows):
+        df = extract_data(os.path.join(workdir, 'iam_policies.csv'), n_rows=n_rows)
+    with metrics.stage('transform', rows_in=n_rows):
+        df_transformed, _, _ = transform_data(df, output_dir=workdir, fmt='csv', snapshot_level=snapshot_level)
+    conn = _connect(dsn)
+    try:
+        with metrics.stage('load', rows_in=len(df_transformed)):
+            bulk_load(conn, df_transformed)
+    finally:
+        conn.close()
+    return {record['stage']: record['rows_per_sec'] for record in metrics.to_dict()['stages']}
+
+
+def compare(results, baseline, threshold):
+    """Regressions of results against baseline: a list of (benchmark, size, baseline, current)."""
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, rows_per_sec in benchmarks.items():
+            expected = baseline.get(size, {}).get(name)
+            if expected and rows_per_sec < expected * (1 - threshold):
+                regressions.append((name, size, expected, rows_per_sec))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ETL pipeline at several data scales")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Row counts to benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per size; the best rows/sec of each benchmark counts')
+    parser.add_argument('--dsn', help='Load into this (local) Postgres instead of the recording fake cursor')
+    parser.add_argument('--snapshots', default='off', choices=['off', 'summary', 'full'], help='Debug snapshot level during transform')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file to compare with / save to')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline instead of comparing')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed throughput drop before failing (0.2 = 20%%)')
+    parser.add_argument('--output', help='Also write this run\'s results to a JSON file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_rows in args.sizes:
+            runs = [run_size(n_rows, workdir, dsn=args.dsn, snapshot_level=args.snapshots) for _ in range(args.repeat)]
+            results[str(n_rows)] = {name: max(run[name] for run in runs) for name in runs[0]}
+            print(f"{n_rows:>12,} rows | " + " | ".join(
+                f"{name}: {rows_per_sec:,.0f} rows/s" for name, rows_per_sec in results[str(n_rows)].items()))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.threshold)
+    for name, size, expected, current in regressions:
+        print(f"REGRESSION {name} at {int(size):,} rows: {current:,.0f} rows/s vs baseline {expected:,.0f} rows/s")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions beyond {args.threshold:.0%} of the baseline.")
+
+
+if __name__ == "__main__":
+    main()
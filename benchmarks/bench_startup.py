@@ -0,0 +1,63 @@
+"""Measure the CLI's startup time against its budget.
+
+Usage (from the repository root):
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --budget-ms 80
+
+Every command runs --runs times in a fresh interpreter from etl/ (as the scheduler runs
+it), after one warm-up run that compiles the bytecode. Wall time is the whole process;
+startup imports are what the CLI imports itself, from -X importtime (see cli.py). Exits
+with 1 when the median startup imports of any command exceed the budget.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ETL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'etl')
+sys.path.insert(0, ETL_DIR)
+
+from cli import DEFAULT_STARTUP_BUDGET_MS, STARTUP_BUDGET_ENV, import_breakdown, parse_importtime
+
+COMMANDS = [
+    ['cli.py', '--help'],
+    ['cli.py', 'load', '--help'],
+    ['cli.py', 'run', '--help'],
+    ['run_all.py', '--help'],
+]
+
+
+def measure(command):
+    """(wall ms, startup import ms) of one run of an etl/ script."""
+    start = time.perf_counter()
+    child = subprocess.run([sys.executable, '-X', 'importtime', *command], cwd=ETL_DIR,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    _, imports = parse_importtime(child.stderr)
+    return wall_ms, import_breakdown(imports)[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CLI startup time")
+    parser.add_argument('--runs', type=int, default=10, help='Runs per command')
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get(STARTUP_BUDGET_ENV, DEFAULT_STARTUP_BUDGET_MS)),
+                        help='Startup import budget (default: $IAM_ETL_STARTUP_BUDGET_MS or 100)')
+    args = parser.parse_args()
+
+    over = []
+    for command in COMMANDS:
+        measure(command)  # Warm-up: compiles the .pyc files
+        runs = [measure(command) for _ in range(args.runs)]
+        wall = statistics.median(run[0] for run in runs)
+        imports = statistics.median(run[1] for run in runs)
+        print(f"{' '.join(command):<24} | wall: {wall:7.1f} ms | imports: {imports:7.1f} ms")
+        if imports > args.budget_ms:
+            over.append(' '.join(command))
+    print(f"Budget: {args.budget_ms:.0f} ms of startup imports: {'exceeded by ' + ', '.join(over) if over else 'met'}")
+    sys.exit(1 if over else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,43 @@
+"""IAM policies ETL as an Airflow DAG.
+
+Extract writes the synthetic data as partitioned columnar files; only their paths travel
+through XCom. Transform and load are mapped over the partitions (one task instance per
+partition, running in parallel), and merge_aggregates combines the per-partition region
+sums and counts into reshaped_iam_policies.
+
+Run it once against local files and a local Postgres, without a scheduler:
+    IAM_ETL_DSN=postgresql://localhost/iam_etl python dags/iam_etl_dag.py
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
 from airflow import DAG
 from airflow.operators.python import PythonOperator
-from airflow.utils.dates import days_ago
-from datetime import timedelta
-import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
 # --- Importing your custom functions ---
-from etl.extract import extract_data  # Assuming you have a function in extract.py
-from etl.transform import transform_data  # Assuming you have a function in transform.py
-from etl.load import load_data_to_postgres  # Assuming you have a function in load.py
+from etl.extract import extract_partitions
+from etl.transform import transform_data, RegionAggregator, write_reshaped
+from etl.db_pool import get_pool
+from etl.load import ensure_loaded_at, load_data_bulk, load_columns
+from etl.storage import frame_path, read_frame, write_frame
+from etl import metrics  # Per-task stage timings, written next to the data as JSON
+
+# Every run works in its own directory below DATA_DIR, e.g. IAM_ETL_DAG_DATA_DIR=/srv/iam_etl/runs
+DATA_DIR = os.environ.get('IAM_ETL_DAG_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'dag_runs'))
+ROWS = int(os.environ.get('IAM_ETL_DAG_ROWS', 10))
+PARTITIONS = int(os.environ.get('IAM_ETL_DAG_PARTITIONS', 4))
+FORMAT = 'parquet'  # Typed and compressed; every task reads only the columns it needs
+
+def run_dir(run_id):
+    """Directory of one DAG run (run ids contain ':' and '+', which are awkward in paths)."""
+    return os.path.join(DATA_DIR, ''.join(c if c.isalnum() or c in '-_.' else '_' for c in run_id))
+
+def write_metrics(run_metrics, directory, task):
+    # Each task (and each partition of a mapped task) writes its stage metrics to its own file
+    run_metrics.write_json(os.path.join(directory, f'{task}_metrics.json'))
 
 # Define default arguments for the DAG
 default_args = {
@@ -21,59 +51,91 @@ with DAG(
     'etl',  # The name of the DAG
     default_args=default_args,
     description='ETL Pipeline for Supabase',
-    schedule_interval='* * * * *',  # Run every minute
+    schedule='* * * * *',  # Run every minute
     catchup=False,
-    start_date=days_ago(1),
+    max_active_runs=1,  # A run takes longer than a minute at scale; don't stack them up
+    start_date=datetime(2024, 1, 1),
 ) as dag:
 
-    # Step 1: Extract data (Assuming extract.py has a function called `extract_data`)
-    def extract():
-        try:
-            # Extract the data using the function from `extract.py`
-            df = extract_data("iam_policies.csv")  # Replace with your actual extract logic
-            return df
-        except Exception as e:
-            print(f"Error in extraction: {e}")
-            raise
+    # Step 1: Extract the data into PARTITIONS files and pass on their paths
+    def extract(run_id):
+        directory = run_dir(run_id)
+        run_metrics = metrics.reset()
+        with metrics.stage('extract') as step:
+            paths = extract_partitions(directory, n_rows=ROWS, partitions=PARTITIONS, fmt=FORMAT)
+            step['rows_out'] = ROWS
+        write_metrics(run_metrics, directory, 'extract')
+        # One dict per partition: the op_kwargs of the mapped transform task
+        return [{'partition': partition, 'path': path} for partition, path in enumerate(paths)]
 
     extract_task = PythonOperator(
         task_id='extract_data',  # Task ID
         python_callable=extract,  # Function to run
-        dag=dag,
     )
 
-    # Step 2: Transform data (Assuming transform.py has a function called `transform_data`)
-    def transform(df):
-        try:
-            # Transform the data using the function from `transform.py`
-            df_transformed, df_sampled, df_reshaped = transform_data(df)
-            return df_transformed, df_sampled, df_reshaped
-        except Exception as e:
-            print(f"Error in transformation: {e}")
-            raise
-
-    transform_task = PythonOperator(
-        task_id='transform_data',  # Task ID
-        python_callable=transform,  # Function to run
-        op_args=[extract_task.output],  # Pass the output of the extract task to transform
-        dag=dag,
-    )
+    # Step 2: Transform one partition (mapped: one task instance per partition)
+    def transform(partition, path):
+        directory = os.path.join(os.path.dirname(path), f'part-{partition:04d}')
+        os.makedirs(directory, exist_ok=True)
+        run_metrics = metrics.reset()
+        df = read_frame(path)
+        with metrics.stage('transform', rows_in=len(df)) as step:
+            # Region sums and counts of this partition (before encryption), merged by merge_aggregates
+            aggregator = RegionAggregator()
+            aggregator.update(df)
+            partials = write_frame(aggregator.partials(), frame_path(directory, 'region_partials', FORMAT))
+            df_transformed, _, _ = transform_data(df, output_dir=directory, fmt=FORMAT, snapshot_level='off')
+            step['rows_out'] = len(df_transformed)
+        write_metrics(run_metrics, directory, 'transform')
+        return {'partition': partition, 'transformed': frame_path(directory, 'transformed', FORMAT), 'partials': partials}
+
+    transform_task = PythonOperator.partial(
+        task_id='transform_data',
+        python_callable=transform,
+    ).expand(op_kwargs=extract_task.output)
+
+    # Step 3: Load one partition (mapped). Partitions hold disjoint policy_ids, so they load in parallel.
+    def load(partition, transformed, partials):
+        directory = os.path.dirname(transformed)
+        run_metrics = metrics.reset()
+        df_transformed = read_frame(transformed, columns=load_columns())
+        with get_pool().connection() as conn:
+            ensure_loaded_at(conn)  # Tables created before loaded_at existed get the column once
+        with metrics.stage('load', rows_in=len(df_transformed)):
+            stats = load_data_bulk(df_transformed)  # COPY into a staging table + one merge
+        write_metrics(run_metrics, directory, 'load')
+        if stats is None:
+            raise RuntimeError(f"Loading partition {partition} failed, see the task log")
+        return stats
 
-    # Step 3: Load data (Assuming load.py has a function called `load_data_to_postgres`)
-    def load(df_transformed):
-        try:
-            # Load the transformed data using the function from `load.py`
-            load_data_to_postgres(df_transformed, 'iam_policies')  # Example table name
-        except Exception as e:
-            print(f"Error in loading data: {e}")
-            raise
-
-    load_task = PythonOperator(
-        task_id='load_data',  # Task ID
-        python_callable=load,  # Function to run
-        op_args=[transform_task.output],  # Pass the output of the transform task to load
-        dag=dag,
+    load_task = PythonOperator.partial(
+        task_id='load_data',
+        python_callable=load,
+    ).expand(op_kwargs=transform_task.output)
+
+    # Step 4: Merge the per-partition aggregates into the region means
+    def merge_aggregates(results, run_id):
+        directory = run_dir(run_id)
+        run_metrics = metrics.reset()
+        results = list(results)
+        with metrics.stage('merge_aggregates', rows_in=len(results)) as step:
+            aggregator = RegionAggregator.from_partials(read_frame(result['partials']) for result in results)
+            df_reshaped = aggregator.result()
+            path = frame_path(directory, 'reshaped_iam_policies', FORMAT)
+            write_reshaped(df_reshaped, path)
+            step['rows_out'] = len(df_reshaped)
+        write_metrics(run_metrics, directory, 'merge_aggregates')
+        return path
+
+    merge_task = PythonOperator(
+        task_id='merge_aggregates',
+        python_callable=merge_aggregates,
+        op_args=[transform_task.output],  # The results of every transform partition
     )
 
-    # Step 4: Define the task dependencies (this ensures the tasks run in the correct order)
-    extract_task >> transform_task >> load_task  # Extraction happens first, then transformation, and finally loading.
+    # Step 5: Define the task dependencies: extract, then every partition's transform,
+    # then the loads (per partition) and the aggregate merge (once all partitions are done)
+    extract_task >> transform_task >> [load_task, merge_task]
+
+if __name__ == "__main__":
+    dag.test()
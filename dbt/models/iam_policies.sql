@@ -1,4 +1,20 @@
 -- models/iam_policies.sql
+-- Incremental: a run only reads the rows the loader inserted or changed since the previous
+-- run (loaded_at, set by etl/load.py) and merges them into the table by policy_id.
+-- Rows loaded before the loaded_at column existed need one `dbt run --full-refresh`.
+{{
+    config(
+        materialized='incremental',
+        unique_key='policy_id',
+        on_schema_change='append_new_columns',
+        post_hook=[
+            "CREATE INDEX IF NOT EXISTS {{ this.identifier }}_region_idx ON {{ this }} (region)",
+            "CREATE INDEX IF NOT EXISTS {{ this.identifier }}_role_idx ON {{ this }} (role)",
+            "CREATE INDEX IF NOT EXISTS {{ this.identifier }}_plan_type_idx ON {{ this }} (plan_type)",
+            "CREATE INDEX IF NOT EXISTS {{ this.identifier }}_dbt_run_at_idx ON {{ this }} (dbt_run_at)",
+        ]
+    )
+}}
 WITH base_data AS (
     SELECT
         policy_id,
@@ -6,7 +22,15 @@ WITH base_data AS (
         role,
         plan_type,
         monthly_rate,
-        premium
+        premium,
+        region,
+        loaded_at,
+        '{{ run_started_at }}'::timestamptz AS dbt_run_at  -- Marks the increment each run adds (see tests/)
     FROM {{ source('public', 'iam_policies') }}  -- Reference the source table here
+    {% if is_incremental() %}
+    -- >= rather than >: rows of a load sharing the newest timestamp may have been committed
+    -- after the last run read them; merging them again by policy_id is harmless
+    WHERE loaded_at >= (SELECT coalesce(max(loaded_at), '-infinity') FROM {{ this }})
+    {% endif %}
 )
 SELECT * FROM base_data
@@ -1,4 +1,9 @@
 -- tests/iam_policies_premium_not_null.sql
+-- Only checks the increment added by the latest run of the model (see dbt_run_at in
+-- models/iam_policies.sql); `dbt test --vars '{full_test: true}'` checks every row
 SELECT *
 FROM {{ ref('iam_policies') }}  -- Reference the 'iam_policies' model created in 'models/iam_policies.sql'
 WHERE premium IS NULL
+{% if not var('full_test', false) %}
+  AND dbt_run_at = (SELECT max(dbt_run_at) FROM {{ ref('iam_policies') }})
+{% endif %}
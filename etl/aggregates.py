@@ -0,0 +1,227 @@
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+
+import pandas as pd
+
+try:
+    from etl.change_index import hash_rows
+except ImportError:  # Running from inside etl/ (run_all.py imports modules directly)
+    from change_index import hash_rows
+
+logger = logging.getLogger('iam_etl.aggregates')
+
+# Where the aggregate store lives, e.g. IAM_ETL_AGGREGATES=/var/lib/iam_etl/aggregates.sqlite
+AGGREGATES_ENV = 'IAM_ETL_AGGREGATES'
+DEFAULT_AGGREGATES_PATH = '../data/aggregates.sqlite'
+
+# Cube cells are keyed by these columns; every measure gets rows/sum/count/min/max per cell
+DIMENSIONS = ['region', 'role', 'plan_type']
+MEASURES = ['monthly_rate', 'login_count', 'last_login_days']
+STATISTICS = ['rows', 'sum', 'count', 'min', 'max', 'mean']
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS cells (
+    region TEXT NOT NULL, role TEXT NOT NULL, plan_type TEXT NOT NULL, measure TEXT NOT NULL,
+    rows INTEGER NOT NULL, sum NUMERIC NOT NULL, count INTEGER NOT NULL, min NUMERIC, max NUMERIC,
+    PRIMARY KEY (region, role, plan_type, measure)
+);
+CREATE TABLE IF NOT EXISTS members (
+    policy_id TEXT PRIMARY KEY, row_hash INTEGER NOT NULL,
+    {', '.join(f'{column} TEXT NOT NULL' for column in DIMENSIONS)},
+    {', '.join(f'{column} NUMERIC' for column in MEASURES)}
+);
+CREATE INDEX IF NOT EXISTS members_cell ON members ({', '.join(DIMENSIONS)});
+CREATE TABLE IF NOT EXISTS batches (
+    fingerprint TEXT PRIMARY KEY, rows INTEGER NOT NULL, applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+def batch_fingerprint(policy_ids, hashes):
+    """Order-independent fingerprint of a batch of rows, used to never apply the same batch twice."""
+    pairs = pd.DataFrame({'policy_id': policy_ids, 'row_hash': hashes}).sort_values(['policy_id', 'row_hash'])
+    digest = hashlib.sha256(pd.util.hash_pandas_object(pairs, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def _cell_stats(df):
+    """rows/sum/count/min/max of every measure per cube cell, one row per (cell, measure)."""
+    if df.empty:
+        return pd.DataFrame(columns=DIMENSIONS + ['measure', 'rows', 'sum', 'count', 'min', 'max'])
+    grouped = df.groupby(DIMENSIONS, sort=False)
+    rows = grouped.size()
+    frames = []
+    for measure in MEASURES:
+        stats = grouped[measure].agg(['sum', 'count', 'min', 'max'])
+        stats.insert(0, 'rows', rows)
+        stats.insert(0, 'measure', measure)
+        frames.append(stats.reset_index())
+    return pd.concat(frames, ignore_index=True)
+
+def _reaches(value, extreme, direction):
+    """Whether a retracted value is at (or beyond) the cell's current min (-1) or max (1)."""
+    if value is None:
+        return False
+    if extreme is None:
+        return True
+    return (value - extreme) * direction >= 0
+
+def _records(df):
+    """Plain Python rows for sqlite3 (NaN -> NULL, numpy scalars -> int/float)."""
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+class AggregateStore:
+    """Persistent sum/count/min/max per (region, role, plan_type) cube cell.
+
+    ``update()`` folds a batch of rows into the cells. Only the delta is applied: rows
+    whose values are already reflected are skipped, rows that changed since they were
+    added are retracted first, and a batch seen before (same fingerprint) is skipped
+    without staging it, so re-running a step never counts rows twice. A batch that
+    replaces older values forgets the earlier fingerprints, so replaying old data still
+    reverts it. Each policy's last aggregated values are kept in ``members`` to make this
+    possible; like the extracted files, the store file holds plaintext values. ``rollup()`` answers any roll-up from the cells alone.
+    """
+
+    def __init__(self, path=None):
+        self.path = str(path or os.environ.get(AGGREGATES_ENV, DEFAULT_AGGREGATES_PATH))
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL;")
+        with self.db:
+            self.db.executescript(SCHEMA)
+        self.stats = {'batches': 0, 'skipped_batches': 0, 'rows_added': 0, 'rows_retracted': 0, 'rows_unchanged': 0}
+
+    def _prepare(self, df):
+        """policy_id, dimensions as text and numeric measures; the last row per policy_id wins."""
+        rows = pd.DataFrame({'policy_id': df['policy_id'].astype(str).to_numpy()})
+        for column in DIMENSIONS:
+            values = df[column].astype(object).to_numpy()
+            rows[column] = pd.Series(values).where(pd.notna(values), '').astype(str).to_numpy()
+        for column in MEASURES:
+            rows[column] = pd.to_numeric(pd.Series(df[column].to_numpy()), errors='coerce').astype(float)
+        return rows.drop_duplicates('policy_id', keep='last')
+
+    def update(self, df, fingerprint=None):
+        """Fold the new and changed rows of df into the cube. Returns False if the batch was applied before."""
+        rows = self._prepare(df)
+        hashes = hash_rows(rows, DIMENSIONS + MEASURES)
+        fingerprint = fingerprint or batch_fingerprint(rows['policy_id'], hashes)
+        if self.db.execute("SELECT 1 FROM batches WHERE fingerprint = ?;", (fingerprint,)).fetchone():
+            self.stats['skipped_batches'] += 1
+            logger.info(f"Aggregate store: batch {fingerprint[:12]} was applied before, skipping {len(rows)} rows.")
+            return False
+
+        rows.insert(1, 'row_hash', hashes)
+        # One transaction: cells, members and the batch record always move together
+        with self.db:
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS incoming AS SELECT * FROM members WHERE 0;")
+            self.db.execute("DELETE FROM incoming;")
+            self.db.executemany(f"INSERT INTO incoming VALUES ({', '.join('?' * rows.shape[1])});", _records(rows))
+
+            unchanged = set(row[0] for row in self.db.execute(
+                "SELECT policy_id FROM incoming JOIN members USING (policy_id) WHERE members.row_hash = incoming.row_hash;"))
+            retracted = pd.read_sql_query(
+                "SELECT members.* FROM members JOIN incoming USING (policy_id) WHERE members.row_hash != incoming.row_hash;",
+                self.db)
+            added = rows[~rows['policy_id'].isin(unchanged)]
+
+            stale = self._retract(_cell_stats(retracted))
+            self.db.execute("""
+                INSERT OR REPLACE INTO members SELECT incoming.* FROM incoming LEFT JOIN members USING (policy_id)
+                WHERE members.row_hash IS NULL OR members.row_hash != incoming.row_hash;
+            """)
+            self._add(_cell_stats(added))
+            self._refresh_extremes(stale)
+            self.db.execute("DELETE FROM cells WHERE rows <= 0;")
+            if len(retracted):
+                # Earlier batches are no longer fully reflected, so replaying one must not be skipped
+                self.db.execute("DELETE FROM batches;")
+            self.db.execute("INSERT INTO batches (fingerprint, rows) VALUES (?, ?);", (fingerprint, len(rows)))
+
+        self.stats['batches'] += 1
+        self.stats['rows_added'] += len(added)
+        self.stats['rows_retracted'] += len(retracted)
+        self.stats['rows_unchanged'] += len(unchanged)
+        logger.info(f"Aggregate store: {len(added)} rows added ({len(retracted)} of them replacing older values), "
+                    f"{len(unchanged)} unchanged rows skipped.")
+        return True
+
+    def _add(self, stats):
+        self.db.executemany(f"""
+            INSERT INTO cells ({', '.join(DIMENSIONS)}, measure, rows, sum, count, min, max)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT ({', '.join(DIMENSIONS)}, measure) DO UPDATE SET
+                rows = rows + excluded.rows,
+                sum = sum + excluded.sum,
+                count = count + excluded.count,
+                min = MIN(COALESCE(min, excluded.min), COALESCE(excluded.min, min)),
+                max = MAX(COALESCE(max, excluded.max), COALESCE(excluded.max, max));
+        """, _records(stats))
+
+    def _retract(self, stats):
+        """Subtract rows from their cells. Returns the (cell, measure) keys whose min or max has to be recomputed."""
+        stale = []
+        key_filter = ' AND '.join(f'{column} = ?' for column in DIMENSIONS + ['measure'])
+        for record in _records(stats):
+            key, (rows, total, count, low, high) = record[:4], record[4:]
+            current = self.db.execute(f"SELECT min, max FROM cells WHERE {key_filter};", key).fetchone()
+            self.db.execute(f"UPDATE cells SET rows = rows - ?, sum = sum - ?, count = count - ? WHERE {key_filter};",
+                            (rows, total, count) + key)
+            # A retracted extreme may have been the cell's min or max: only then is a lookup needed
+            if current is not None and (_reaches(low, current[0], -1) or _reaches(high, current[1], 1)):
+                stale.append(key)
+        return stale
+
+    def _refresh_extremes(self, stale):
+        """Recompute min/max of the given cells from the members of that cell (an index lookup)."""
+        key_filter = ' AND '.join(f'{column} = ?' for column in DIMENSIONS)
+        for key in stale:
+            cell, measure = key[:3], key[3]
+            low, high = self.db.execute(f"SELECT MIN({measure}), MAX({measure}) FROM members WHERE {key_filter};", cell).fetchone()
+            self.db.execute(f"UPDATE cells SET min = ?, max = ? WHERE {key_filter} AND measure = ?;", (low, high) + cell + (measure,))
+
+    def rollup(self, by=('region',), measures=MEASURES, statistic='mean'):
+        """One statistic per measure, rolled up to the `by` dimensions (empty for the grand total).
+
+        Laid out like pivot_table: one row per group, one column per measure (alphabetical).
+        """
+        by = list(by)
+        unknown = set(by) - set(DIMENSIONS)
+        if unknown or statistic not in STATISTICS:
+            raise ValueError(f"Unknown dimensions {sorted(unknown)} or statistic {statistic!r}, "
+                             f"expected dimensions from {DIMENSIONS} and one of {STATISTICS}")
+        group = ''.join(f'{column}, ' for column in by)
+        cells = pd.read_sql_query(f"""
+            SELECT {group}measure, SUM(rows) AS rows, SUM(sum) AS sum, SUM(count) AS count, MIN(min) AS min, MAX(max) AS max
+            FROM cells WHERE measure IN ({', '.join('?' * len(measures))})
+            GROUP BY {group}measure ORDER BY {group}measure;
+        """, self.db, params=list(measures))
+        cells['mean'] = cells['sum'] / cells['count'].where(cells['count'] > 0)
+        if not by:
+            return cells.set_index('measure')[[statistic]].T.rename_axis(None, axis=1).reset_index(drop=True)
+        return cells.pivot(index=by, columns='measure', values=statistic).rename_axis(None, axis=1)
+
+    def region_means(self, measures=('monthly_rate', 'login_count')):
+        """The reshaped_iam_policies table: mean of each measure per region."""
+        return self.rollup(['region'], measures=sorted(measures))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM members;").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the local region/role/plan_type aggregate store")
+    parser.add_argument('--store', help=f'Store file (default: ${AGGREGATES_ENV} or {DEFAULT_AGGREGATES_PATH})')
+    parser.add_argument('--by', nargs='*', default=['region'], choices=DIMENSIONS, help='Dimensions to roll up to (none for the grand total)')
+    parser.add_argument('--statistic', default='mean', choices=STATISTICS, help='Statistic to report per measure')
+    args = parser.parse_args()
+
+    store = AggregateStore(args.store)
+    print(f"{store.path}: {len(store)} policies aggregated.")
+    print(store.rollup(args.by, statistic=args.statistic).to_string())
+    store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+import time
+
+try:
+    from etl import metrics
+    from etl.db_pool import DSN_ENV
+    from etl.load import build_merge_query, load_columns, partition_frame, prepare_for_load
+except ImportError:  # Running from inside etl/
+    import metrics
+    from db_pool import DSN_ENV
+    from load import build_merge_query, load_columns, partition_frame, prepare_for_load
+
+logger = logging.getLogger('iam_etl.async_load')
+
+# Transformed chunks that may wait per connection before the transform blocks (backpressure):
+# memory stays at about (QUEUE_CHUNKS + 1) chunks per connection however large the input is
+QUEUE_CHUNKS = 4
+
+def _psycopg():
+    try:
+        import psycopg
+    except ImportError as e:
+        raise ImportError("The pipelined loader needs psycopg 3 (pip install 'psycopg[binary]')") from e
+    return psycopg
+
+async def _load_chunk(conn, df, columns, on_conflict, key, table='iam_policies', staging='iam_policies_staging'):
+    """COPY one chunk into a temporary staging table and merge it, in one transaction. Returns rows written."""
+    sql = _psycopg().sql
+    async with conn.transaction():
+        async with conn.pipeline():  # Both setup statements in one round trip (COPY itself can't be pipelined)
+            await conn.execute(sql.SQL("CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;").format(
+                staging=sql.Identifier(staging), table=sql.Identifier(table)))
+            await conn.execute(sql.SQL("ALTER TABLE {staging} ADD COLUMN load_seq bigserial;").format(staging=sql.Identifier(staging)))
+        async with conn.cursor() as cur:
+            copy_query = sql.SQL("COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)").format(
+                staging=sql.Identifier(staging), columns=sql.SQL(', ').join(map(sql.Identifier, columns)))
+            async with cur.copy(copy_query) as copy:
+                await copy.write(df.to_csv(index=False, header=False))
+            await cur.execute(build_merge_query(columns, on_conflict=on_conflict, table=table, staging=staging, key=key, sql=sql))
+            return cur.rowcount
+
+async def _consume(conn, queue, columns, on_conflict, key, stats):
+    """Load the chunks of one queue in order until the producer's None.
+
+    After a failure the queue is still drained (without loading), so the transform is
+    never left blocked on a full queue; the first error is re-raised at the end.
+    """
+    error = None
+    while (item := await queue.get()) is not None:
+        produced, chunk = item
+        if error is not None:
+            continue
+        start = time.perf_counter()
+        try:
+            stats['written'] += await _load_chunk(conn, prepare_for_load(chunk, columns), columns, on_conflict, key)
+        except Exception as e:
+            error = e
+            logger.error(f"Pipelined load failed, skipping the rest of this connection's chunks: {e}")
+            continue
+        end = time.perf_counter()
+        stats['load_seconds'] += end - start
+        stats['rows'] += len(chunk)
+        stats['chunks'] += 1
+        stats['latencies'].append(end - produced)
+    if error is not None:
+        raise error
+
+async def load_pipelined(produce, dsn=None, connections=1, queue_chunks=QUEUE_CHUNKS, on_conflict='nothing',
+                         key=None, connect=None):
+    """Load transformed chunks while they are still being produced.
+
+    `produce(on_chunk)` runs in a worker thread and calls `on_chunk(df)` for every
+    transformed chunk (e.g. transform_stream's on_chunk); its return value is returned
+    with the stats. Chunks are hash-partitioned by policy_id over `connections` async
+    connections, each with a bounded queue: a full queue blocks the producer, so memory
+    stays bounded. Each chunk is COPY'd and merged in its own transaction, in order per
+    connection, so duplicates resolve like a serial load.
+
+    The stats compare the run with doing the same work one step after the other:
+    overlap_efficiency is the share of the shorter step that was hidden behind the
+    longer one (1.0: fully overlapped), sequential_seconds the transform plus load time.
+    """
+    psycopg = None if connect is not None else _psycopg()
+    connect = connect or (lambda: psycopg.AsyncConnection.connect(os.environ.get(DSN_ENV, '') if dsn is None else dsn))
+    columns = load_columns(on_conflict, key)
+    loop = asyncio.get_running_loop()
+    queues = [asyncio.Queue(maxsize=queue_chunks) for _ in range(connections)]
+    per_connection = [{'rows': 0, 'written': 0, 'chunks': 0, 'load_seconds': 0.0, 'latencies': []} for _ in range(connections)]
+    blocked = [0.0]
+
+    def on_chunk(chunk):
+        produced = time.perf_counter()
+        parts = partition_frame(chunk, connections) if connections > 1 else [chunk]
+        for queue, part in zip(queues, parts):
+            if len(part):
+                asyncio.run_coroutine_threadsafe(queue.put((produced, part)), loop).result()  # Waits while the queue is full
+        blocked[0] += time.perf_counter() - produced
+
+    async def producer():
+        try:
+            return await asyncio.to_thread(produce, on_chunk)
+        finally:
+            for queue in queues:
+                await queue.put(None)
+
+    start = time.perf_counter()
+    conns = [await connect() for _ in range(connections)]
+    try:
+        with metrics.stage('pipelined_load') as step:
+            results = await asyncio.gather(
+                producer(), *(_consume(conn, queue, columns, on_conflict, key, stats)
+                              for conn, queue, stats in zip(conns, queues, per_connection)),
+                return_exceptions=True)
+            step['rows_out'] = sum(stats['rows'] for stats in per_connection)
+    finally:
+        for conn in conns:
+            await conn.close()
+    for outcome in results:
+        if isinstance(outcome, BaseException):
+            raise outcome
+
+    wall = time.perf_counter() - start
+    transform_seconds = wall - blocked[0]  # The producer thread's time minus the time it waited for the loader
+    load_seconds = max(stats['load_seconds'] for stats in per_connection)  # The busiest connection bounds the load
+    latencies = sorted(latency for stats in per_connection for latency in stats['latencies'])
+    shorter = min(transform_seconds, load_seconds)
+    stats = {
+        'rows': sum(stats['rows'] for stats in per_connection),
+        'written': sum(stats['written'] for stats in per_connection),
+        'chunks': sum(stats['chunks'] for stats in per_connection),
+        'connections': connections,
+        'seconds': round(wall, 3),
+        'transform_seconds': round(transform_seconds, 3),
+        'load_seconds': round(load_seconds, 3),
+        'producer_blocked_seconds': round(blocked[0], 3),
+        'sequential_seconds': round(transform_seconds + load_seconds, 3),
+        'overlap_efficiency': round(min(max((transform_seconds + load_seconds - wall) / shorter, 0.0), 1.0), 3) if shorter > 0 else None,
+        'chunk_latency_avg': round(sum(latencies) / len(latencies), 3) if latencies else None,
+        'chunk_latency_max': round(latencies[-1], 3) if latencies else None,
+    }
+    logger.info(f"Pipelined load: {stats['rows']} rows ({stats['written']} written) in {stats['seconds']}s, "
+                f"{stats['sequential_seconds']}s one step after the other, overlap efficiency {stats['overlap_efficiency']}.")
+    return results[0], stats
+
+def transform_and_load(chunks, dsn=None, connections=1, queue_chunks=QUEUE_CHUNKS, on_conflict='nothing', **transform_options):
+    """transform_stream over `chunks` with its output loaded concurrently. Returns (transform result, load stats)."""
+    try:
+        from etl.transform import transform_stream
+    except ImportError:  # Running from inside etl/
+        from transform import transform_stream
+
+    def produce(on_chunk):
+        return transform_stream(chunks, on_chunk=on_chunk, **transform_options)
+
+    return asyncio.run(load_pipelined(produce, dsn=dsn, connections=connections, queue_chunks=queue_chunks, on_conflict=on_conflict))
@@ -0,0 +1,125 @@
+import argparse
+import logging
+import os
+import sqlite3
+
+import pandas as pd
+
+logger = logging.getLogger('iam_etl.change_index')
+
+# Where the row-hash index lives, e.g. IAM_ETL_CHANGE_INDEX=/var/lib/iam_etl/row_hashes.sqlite
+INDEX_ENV = 'IAM_ETL_CHANGE_INDEX'
+DEFAULT_INDEX_PATH = '../data/row_hashes.sqlite'
+
+# Rows per round trip when reading iam_policies back for a rebuild
+REBUILD_FETCH_ROWS = 100_000
+
+def hash_rows(df, columns):
+    """One 64-bit hash per row over the given columns (vectorized, stored as signed for SQLite)."""
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy().view('int64')
+
+class ChangeIndex:
+    """Persistent policy_id -> row hash index of what has already been loaded into iam_policies.
+
+    ``split()`` compares a frame against the index and returns only the new or changed rows,
+    so unchanged rows never leave the machine. ``record()`` stores the hashes once those rows
+    have been committed to the database. Hit/miss counts are kept in ``stats``.
+    """
+
+    def __init__(self, path=None):
+        self.path = str(path or os.environ.get(INDEX_ENV, DEFAULT_INDEX_PATH))
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL;")
+        self.db.execute("CREATE TABLE IF NOT EXISTS row_hashes (policy_id TEXT PRIMARY KEY, row_hash INTEGER NOT NULL);")
+        self.stats = {'hits': 0, 'new': 0, 'changed': 0}
+
+    def _stage(self, policy_ids, hashes):
+        """Put (policy_id, hash) pairs into a temporary table for set-based comparison."""
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS incoming (policy_id TEXT, row_hash INTEGER);")
+        self.db.execute("DELETE FROM incoming;")
+        self.db.executemany("INSERT INTO incoming VALUES (?, ?);", zip(policy_ids, hashes.tolist()))
+
+    def split(self, df, columns):
+        """Return (rows to send, their hashes): rows whose policy_id is new or whose hash changed."""
+        if df.empty:
+            return df, hash_rows(df, columns)
+        hashes = hash_rows(df, columns)
+        policy_ids = df['policy_id'].astype(str).tolist()
+        self._stage(policy_ids, hashes)
+        known = dict(self.db.execute("""
+            SELECT incoming.policy_id, row_hashes.row_hash = incoming.row_hash
+            FROM incoming JOIN row_hashes USING (policy_id);
+        """).fetchall())
+
+        unchanged = pd.Series(policy_ids, index=df.index).map(known).fillna(0).astype(bool).to_numpy()
+        changed = pd.Series(policy_ids, index=df.index).isin(list(known)).to_numpy() & ~unchanged
+        self.stats['hits'] += int(unchanged.sum())
+        self.stats['changed'] += int(changed.sum())
+        self.stats['new'] += int((~unchanged & ~changed).sum())
+        logger.info(f"Change index: {self.stats['hits']} unchanged rows skipped, "
+                    f"{self.stats['new']} new and {self.stats['changed']} changed rows to send.")
+        return df[~unchanged], hashes[~unchanged]
+
+    def record(self, df, hashes):
+        """Remember the hashes of rows that were committed to the database."""
+        self._stage(df['policy_id'].astype(str).tolist(), hashes)
+        with self.db:
+            # Later rows for the same policy_id win, like the DO UPDATE merge
+            self.db.execute("""
+                INSERT OR REPLACE INTO row_hashes (policy_id, row_hash)
+                SELECT policy_id, row_hash FROM incoming ORDER BY rowid;
+            """)
+
+    def rebuild_from_database(self, conn, columns, prepare=None):
+        """Replace the index with hashes of what iam_policies currently holds.
+
+        `prepare` normalizes each fetched frame the same way the loader does before hashing.
+        """
+        with self.db:
+            self.db.execute("DELETE FROM row_hashes;")
+        total = 0
+        # A named (server-side) cursor streams the table instead of fetching it all at once
+        with conn.cursor(name='change_index_rebuild') as cur:
+            cur.itersize = REBUILD_FETCH_ROWS
+            cur.execute(f"SELECT {', '.join(columns)} FROM iam_policies;")
+            while True:
+                rows = cur.fetchmany(REBUILD_FETCH_ROWS)
+                if not rows:
+                    break
+                df = pd.DataFrame(rows, columns=columns)
+                if prepare is not None:
+                    df = prepare(df, columns)
+                self.record(df, hash_rows(df, columns))
+                total += len(df)
+        conn.rollback()
+        logger.info(f"Change index rebuilt from the database with {total} rows.")
+        return total
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM row_hashes;").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the local row-hash index used to skip unchanged rows")
+    parser.add_argument('--index', help=f'Index file (default: ${INDEX_ENV} or {DEFAULT_INDEX_PATH})')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the index from the iam_policies table')
+    parser.add_argument('--upsert', action='store_true', help='Hash the columns of the DO UPDATE loader instead of the default ones')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    index = ChangeIndex(args.index)
+    if args.rebuild:
+        try:
+            from etl import load
+        except ImportError:  # Running from inside etl/
+            import load
+        with load.get_pool().connection() as conn:
+            columns = load.load_columns('update' if args.upsert else 'nothing')
+            index.rebuild_from_database(conn, columns, prepare=load.prepare_for_load)
+    print(f"{index.path}: {len(index)} rows indexed.")
+    index.close()
+
+if __name__ == "__main__":
+    main()
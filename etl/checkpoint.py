@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+
+import pandas as pd
+import psycopg2
+
+try:
+    from etl.db_pool import PoolTimeout
+except ImportError:  # Running from inside etl/
+    from db_pool import PoolTimeout
+
+logger = logging.getLogger('iam_etl.checkpoint')
+
+# Where the load progress is kept, e.g. IAM_ETL_LOAD_CHECKPOINT=/var/lib/iam_etl/load_checkpoint.json
+CHECKPOINT_ENV = 'IAM_ETL_LOAD_CHECKPOINT'
+DEFAULT_CHECKPOINT_PATH = '../data/load_checkpoint.json'
+
+# Retries of a failed batch: exponential backoff from BACKOFF_BASE seconds, capped at BACKOFF_MAX,
+# with full jitter so parallel loaders that failed together don't retry in lockstep
+RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+# Errors worth retrying: lost connections, serialization failures and deadlocks (all
+# OperationalError subclasses) and an exhausted pool. Anything else fails at once.
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeout)
+
+def frame_fingerprint(df, params=None):
+    """Content hash of a frame (values, columns and dtypes) plus any parameters that change the load."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps({'columns': list(map(str, df.columns)), 'dtypes': list(map(str, df.dtypes)),
+                              'params': params or {}}, sort_keys=True).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def backoff_delays(retries=RETRIES, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Seconds to wait before each retry: uniform in [0, min(cap, base * 2**attempt)]."""
+    return [random.uniform(0, min(cap, base * 2 ** attempt)) for attempt in range(retries)]
+
+def retry(func, retries=RETRIES, base=BACKOFF_BASE, cap=BACKOFF_MAX, transient=TRANSIENT_ERRORS, sleep=time.sleep):
+    """Call func() until it succeeds, retrying transient errors with backoff. Returns (result, retries used)."""
+    delays = backoff_delays(retries, base, cap)
+    for attempt in range(retries + 1):
+        try:
+            return func(), attempt
+        except transient as e:
+            if attempt == retries:
+                raise
+            logger.warning(f"Transient error ({e}); retry {attempt + 1} of {retries} in {delays[attempt]:.2f}s")
+            sleep(delays[attempt])
+
+class LoadCheckpoint:
+    """Progress of a batched load in a local JSON file, to resume it after a failure.
+
+    The state is the fingerprint of the input and how many of its rows (and batches) have
+    been committed. A load of the same input starts after the committed rows; any other
+    input starts from the beginning. Batches are idempotent by policy_id (ON CONFLICT),
+    so a batch committed just before a crash, but not recorded, is harmlessly sent again.
+    """
+
+    def __init__(self, path=None):
+        self.path = str(path or os.environ.get(CHECKPOINT_ENV, DEFAULT_CHECKPOINT_PATH))
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def resume(self, fingerprint):
+        """(rows, batches) already committed for this input; (0, 0) for a new one."""
+        state = self.read()
+        if state is None or state.get('fingerprint') != fingerprint:
+            return 0, 0
+        return state['rows_committed'], state['batches_committed']
+
+    def commit(self, fingerprint, rows_committed, batches_committed):
+        """Record committed progress (atomically: a crash leaves the old or the new state)."""
+        state = {'fingerprint': fingerprint, 'rows_committed': rows_committed,
+                 'batches_committed': batches_committed, 'updated': time.time()}
+        partial = f"{self.path}.partial-{os.getpid()}"
+        with open(partial, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(partial, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,110 @@
+"""Command line for the pipeline: one subcommand per stage, plus `run` for all of them.
+
+    python cli.py extract --rows 100000
+    python cli.py transform --format parquet --dedup first
+    python cli.py load --bulk --upsert
+    python cli.py run --rows 100000 --bulk
+    python cli.py --profile-startup load --bulk
+
+Startup is kept small for frequently scheduled runs: this module and run_all.py only
+import the standard library, and every stage imports its module (and pandas, numpy,
+psycopg2, ...) when it runs (see run_all.STAGES). `--help` of any subcommand imports
+none of them. --profile-startup re-runs the command under `python -X importtime` and
+prints where the import time went, against the startup budget.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import run_all
+
+# Import-time budget of the CLI itself (everything up to and including run_all), e.g. IAM_ETL_STARTUP_BUDGET_MS=150
+STARTUP_BUDGET_ENV = 'IAM_ETL_STARTUP_BUDGET_MS'
+DEFAULT_STARTUP_BUDGET_MS = 100
+
+PROFILE_TOP = 15
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run the ETL pipeline, a stage at a time or all of it")
+    parser.add_argument('--profile-startup', action='store_true', help='Run the command under python -X importtime and print an import-time breakdown')
+    commands = parser.add_subparsers(dest='command', required=True, metavar='{' + ','.join([*run_all.STAGES, 'run']) + '}')
+    for stage, (module, add_options) in run_all.STAGES.items():
+        command = commands.add_parser(stage, help=f'Run the {stage} stage ({module}.py)')
+        run_all.add_common_options(command)
+        add_options(command)
+    command = commands.add_parser('run', help='Run every stage: ' + ', '.join(run_all.STAGES))
+    run_all.add_common_options(command)
+    for _, add_options in run_all.STAGES.values():
+        add_options(command)
+    return parser
+
+def pipeline_args(args):
+    """The run_all options for a parsed subcommand: its own options, defaults for the other stages'."""
+    options = vars(run_all.build_parser().parse_args([]))
+    options.update((name, value) for name, value in vars(args).items() if name not in ('command', 'profile_startup'))
+    for stage in run_all.STAGES:
+        options[stage] = args.command == stage
+    options['all'] = args.command == 'run'
+    return argparse.Namespace(**options)
+
+def parse_importtime(stderr):
+    """(lines that are not import times, [(module, self us, cumulative us, depth)]) from -X importtime output."""
+    other, imports = [], []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            other.append(line)  # The command's own log output
+            continue
+        if line.startswith('import time: self'):  # Header
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(own), int(cumulative), depth))
+    return other, imports
+
+def import_breakdown(imports, top=PROFILE_TOP):
+    """Import time per top-level package (self times summed), largest first, and the total, in ms."""
+    packages = {}
+    for name, own, _, _ in imports:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + own
+    total = sum(packages.values())
+    return sorted(((package, us / 1000) for package, us in packages.items()), key=lambda item: -item[1])[:top], total / 1000
+
+def profile_startup(argv, budget_ms=None):
+    """Re-run this command under -X importtime; print its output, then the import-time breakdown."""
+    budget_ms = budget_ms or float(os.environ.get(STARTUP_BUDGET_ENV, DEFAULT_STARTUP_BUDGET_MS))
+    start = time.perf_counter()
+    child = subprocess.run([sys.executable, '-X', 'importtime', os.path.abspath(__file__), *argv],
+                           stderr=subprocess.PIPE, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    other, imports = parse_importtime(child.stderr)
+    if other:
+        print('\n'.join(other), file=sys.stderr)
+
+    # -X importtime lists a module after its own imports: up to run_all is the CLI's startup,
+    # everything after it was imported by the pipeline run
+    end = next((i + 1 for i, (name, _, _, depth) in enumerate(imports) if depth == 0 and name == 'run_all'), len(imports))
+    startup, total_ms = import_breakdown(imports[:end])
+    stages, stages_ms = import_breakdown(imports[end:])
+
+    print(f"\nStartup imports: {total_ms:.1f} ms (budget {budget_ms:.0f} ms{', OVER BUDGET' if total_ms > budget_ms else ''})")
+    for package, ms in startup:
+        print(f"  {package:<28} {ms:8.1f} ms")
+    if stages:
+        print(f"Pipeline imports: {stages_ms:.1f} ms")
+        for package, ms in stages:
+            print(f"  {package:<28} {ms:8.1f} ms")
+    print(f"Total run: {wall_ms:.0f} ms")
+    return child.returncode
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_parser().parse_args(argv)
+    if args.profile_startup:
+        sys.exit(profile_startup([arg for arg in argv if arg != '--profile-startup']))
+    run_all.run(pipeline_args(args))
+
+if __name__ == "__main__":
+    main()
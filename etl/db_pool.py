@@ -0,0 +1,182 @@
+import collections
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import PoolError
+
+# Environment variables read by the shared pool.
+# IAM_ETL_DSN is a libpq connection string or URL, e.g.
+#   postgresql://etl_user1:<password>@db.<project>.supabase.co:5432/postgres?sslmode=require
+# When it is not set, psycopg2 falls back to the standard PGHOST/PGUSER/PGPASSWORD/... variables.
+DSN_ENV = 'IAM_ETL_DSN'
+POOL_MIN_ENV = 'IAM_ETL_POOL_MIN'
+POOL_MAX_ENV = 'IAM_ETL_POOL_MAX'
+POOL_TIMEOUT_ENV = 'IAM_ETL_POOL_TIMEOUT'
+
+logger = logging.getLogger('iam_etl.db_pool')
+
+
+class PoolTimeout(PoolError):
+    """Raised when no connection became available within the pool timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of reusable connections with a health check on checkout.
+
+    At most ``maxconn`` connections are open at once; callers beyond that wait (up to
+    ``timeout`` seconds) for a connection to be returned. Wait time and checkout counts
+    are available from ``metrics()``.
+    """
+
+    def __init__(self, dsn='', minconn=1, maxconn=4, timeout=30.0, connect=None):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: minconn={minconn}, maxconn={maxconn}")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._connect = connect or (lambda: psycopg2.connect(dsn))
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._stats = {
+            'checkouts': 0,
+            'connections_opened': 0,
+            'health_check_failures': 0,
+            'timeouts': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'in_use': 0,
+        }
+        for _ in range(minconn):
+            self._idle.append(self._open())
+
+    def _open(self):
+        conn = self._connect()
+        with self._lock:
+            self._stats['connections_opened'] += 1
+        return conn
+
+    def _is_healthy(self, conn):
+        """Cheap liveness probe: a closed or broken connection is replaced instead of handed out."""
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()  # Leave the connection idle, not inside the probe's transaction
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Check out a healthy connection, waiting for a free slot if the pool is exhausted."""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+        waited = time.perf_counter() - start
+
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    candidate = self._idle.popleft() if self._idle else None
+                if candidate is None:
+                    conn = self._open()
+                elif self._is_healthy(candidate):
+                    conn = candidate
+                else:
+                    with self._lock:
+                        self._stats['health_check_failures'] += 1
+                    self._close_quietly(candidate)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['wait_seconds_total'] += waited
+            self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], waited)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool (closing it if it is broken or close=True)."""
+        try:
+            if not close and not conn.closed:
+                try:
+                    conn.rollback()  # Never hand out a connection with an open transaction
+                except psycopg2.Error:
+                    close = True
+            if close or conn.closed:
+                self._close_quietly(conn)
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager around getconn/putconn."""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def metrics(self):
+        """Snapshot of checkout counts and wait times."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        stats['wait_seconds_avg'] = stats['wait_seconds_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), collections.deque()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The process-wide pool, created from the environment on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                dsn=os.environ.get(DSN_ENV, ''),
+                minconn=int(os.environ.get(POOL_MIN_ENV, 1)),
+                maxconn=int(os.environ.get(POOL_MAX_ENV, 4)),
+                timeout=float(os.environ.get(POOL_TIMEOUT_ENV, 30)),
+            )
+            logger.info(f"Database connection pool ready (min={_pool.minconn}, max={_pool.maxconn}).")
+        return _pool
+
+
+def close_pool():
+    """Close every idle connection of the process-wide pool and forget it."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
@@ -0,0 +1,244 @@
+import argparse
+import logging
+import time
+
+from psycopg2 import sql
+
+try:
+    from etl import metrics
+    from etl.load import bulk_load
+    from etl.schema import CATEGORIES
+except ImportError:  # Running from inside etl/
+    import metrics
+    from load import bulk_load
+    from schema import CATEGORIES
+
+logger = logging.getLogger('iam_etl.ddl')
+
+TABLE = 'iam_policies'
+
+# A persistent staging table for managed loads. UNLOGGED: nothing written to it goes
+# through the WAL, and it is emptied after a crash, which is all a staging table needs.
+STAGING_TABLE = 'iam_policies_load'
+
+# The table is LIST partitioned by region, one partition per known region plus a default
+# partition for anything else. A unique key on a partitioned table has to include the
+# partition column, so the primary key is (policy_id, region) and ON CONFLICT (policy_id)
+# no longer has an index to use. managed_load merges on CONFLICT_KEY; the other loaders need
+# IAM_ETL_CONFLICT_KEY=policy_id,region (see load.py). A policy that moves to another region
+# then becomes a second row.
+CONFLICT_KEY = ['policy_id', 'region']
+PARTITIONS = {f'{TABLE}_{region.lower()}': region for region in CATEGORIES['region']}
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+# Columns of iam_policies, in table order (see _create_table)
+COLUMNS = ['policy_id', 'user_id', 'role', 'plan_type', 'monthly_rate', 'premium', 'region',
+           'login_count', 'last_login_days', 'loaded_at']
+
+# An existing plain (not partitioned) iam_policies table is renamed to this while migration 1
+# copies its rows into the partitioned table, and dropped once they are all in
+UNPARTITIONED_TABLE = f'{TABLE}_unpartitioned'
+
+# Region given to converted rows that have none: the row loader never wrote region, so a table
+# it filled has NULLs (or no region column at all). They land in the default partition; a later
+# load of the same policy with its real region adds a second row, as a move between regions does.
+UNKNOWN_REGION = 'UNKNOWN'
+
+# Secondary indexes ({name: columns}); created on the parent, so every partition gets its own
+SECONDARY_INDEXES = {
+    f'{TABLE}_user_id_idx': ['user_id'],
+    f'{TABLE}_role_idx': ['role'],
+    f'{TABLE}_plan_type_idx': ['plan_type'],
+    f'{TABLE}_loaded_at_idx': ['loaded_at'],
+}
+
+# Index deferral: a load of at least DEFER_MIN_ROWS rows that is also at least DEFER_FRACTION
+# of the table drops the secondary indexes and rebuilds them once, which beats updating
+# them row by row. ANALYZE runs after a load that wrote ANALYZE_MIN_ROWS rows or ANALYZE_FRACTION
+# of the table, so the planner sees the new row counts before autovacuum gets to it.
+DEFER_MIN_ROWS = 100_000
+DEFER_FRACTION = 0.2
+ANALYZE_MIN_ROWS = 10_000
+ANALYZE_FRACTION = 0.1
+
+def table_kind(cur, table=TABLE):
+    """pg_class.relkind of a table in the current schema: 'r' plain, 'p' partitioned, None if it doesn't exist."""
+    cur.execute("SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE n.nspname = current_schema() AND c.relname = %s;", (table,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def table_columns(cur, table):
+    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() "
+                "AND table_name = %s;", (table,))
+    return {row[0] for row in cur.fetchall()}
+
+def _set_aside(cur, columns):
+    """Rename an existing plain iam_policies table (and its indexes, whose names the new table needs)."""
+    if 'region' in columns:
+        cur.execute(sql.SQL("SELECT count(*) FROM {table} WHERE region IS NULL;").format(table=sql.Identifier(TABLE)))
+        missing = cur.fetchone()[0]
+    else:
+        cur.execute(sql.SQL("SELECT count(*) FROM {table};").format(table=sql.Identifier(TABLE)))
+        missing = cur.fetchone()[0]
+    if missing:
+        logger.warning(f"{missing} rows of the existing {TABLE} table have no region; they are copied with "
+                       f"region {UNKNOWN_REGION!r} into {DEFAULT_PARTITION}.")
+    indexes = sorted(existing_indexes(cur))
+    yield sql.SQL("ALTER TABLE {table} RENAME TO {old};").format(table=sql.Identifier(TABLE), old=sql.Identifier(UNPARTITIONED_TABLE))
+    for name in indexes:  # Renaming the primary key's index renames the constraint too
+        yield sql.SQL("ALTER INDEX {name} RENAME TO {new};").format(name=sql.Identifier(name), new=sql.Identifier(f'{name}_unpartitioned'))
+
+def _copy_set_aside(cur, columns):
+    """Copy the rows of the renamed plain table into the partitioned one, then drop it (the swap)."""
+    copied = [column for column in COLUMNS if column in columns or column == 'region']
+    values = [sql.SQL("coalesce({region}, {unknown})").format(region=sql.Identifier(column), unknown=sql.Literal(UNKNOWN_REGION))
+              if column == 'region' and 'region' in columns else
+              sql.Literal(UNKNOWN_REGION) if column == 'region' else sql.Identifier(column) for column in copied]
+    yield sql.SQL("INSERT INTO {table} ({columns}) SELECT {values} FROM {old};").format(
+        table=sql.Identifier(TABLE), columns=sql.SQL(', ').join(map(sql.Identifier, copied)),
+        values=sql.SQL(', ').join(values), old=sql.Identifier(UNPARTITIONED_TABLE))
+    logger.info(f"Copied {cur.rowcount} rows of the plain {TABLE} table into the partitioned one.")
+    # Fails (and rolls the whole migration back) if views or foreign keys still depend on the old table
+    yield sql.SQL("DROP TABLE {old};").format(old=sql.Identifier(UNPARTITIONED_TABLE))
+
+def _create_table(cur):
+    # A deployment from before the managed schema has a plain table with data: convert it in
+    # the same transaction (rename, create, copy, drop), so a failure leaves it untouched
+    convert = table_kind(cur) == 'r'
+    if convert:
+        columns = table_columns(cur, TABLE)
+        yield from _set_aside(cur, columns)
+    yield sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {table} (
+            policy_id text NOT NULL,
+            user_id text,
+            role text,
+            plan_type text,
+            monthly_rate integer,
+            premium boolean,
+            region text NOT NULL,
+            login_count integer,
+            last_login_days integer,
+            loaded_at timestamptz,
+            PRIMARY KEY (policy_id, region)
+        ) PARTITION BY LIST (region);
+    """).format(table=sql.Identifier(TABLE))
+    for partition, region in PARTITIONS.items():
+        yield sql.SQL("CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} FOR VALUES IN ({region});").format(
+            partition=sql.Identifier(partition), table=sql.Identifier(TABLE), region=sql.Literal(region))
+    yield sql.SQL("CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} DEFAULT;").format(
+        partition=sql.Identifier(DEFAULT_PARTITION), table=sql.Identifier(TABLE))
+    if convert:
+        yield from _copy_set_aside(cur, columns)
+    for name in SECONDARY_INDEXES:
+        yield create_index(name)
+
+def _create_staging(cur):
+    yield sql.SQL("CREATE UNLOGGED TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS, load_seq bigserial);").format(
+        staging=sql.Identifier(STAGING_TABLE), table=sql.Identifier(TABLE))
+
+# Ordered schema migrations: (version, description, statements(cur)). Never edit an applied one; add a new version.
+MIGRATIONS = [
+    (1, 'iam_policies, list partitioned by region', _create_table),
+    (2, 'unlogged staging table for managed loads', _create_staging),
+]
+
+def create_index(name, table=TABLE):
+    return sql.SQL("CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns});").format(
+        name=sql.Identifier(name), table=sql.Identifier(table),
+        columns=sql.SQL(', ').join(map(sql.Identifier, SECONDARY_INDEXES[name])))
+
+def applied_versions(cur):
+    cur.execute("CREATE TABLE IF NOT EXISTS iam_etl_schema_version (version integer PRIMARY KEY, description text, "
+                "applied_at timestamptz NOT NULL DEFAULT now());")
+    cur.execute("SELECT version FROM iam_etl_schema_version;")
+    return {row[0] for row in cur.fetchall()}
+
+def migrate(conn):
+    """Apply every pending migration, each in its own transaction. Returns the versions applied."""
+    applied = []
+    with conn.cursor() as cur:
+        done = applied_versions(cur)
+        conn.commit()
+        for version, description, statements in MIGRATIONS:
+            if version in done:
+                continue
+            for statement in statements(cur):
+                cur.execute(statement)
+            cur.execute("INSERT INTO iam_etl_schema_version (version, description) VALUES (%s, %s);", (version, description))
+            conn.commit()
+            applied.append(version)
+            logger.info(f"Applied schema migration {version}: {description}")
+    return applied
+
+def table_rows(cur, table=TABLE):
+    """The planner's row estimate for a table, summed over its partitions (0 if never analyzed)."""
+    cur.execute("""
+        SELECT coalesce(sum(greatest(c.reltuples, 0)), 0)::bigint FROM pg_class c
+        WHERE c.oid = %(table)s::regclass OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %(table)s::regclass);
+    """, {'table': table})
+    return cur.fetchone()[0]
+
+def existing_indexes(cur, table=TABLE):
+    cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s;", (table,))
+    return {row[0] for row in cur.fetchall()}
+
+def plan_load(rows, existing_rows):
+    """Whether a load of `rows` into a table of `existing_rows` should defer the secondary indexes and ANALYZE."""
+    return {
+        'defer_indexes': rows >= DEFER_MIN_ROWS and rows >= DEFER_FRACTION * existing_rows,
+        'analyze': rows >= ANALYZE_MIN_ROWS or rows >= ANALYZE_FRACTION * existing_rows,
+    }
+
+def managed_load(conn, df, on_conflict='nothing', table=TABLE):
+    """Bulk-load into the migrated schema, deferring index maintenance and analyzing as the load size warrants.
+
+    The index drop, COPY and merge commit together, so a failed load leaves the indexes in
+    place; the dropped indexes are rebuilt right after the merge commits.
+    """
+    start = time.perf_counter()
+    with conn.cursor() as cur:
+        plan = plan_load(len(df), table_rows(cur, table))
+        deferred = sorted(existing_indexes(cur, table) & set(SECONDARY_INDEXES)) if plan['defer_indexes'] else []
+        with metrics.stage('drop_indexes', rows_in=len(deferred)):
+            for name in deferred:
+                cur.execute(sql.SQL("DROP INDEX {name};").format(name=sql.Identifier(name)))
+    logger.info(f"Loading {len(df)} rows: deferring indexes {deferred or 'none'}, analyze={plan['analyze']}.")
+
+    stats = bulk_load(conn, df, on_conflict=on_conflict, table=table, staging=STAGING_TABLE, key=CONFLICT_KEY)
+
+    with conn.cursor() as cur:
+        with metrics.stage('rebuild_indexes', rows_in=len(deferred)):
+            for name in deferred:
+                cur.execute(create_index(name, table))
+            conn.commit()
+        if plan['analyze']:
+            with metrics.stage('analyze'):
+                cur.execute(sql.SQL("ANALYZE {table};").format(table=sql.Identifier(table)))
+                conn.commit()
+    stats.update(deferred_indexes=deferred, analyzed=plan['analyze'], seconds=round(time.perf_counter() - start, 3))
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or migrate the iam_policies schema")
+    parser.add_argument('--status', action='store_true', help='Only list the applied and pending migrations')
+    args = parser.parse_args()
+    logging.basicConfig(level='INFO', format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    try:
+        from etl.db_pool import get_pool
+    except ImportError:  # Running from inside etl/
+        from db_pool import get_pool
+    with get_pool().connection() as conn:
+        if args.status:
+            with conn.cursor() as cur:
+                done = applied_versions(cur)
+            conn.commit()
+            for version, description, _ in MIGRATIONS:
+                print(f"{version:>4}  {'applied' if version in done else 'pending':8} {description}")
+        else:
+            print(f"Applied migrations: {migrate(conn) or 'none (up to date)'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('iam_etl.dedup')
+
+# Memory the dedup state may use before it spills to disk, e.g. IAM_ETL_DEDUP_MEMORY_MB=1024
+MEMORY_MB_ENV = 'IAM_ETL_DEDUP_MEMORY_MB'
+DEFAULT_MEMORY_MB = 256
+# Where spill files go (default: the system temp directory)
+SPILL_DIR_ENV = 'IAM_ETL_DEDUP_SPILL_DIR'
+
+KEY_COLUMN = 'policy_id'
+KEEP_POLICIES = ('first', 'last', 'latest')
+
+# Spilled rows are hash partitioned by key; each partition must fit in memory on its own
+SPILL_PARTITIONS = 64
+# Rough cost of one key in the in-memory seen-set (str object plus set slot)
+KEY_BYTES = 100
+BLOOM_HASHES = 4
+
+SEQ = '_dedup_seq'  # Position in the stream, to restore the input order and break ties
+
+def key_hashes(values):
+    """A 64-bit hash per key (the same for a key in any chunk)."""
+    return pd.util.hash_pandas_object(values.astype(str), index=False).to_numpy()
+
+class BloomFilter:
+    """Fixed-size Bloom filter over 64-bit key hashes: no false negatives, false positives to verify."""
+
+    def __init__(self, bits, hashes=BLOOM_HASHES):
+        self.bits = max(int(bits), 64)
+        self.hashes = hashes
+        self.array = np.zeros((self.bits + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, hashes):
+        # Double hashing: the low and high halves of one 64-bit hash give every probe
+        low, high = hashes & 0xFFFFFFFF, hashes >> np.uint64(32)
+        return [(low + np.uint64(i) * high) % np.uint64(self.bits) for i in range(self.hashes)]
+
+    def add(self, hashes):
+        for positions in self._positions(hashes):
+            np.bitwise_or.at(self.array, positions // np.uint64(8), np.left_shift(1, positions % np.uint64(8)).astype(np.uint8))
+
+    def might_contain(self, hashes):
+        found = np.ones(len(hashes), dtype=bool)
+        for positions in self._positions(hashes):
+            found &= (self.array[positions // np.uint64(8)] >> (positions % np.uint64(8)).astype(np.uint8)) & 1 == 1
+        return found
+
+class Deduplicator:
+    """Drops rows with a repeated policy_id from a stream of chunks, in bounded memory.
+
+    keep='first' emits a row as soon as its key is seen for the first time; 'last' keeps
+    the last row of a key and 'latest' the row with the greatest `order_by` value (the last
+    one on ties), which can only be known at the end of the stream.
+
+    Up to `memory_mb` the state stays in memory: a set of seen keys for 'first', the rows
+    themselves for 'last'/'latest'. Beyond it rows are hash partitioned by key into spill
+    files, and every partition is deduplicated on its own at the end. With 'first', a Bloom
+    filter over every key seen keeps the stream flowing: a row whose key is definitely new
+    is emitted at once, and only possible repeats are spilled and verified exactly against
+    the spilled keys at the end.
+
+    ``update()`` returns the rows that can be emitted now, ``finish()`` yields the rest.
+    Within memory the output is that of drop_duplicates (in input order); after a spill
+    the rows held back come out partition by partition, each in input order.
+    """
+
+    def __init__(self, keep='first', order_by=None, memory_mb=None, spill_dir=None, partitions=SPILL_PARTITIONS,
+                 column=KEY_COLUMN):
+        if keep not in KEEP_POLICIES:
+            raise ValueError(f"keep must be one of {KEEP_POLICIES}, not {keep!r}")
+        if keep == 'latest' and not order_by:
+            raise ValueError("keep='latest' needs the column that orders the rows (order_by)")
+        if memory_mb is None:
+            memory_mb = float(os.environ.get(MEMORY_MB_ENV, DEFAULT_MEMORY_MB))
+        self.keep = keep
+        self.order_by = order_by
+        self.memory_bytes = int(memory_mb * 2**20)
+        self.spill_dir = spill_dir or os.environ.get(SPILL_DIR_ENV)
+        self.partitions = partitions
+        self.column = column
+        self._seen = set()
+        self._buffered = []
+        self._buffered_bytes = 0
+        self._bloom = None
+        self._spill = None  # Directory of the partition files once spilled
+        self._seq = 0
+        self.stats = {'rows_in': 0, 'rows_out': 0, 'duplicates': 0, 'spilled_rows': 0, 'bloom_candidates': 0}
+
+    @property
+    def spilled(self):
+        return self._spill is not None
+
+    def update(self, chunk):
+        """Fold a chunk in; returns its rows that are already known to be kept (possibly none)."""
+        chunk = chunk.assign(**{SEQ: np.arange(self._seq, self._seq + len(chunk))})
+        self._seq += len(chunk)
+        self.stats['rows_in'] += len(chunk)
+        if self.keep == 'first':
+            out = self._update_first(chunk)
+        else:
+            self._update_buffered(chunk)
+            out = chunk.iloc[:0]
+        return self._emit(out)
+
+    def _emit(self, rows):
+        self.stats['rows_out'] += len(rows)
+        return rows.drop(columns=SEQ)
+
+    def _update_first(self, chunk):
+        chunk = chunk.drop_duplicates(self.column, keep='first')  # Repeats within the chunk never get further
+        if not self.spilled:
+            keys = chunk[self.column].astype(str)
+            new = ~keys.isin(self._seen).to_numpy()
+            self._seen.update(keys[new])
+            if len(self._seen) * KEY_BYTES > self.memory_bytes:
+                self._spill_seen()
+            return chunk[new]
+        hashes = key_hashes(chunk[self.column])
+        candidates = self._bloom.might_contain(hashes)
+        self._bloom.add(hashes[~candidates])
+        new = chunk[~candidates]
+        # Emitted keys are spilled too, so the candidates can be verified against them
+        self._write_spill(new[[self.column]].assign(_emitted=True), hashes[~candidates])
+        self._write_spill(chunk[candidates].assign(_emitted=False), hashes[candidates])
+        self.stats['bloom_candidates'] += int(candidates.sum())
+        return new
+
+    def _spill_seen(self):
+        """Move the seen-set to disk and replace it with a Bloom filter of the same keys."""
+        self._open_spill()
+        keys = pd.Series(list(self._seen), name=self.column)
+        self._seen = set()
+        # Half of the memory budget as bits: about 1% false positives up to 0.4 keys per byte of
+        # budget (100M keys for 256 MB); every false positive only costs a spilled row
+        self._bloom = BloomFilter(self.memory_bytes * 4)
+        hashes = key_hashes(keys)
+        self._bloom.add(hashes)
+        self._write_spill(keys.to_frame().assign(_emitted=True), hashes)
+        logger.info(f"Dedup seen-set passed {self.memory_bytes / 2**20:.0f} MB: {len(keys)} keys spilled to {self._spill}")
+
+    def _update_buffered(self, chunk):
+        if self.spilled:
+            self._write_spill(chunk, key_hashes(chunk[self.column]))
+            return
+        self._buffered.append(chunk)
+        self._buffered_bytes += int(chunk.memory_usage(deep=True).sum())
+        if self._buffered_bytes > self.memory_bytes:
+            self._open_spill()
+            buffered, self._buffered, self._buffered_bytes = pd.concat(self._buffered), [], 0
+            self._write_spill(buffered, key_hashes(buffered[self.column]))
+            logger.info(f"Dedup buffer passed {self.memory_bytes / 2**20:.0f} MB: {len(buffered)} rows spilled to {self._spill}")
+
+    def _open_spill(self):
+        self._spill = tempfile.mkdtemp(prefix='iam_etl-dedup-', dir=self.spill_dir)
+
+    def _partition_path(self, partition):
+        return os.path.join(self._spill, f'part-{partition:04d}.pickle')
+
+    def _write_spill(self, rows, hashes):
+        """Append rows to their hash partitions' files (a sequence of pickled frames per file)."""
+        if rows.empty:
+            return
+        if '_emitted' not in rows or not rows['_emitted'].all():
+            self.stats['spilled_rows'] += len(rows)
+        buckets = hashes % np.uint64(self.partitions)
+        for partition in np.unique(buckets):
+            with open(self._partition_path(int(partition)), 'ab') as f:
+                pickle.dump(rows[buckets == partition], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _read_spill(self, partition):
+        path = self._partition_path(partition)
+        if not os.path.exists(path):
+            return []
+        frames = []
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    frames.append(pickle.load(f))  # Only our own temporary files
+                except EOFError:
+                    return frames
+
+    def _resolve(self, rows):
+        """The kept row of every key in rows (that all fit in memory), in input order."""
+        if self.keep == 'first':
+            kept = rows.drop_duplicates(self.column, keep='first')
+        elif self.keep == 'last':
+            kept = rows.drop_duplicates(self.column, keep='last')
+        else:
+            kept = rows.sort_values([self.order_by, SEQ], kind='stable').drop_duplicates(self.column, keep='last')
+        return kept.sort_values(SEQ, kind='stable')
+
+    def finish(self):
+        """Yield the rows held back until the end of the stream, then drop the spill files."""
+        try:
+            if not self.spilled:
+                if self._buffered:
+                    yield self._emit(self._resolve(pd.concat(self._buffered)))
+                    self._buffered = []
+                return
+            for partition in range(self.partitions):
+                frames = self._read_spill(partition)
+                if not frames:
+                    continue
+                if self.keep == 'first':
+                    emitted = pd.concat([frame for frame in frames if frame['_emitted'].all()] or [pd.DataFrame({self.column: []})])
+                    rows = pd.concat([frame for frame in frames if not frame['_emitted'].all()] or [frames[0].iloc[:0]])
+                    rows = rows[~rows[self.column].astype(str).isin(emitted[self.column].astype(str))].drop(columns='_emitted')
+                else:
+                    rows = pd.concat(frames)
+                if len(rows):
+                    yield self._emit(self._resolve(rows))
+        finally:
+            self.close()
+
+    def close(self):
+        if self._spill is not None:
+            shutil.rmtree(self._spill, ignore_errors=True)
+        self.stats['duplicates'] = self.stats['rows_in'] - self.stats['rows_out']
+        if self.stats['rows_in']:
+            logger.info(f"Dedup on {self.column} (keep={self.keep}): {self.stats['duplicates']} duplicates dropped "
+                        f"of {self.stats['rows_in']} rows, {self.stats['spilled_rows']} rows spilled.")
+
+def dedupe_chunks(chunks, deduplicator):
+    """The chunks without repeated keys (see Deduplicator); empty chunks are skipped."""
+    for chunk in chunks:
+        out = deduplicator.update(chunk)
+        if len(out):
+            yield out
+    yield from deduplicator.finish()
+
+def dedupe_frame(df, deduplicator):
+    """A whole frame through a Deduplicator (see transform_data)."""
+    parts = list(dedupe_chunks([df], deduplicator))
+    return pd.concat(parts) if len(parts) > 1 else parts[0] if parts else df.iloc[:0]
@@ -0,0 +1,144 @@
+import base64
+import binascii
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger('iam_etl.encryption')
+
+# 128, 192 or 256-bit AES key, base64 or hex encoded, e.g. IAM_ETL_ENCRYPTION_KEY=$(openssl rand -base64 32)
+KEY_ENV = 'IAM_ETL_ENCRYPTION_KEY'
+WORKERS_ENV = 'IAM_ETL_ENCRYPTION_WORKERS'
+
+# Values per task sent to a worker process: large enough that pickling is small next to the work
+BATCH_ROWS = 50_000
+NONCE_BYTES = 12  # The standard AES-GCM nonce size; every value gets a fresh random nonce
+
+def _aesgcm():
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError as e:
+        raise ImportError("AES-GCM encryption needs the cryptography package (pip install cryptography)") from e
+    return AESGCM
+
+def load_key(key=None):
+    """The AES key as bytes, from `key` (bytes or an encoded string) or $IAM_ETL_ENCRYPTION_KEY."""
+    if key is None:
+        key = os.environ.get(KEY_ENV)
+        if not key:
+            raise ValueError(f"No encryption key: set {KEY_ENV} to a base64 or hex encoded 128/192/256-bit key")
+    if isinstance(key, str):
+        try:
+            is_hex = len(key) in (32, 48, 64) and all(c in '0123456789abcdefABCDEF' for c in key)
+            key = bytes.fromhex(key) if is_hex else base64.b64decode(key, validate=True)
+        except (ValueError, binascii.Error) as e:
+            raise ValueError(f"The encryption key must be base64 or hex encoded ({e})") from e
+    if len(key) not in (16, 24, 32):
+        raise ValueError(f"The encryption key must be 16, 24 or 32 bytes long, not {len(key)}")
+    return key
+
+def generate_key():
+    """A new random 256-bit key, base64 encoded (the format of $IAM_ETL_ENCRYPTION_KEY)."""
+    return base64.b64encode(os.urandom(32)).decode('ascii')
+
+def _plaintext(value):
+    # Integral floats lose their decimal part (50.0 -> '50'), as the loader writes them;
+    # encode_data keeps str(value) ('50.0')
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).encode('utf-8')
+
+def encrypt_batch(key, column, values):
+    """Encrypt a list of values: base64(nonce + ciphertext + tag) per value, None for missing values.
+
+    The column name is authenticated with every value, so a ciphertext moved to another
+    column no longer decrypts. Runs in the worker processes, hence a plain function.
+    """
+    aesgcm = _aesgcm()(key)
+    associated = column.encode('utf-8')
+    nonces = os.urandom(NONCE_BYTES * len(values))  # One system call for the whole batch
+    tokens = []
+    for i, value in enumerate(values):
+        if value is None or value != value:  # None or NaN
+            tokens.append(None)
+            continue
+        nonce = nonces[i * NONCE_BYTES:(i + 1) * NONCE_BYTES]
+        tokens.append(base64.b64encode(nonce + aesgcm.encrypt(nonce, _plaintext(value), associated)).decode('ascii'))
+    return tokens
+
+def decrypt_batch(key, column, tokens):
+    """Inverse of encrypt_batch: the plaintext strings (None for missing values)."""
+    aesgcm = _aesgcm()(key)
+    associated = column.encode('utf-8')
+    values = []
+    for token in tokens:
+        if token is None or token != token:
+            values.append(None)
+            continue
+        raw = base64.b64decode(token)
+        values.append(aesgcm.decrypt(raw[:NONCE_BYTES], raw[NONCE_BYTES:], associated).decode('utf-8'))
+    return values
+
+def _run_batch(task):
+    func, key, column, values = task
+    return func(key, column, values)
+
+class EncryptionEngine:
+    """AES-GCM encryption of column slices, spread over a pool of worker processes.
+
+    ``encrypt()`` splits the values into batches of ``batch_rows`` and encrypts them in
+    ``workers`` processes (in-process with one worker); ``decrypt()`` reverses it, e.g. to
+    verify a run. The pool is started on first use and kept until ``close()``.
+    """
+
+    def __init__(self, key=None, workers=None, batch_rows=BATCH_ROWS):
+        self.key = load_key(key)
+        if workers is None:
+            workers = int(os.environ.get(WORKERS_ENV, 1))
+        self.workers = max(1, workers)
+        self.batch_rows = batch_rows
+        self._pool = None
+
+    @property
+    def key_id(self):
+        """Short one-way identifier of the key, e.g. to tell outputs of different keys apart in a cache."""
+        return hashlib.blake2b(self.key, digest_size=8, person=b'iam_etl-key-id').hexdigest()
+
+    def _map(self, func, column, values):
+        values = list(values)
+        batches = [values[start:start + self.batch_rows] for start in range(0, len(values), self.batch_rows)]
+        if self.workers == 1 or len(batches) == 1:
+            results = [func(self.key, column, batch) for batch in batches]
+        else:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            results = self._pool.map(_run_batch, [(func, self.key, column, batch) for batch in batches])
+        out = np.empty(len(values), dtype=object)
+        start = 0
+        for result in results:
+            out[start:start + len(result)] = result
+            start += len(result)
+        return out
+
+    def encrypt(self, values, column):
+        """Ciphertexts (base64 strings) of the values of `column`, in order."""
+        return self._map(encrypt_batch, column, values)
+
+    def decrypt(self, tokens, column):
+        """Plaintext strings of ciphertexts produced by encrypt() for the same column."""
+        return self._map(decrypt_batch, column, tokens)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -1,52 +1,109 @@
+import os
+
 import pandas as pd
 import numpy as np
-from sklearn.datasets import make_classification
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-# Function to generate synthetic data
-def extract_data():
-    # Set the random seed for reproducibility
-    np.random.seed(42)
+try:
+    from etl.schema import apply_schema
+    from etl.storage import FrameWriter, frame_path, write_frame
+except ImportError:  # Running from inside etl/ (run_all.py imports 'extract' directly)
+    from schema import apply_schema
+    from storage import FrameWriter, frame_path, write_frame
+
+# Width of the numeric part of generated IDs: fixed width keeps them unique and sortable up to 10 billion rows
+ID_WIDTH = 10
+
+def _make_ids(prefix, start, n_rows):
+    """Zero-padded, fixed-width IDs (P0000000001, P0000000002, ...) for rows start+1 .. start+n_rows."""
+    numbers = np.arange(start + 1, start + n_rows + 1).astype(str)
+    return np.char.add(prefix, np.char.zfill(numbers, ID_WIDTH))
 
-    # Number of rows to generate
-    n_samples = 10
+def generate_chunk(start, n_rows, seed_sequence):
+    """Generate rows start .. start+n_rows-1 of the synthetic dataset.
+
+    Every chunk draws from its own generator, derived from the run's SeedSequence,
+    so the output only depends on the seed and chunk size, not on how many workers ran.
+    """
+    rng = np.random.default_rng(seed_sequence)
 
     # Manually generating the data based on the structure you want
-    policy_ids = [f'P100{i+1}' for i in range(n_samples)]
-    user_ids = [f'U00{i+1}' for i in range(n_samples)]
-    roles_data = np.random.choice(['Admin', 'User', 'Manager'], size=n_samples)
-    plan_types_data = np.random.choice(['Enterprise', 'Standard', 'Basic'], size=n_samples)
-    monthly_rates = np.random.choice([50, 120, 320, 520], size=n_samples)
-    premium_values_data = np.random.choice(['Yes', 'No'], size=n_samples)
-    regions_data = np.random.choice(['US', 'EU', 'APAC'], size=n_samples)
-    login_counts = np.random.randint(20, 800, size=n_samples)
-    last_login_days = np.random.randint(1, 400, size=n_samples)
-
-    # Dynamically generate data_type with both 'encrypted' and 'non-encrypted'
-    data_types = np.random.choice(['encrypted', 'non-encrypted'], size=n_samples, p=[0.3, 0.7])  # 30% encrypted, 70% non-encrypted
-
-    # Create the DataFrame
     df = pd.DataFrame({
-        'policy_id': policy_ids,
-        'user_id': user_ids,
-        'role': roles_data,
-        'plan_type': plan_types_data,
-        'monthly_rate': monthly_rates,
-        'premium': premium_values_data,
-        'region': regions_data,
-        'login_count': login_counts,
-        'last_login_days': last_login_days,
-        'data_type': data_types
+        'policy_id': _make_ids('P', start, n_rows),
+        'user_id': _make_ids('U', start, n_rows),
+        'role': rng.choice(['Admin', 'User', 'Manager'], size=n_rows),
+        'plan_type': rng.choice(['Enterprise', 'Standard', 'Basic'], size=n_rows),
+        'monthly_rate': rng.choice([50, 120, 320, 520], size=n_rows),
+        'premium': rng.choice(['Yes', 'No'], size=n_rows),
+        'region': rng.choice(['US', 'EU', 'APAC'], size=n_rows),
+        'login_count': rng.integers(20, 800, size=n_rows),
+        'last_login_days': rng.integers(1, 400, size=n_rows),
+        # Dynamically generate data_type with both 'encrypted' and 'non-encrypted'
+        'data_type': rng.choice(['encrypted', 'non-encrypted'], size=n_rows, p=[0.3, 0.7]),  # 30% encrypted, 70% non-encrypted
     })
 
     # Ensure the 'premium' column is boolean (True/False)
     df['premium'] = df['premium'].map({'Yes': True, 'No': False})
 
-    # Save the generated data to a CSV file
-    output_file = '../data/iam_policies.csv'
-    df.to_csv(output_file, index=False)
+    # Categoricals and narrow integers (see schema.py)
+    return apply_schema(df)
+
+def iter_chunks(n_rows, chunk_size, seed=42, workers=1):
+    """Yield the dataset chunk by chunk, in order, generating up to `workers` chunks in parallel."""
+    starts = range(0, n_rows, chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    tasks = [(start, min(chunk_size, n_rows - start), seed_sequence) for start, seed_sequence in zip(starts, seeds)]
+
+    if workers <= 1:
+        for task in tasks:
+            yield generate_chunk(*task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep only a few chunks in flight so memory stays bounded by chunk size, not row count
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(generate_chunk, *task))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# Function to generate synthetic data
+def extract_data(output_file='../data/iam_policies.csv', n_rows=10, chunk_size=1_000_000, workers=1, seed=42, return_df=True):
+    """Generate `n_rows` synthetic policies and stream them to `output_file` chunk by chunk.
+
+    The file format (csv, parquet or arrow) follows the extension of `output_file`.
+
+    Returns the full DataFrame when return_df is True; pass return_df=False for datasets
+    that should not be held in memory (read them back with storage.iter_frame_chunks).
+    """
+    frames = []
+    with FrameWriter(output_file) as writer:
+        for chunk in iter_chunks(n_rows, chunk_size, seed=seed, workers=workers):
+            # Save the generated data, appending every chunk after the first
+            writer.write(chunk)
+            if return_df:
+                frames.append(chunk)
 
     # Print a confirmation message to indicate the file has been saved
-    print(f"Synthetic data has been saved to {output_file}")
+    print(f"Synthetic data ({n_rows} rows) has been saved to {output_file}")
 
     # Return the DataFrame for further processing
-    return df
+    if return_df:
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return output_file
+
+def extract_partitions(output_dir, n_rows=10, partitions=4, fmt='parquet', workers=1, seed=42):
+    """Generate `n_rows` synthetic policies as `partitions` files of consecutive rows.
+
+    Returns the file paths; the Airflow DAG passes these (not the data) to its mapped tasks.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rows_per_partition = max(1, -(-n_rows // partitions))  # Ceiling division
+    paths = []
+    for partition, chunk in enumerate(iter_chunks(n_rows, rows_per_partition, seed=seed, workers=workers)):
+        paths.append(write_frame(chunk, frame_path(output_dir, f'iam_policies-part-{partition:04d}', fmt)))
+    print(f"Synthetic data ({n_rows} rows) has been saved to {len(paths)} partitions in {output_dir}")
+    return paths
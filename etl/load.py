@@ -1,79 +1,426 @@
-import psycopg2
 import pandas as pd
 from psycopg2 import sql
+import io
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# Connect to Supabase PostgreSQL database
+try:
+    from etl import metrics
+    from etl.change_index import ChangeIndex
+    from etl.checkpoint import frame_fingerprint, retry, LoadCheckpoint, RETRIES
+    from etl.db_pool import get_pool
+except ImportError:  # Running from inside etl/ (run_all.py imports 'load' directly)
+    import metrics
+    from change_index import ChangeIndex
+    from checkpoint import frame_fingerprint, retry, LoadCheckpoint, RETRIES
+    from db_pool import get_pool
+
+logger = logging.getLogger('iam_etl.load')
+
+# Columns written by the loader (must exist in the iam_policies table)
+LOAD_COLUMNS = ['policy_id', 'user_id', 'role', 'plan_type', 'monthly_rate', 'premium']
+
+# Columns written and compared by the DO UPDATE upsert from load_bk.py
+UPSERT_COLUMNS = LOAD_COLUMNS + ['region', 'login_count', 'last_login_days']
+
+# Columns identifying a row for ON CONFLICT, comma separated. policy_id by default; a table
+# partitioned by region (see ddl.py) can only have unique keys that include the partition
+# column, so it needs IAM_ETL_CONFLICT_KEY=policy_id,region
+CONFLICT_KEY_ENV = 'IAM_ETL_CONFLICT_KEY'
+DEFAULT_CONFLICT_KEY = 'policy_id'
+
+# Set to the loading transaction's time on every row the loader inserts or changes; the dbt
+# model (dbt/models/iam_policies.sql) picks up only rows loaded since its previous run by it
+LOADED_AT_COLUMN = 'loaded_at'
+
+# Columns that must reach the database as numbers (encrypted values become NULL)
+NUMERIC_COLUMNS = ['monthly_rate', 'login_count', 'last_login_days']
+
+# Rows per COPY statement when streaming a frame into the staging table
+COPY_CHUNK_ROWS = 100_000
+
+# Rows per committed batch of a checkpointed load, e.g. IAM_ETL_LOAD_BATCH_ROWS=100000
+BATCH_ROWS_ENV = 'IAM_ETL_LOAD_BATCH_ROWS'
+DEFAULT_BATCH_ROWS = 50_000
+
+# Default degree of parallelism for load_data_parallel (tune against database CPU)
+LOAD_WORKERS_ENV = 'IAM_ETL_LOAD_WORKERS'
+
+# Check out a connection to the Supabase PostgreSQL database from the shared pool
+# (connection details come from the environment, see db_pool.py)
 def connect_to_supabase():
     try:
-        # Use your Supabase database connection details
-        conn = psycopg2.connect(
-            host="db.prwzydmfrcbepgevmqmu.supabase.co",  # Supabase host
-            port=5432,  # Default PostgreSQL port
-            database="postgres",  # Database name
-            user="etl_user1",  # Database username
-            password="cyuqD639?TT",  # Database password
-            sslmode="require"  # SSL connection for security
-        )
-        print("Successfully connected to Supabase PostgreSQL.")
+        conn = get_pool().getconn()
+        logger.info("Successfully connected to Supabase PostgreSQL.")
         return conn
     except Exception as e:
-        print(f"Error: Unable to connect to database - {e}")
+        logger.error(f"Unable to connect to database - {e}")
         return None
 
+# Hand a connection from connect_to_supabase back to the pool
+def release_connection(conn):
+    get_pool().putconn(conn)
+
+def ensure_loaded_at(conn, table='iam_policies'):
+    """Add the loaded_at column to a table created before the loaders wrote it; a no-op once it exists.
+
+    Checked first, so the ALTER TABLE (and its exclusive lock) only ever runs once.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema() "
+                    "AND table_name = %s AND column_name = %s;", (table, LOADED_AT_COLUMN))
+        if cur.fetchone() is None:
+            cur.execute(sql.SQL("ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} timestamptz;").format(
+                table=sql.Identifier(table), column=sql.Identifier(LOADED_AT_COLUMN)))
+            logger.info(f"Added the {LOADED_AT_COLUMN} column to {table}.")
+    conn.commit()
+
+def insert_rows(conn, df, key=None, on_conflict='nothing'):
+    """Insert the rows one by one and commit. Returns the rows sent.
+
+    on_conflict='nothing' skips rows whose conflict key exists (ON CONFLICT ... DO NOTHING),
+    'update' updates them when they changed, like the bulk merge (see build_merge_query).
+    `key` is the conflict key (default: conflict_key()); its columns are inserted too.
+    """
+    if on_conflict not in ('nothing', 'update'):
+        raise ValueError(f"on_conflict must be 'nothing' or 'update', not {on_conflict!r}")
+    key = key or conflict_key()
+    columns = load_columns(on_conflict, key)
+    # The table in Supabase should have the following columns based on your DataFrame
+    insert_query = sql.SQL("""
+        INSERT INTO iam_policies
+        ({columns}, {loaded_at})
+        VALUES ({values}, now())
+        ON CONFLICT ({key})
+    """).format(
+        columns=sql.SQL(', ').join(map(sql.Identifier, columns)),
+        loaded_at=sql.Identifier(LOADED_AT_COLUMN),
+        values=sql.SQL(', ').join(sql.Placeholder() * len(columns)),
+        key=sql.SQL(', ').join(map(sql.Identifier, key)),
+    ) + (sql.SQL("DO NOTHING;") if on_conflict == 'nothing' else update_clause(columns, key))
+
+    # Print the DataFrame to see the columns and structure
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Data to be loaded:\n{df.head()}")  # Debugging: Log the first few rows of the DataFrame
+
+    # Ensure that the numeric columns ('monthly_rate', ...) are numeric and handle NaN values by converting them to None (NULL in DB)
+    for column in NUMERIC_COLUMNS:
+        if column in columns:
+            values = pd.to_numeric(df[column], errors='coerce')  # Convert to numeric, invalid values become NaN
+            df = df.assign(**{column: values.astype(object).where(values.notna(), None)})  # Replace NaN/NA with None
+
+    # Loop through each row in the DataFrame and insert it into the PostgreSQL table
+    debug = logger.isEnabledFor(logging.DEBUG)
+    with conn.cursor() as cur:
+        for row in df[columns].itertuples(index=False, name=None):
+            # One value per column, in the order of the INSERT (numeric columns are numbers or None by now)
+            values = tuple(row)
+
+            # Log the values being inserted to debug
+            if debug:
+                logger.debug(f"Inserting values: {values}")  # Debugging: Check the tuple is correctly formatted
+
+            # Execute the insert query with the values
+            cur.execute(insert_query, values)
+
+    # Commit the batch
+    conn.commit()
+    return len(df)
+
+def load_in_batches(df, write_batch, batch_rows=None, checkpoint=None, pool=None, params=None, retries=RETRIES, sleep=time.sleep):
+    """Load the frame in batches of batch_rows rows, each committed in its own transaction.
+
+    `write_batch(conn, batch)` writes and commits one batch (insert_rows, bulk_load, ...) and
+    returns the rows it wrote. Transient failures are retried with exponential backoff and
+    jitter on a fresh connection; after each commit the progress is recorded in `checkpoint`
+    (see checkpoint.py), so a load of the same input that failed part way resumes after the
+    last committed batch. The checkpoint is cleared once every batch is in.
+    """
+    batch_rows = batch_rows or int(os.environ.get(BATCH_ROWS_ENV, DEFAULT_BATCH_ROWS))
+    checkpoint = checkpoint or LoadCheckpoint()
+    pool = pool or get_pool()
+    fingerprint = frame_fingerprint(df, params)
+    rows_done, batches_done = checkpoint.resume(fingerprint)
+    if rows_done:
+        logger.info(f"Resuming the load after {batches_done} committed batches ({rows_done} of {len(df)} rows).")
+    stats = {'rows': len(df), 'resumed_from': rows_done, 'batches': 0, 'written': 0, 'retries': 0}
+
+    def write(batch):
+        with pool.connection() as conn:  # The pool replaces a broken connection on the next checkout
+            return write_batch(conn, batch)
+
+    for start in range(rows_done, len(df), batch_rows):
+        batch = df.iloc[start:start + batch_rows]
+        with metrics.stage('load_batch', rows_in=len(batch)) as step:
+            written, retried = retry(lambda: write(batch), retries=retries, sleep=sleep)
+            step['rows_out'] = written
+        batches_done += 1
+        checkpoint.commit(fingerprint, start + len(batch), batches_done)
+        stats['batches'] += 1
+        stats['written'] += written or 0
+        stats['retries'] += retried
+
+    checkpoint.clear()
+    logger.info(f"Loaded {len(df) - rows_done} rows in {stats['batches']} batches of up to {batch_rows} "
+                f"({stats['retries']} retries, resumed from row {rows_done}).")
+    return stats
+
 # Function to load data to Supabase
-def load_data_to_supabase(df):
+def load_data_to_supabase(df, batch_rows=None, checkpoint=None, on_conflict='nothing'):
+    """Insert the rows in batches, resuming after the last committed batch of an earlier failed run (see load_in_batches)."""
+    try:
+        stats = load_in_batches(df, lambda conn, batch: insert_rows(conn, batch, on_conflict=on_conflict), batch_rows=batch_rows,
+                                checkpoint=checkpoint, params={'loader': 'rows', 'on_conflict': on_conflict})
+        logger.info("Data loaded successfully into the Supabase database.")
+        return stats
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        return None
+
+def conflict_key():
+    """The ON CONFLICT columns, from $IAM_ETL_CONFLICT_KEY."""
+    return [column.strip() for column in os.environ.get(CONFLICT_KEY_ENV, DEFAULT_CONFLICT_KEY).split(',') if column.strip()]
+
+def load_columns(on_conflict='nothing', key=None):
+    """Columns a load sends: LOAD_COLUMNS (UPSERT_COLUMNS for DO UPDATE) plus any conflict key column they lack."""
+    columns = UPSERT_COLUMNS if on_conflict == 'update' else LOAD_COLUMNS
+    return columns + [column for column in (key or conflict_key()) if column not in columns]
+
+def prepare_for_load(df, columns):
+    """Select the load columns and coerce the numeric ones the same way the row loader does."""
+    df = df[columns].copy()
+    for column in NUMERIC_COLUMNS:
+        if column in df.columns:
+            values = pd.to_numeric(df[column], errors='coerce')  # Invalid values become NaN -> NULL (encrypted rows are already NULL)
+            # COPY will not cast '50.0' into an integer column, so write whole numbers without the decimal part
+            if values.notna().any() and (values.dropna() % 1 == 0).all():
+                values = values.astype('Int64')
+            df[column] = values
+    return df
+
+def build_merge_query(columns, on_conflict='nothing', table='iam_policies', staging='iam_policies_staging', key=None, sql=sql):
+    """Set-based merge of the staging table into the target table.
+
+    on_conflict='nothing' keeps the current ON CONFLICT (policy_id) DO NOTHING behavior,
+    on_conflict='update' is the DO UPDATE ... WHERE IS DISTINCT FROM upsert from load_bk.py.
+    Duplicate policy_ids within one load are collapsed first (Postgres refuses to update a
+    row twice in one statement): the first one wins for DO NOTHING, the last one for DO UPDATE,
+    which is what the row-by-row loaders end up with.
+    Inserted and changed rows get loaded_at = now(); unchanged rows keep their loaded_at.
+    `key` is the conflict key (default: conflict_key()); it must have a unique index.
+    `sql` builds the query: psycopg2.sql, or psycopg.sql for psycopg 3 connections (same API).
+    """
+    if on_conflict not in ('nothing', 'update'):
+        raise ValueError(f"on_conflict must be 'nothing' or 'update', not {on_conflict!r}")
+    key = key or conflict_key()
+    if set(key) - set(columns):
+        raise ValueError(f"The conflict key {key} must be among the loaded columns {columns}")
+
+    column_list = sql.SQL(', ').join(map(sql.Identifier, columns))
+    key_list = sql.SQL(', ').join(map(sql.Identifier, key))
+    query = sql.SQL("""
+        INSERT INTO {table} ({columns}, {loaded_at})
+        SELECT DISTINCT ON ({key}) {columns}, now()
+        FROM {staging}
+        ORDER BY {key}, load_seq {order}
+        ON CONFLICT ({key})
+    """).format(
+        table=sql.Identifier(table),
+        staging=sql.Identifier(staging),
+        columns=column_list,
+        key=key_list,
+        loaded_at=sql.Identifier(LOADED_AT_COLUMN),
+        order=sql.SQL('ASC' if on_conflict == 'nothing' else 'DESC'),
+    )
+
+    if on_conflict == 'nothing':
+        return query + sql.SQL("DO NOTHING;")
+
+    return query + update_clause(columns, key, table=table, sql=sql)
+
+def update_clause(columns, key, table='iam_policies', sql=sql):
+    """DO UPDATE of the non-key columns (and loaded_at), only for rows where one of them changed."""
+    updated = [column for column in columns if column not in key]
+    return sql.SQL("DO UPDATE SET {assignments} WHERE {changed};").format(
+        assignments=sql.SQL(', ').join(
+            sql.SQL("{column} = EXCLUDED.{column}").format(column=sql.Identifier(column))
+            for column in updated + [LOADED_AT_COLUMN]),
+        changed=sql.SQL(' OR ').join(
+            sql.SQL("{table}.{column} IS DISTINCT FROM EXCLUDED.{column}").format(
+                table=sql.Identifier(table), column=sql.Identifier(column)) for column in updated),
+    )
+
+def copy_to_staging(cur, df, columns, table='iam_policies', staging='iam_policies_staging', create=True):
+    """Create a temporary staging table shaped like the target and stream the frame into it with COPY.
+
+    With create=False, `staging` is an existing table with a load_seq column (e.g. the
+    unlogged staging table from ddl.py); it is emptied first.
+    """
+    if create:
+        cur.execute(sql.SQL("CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;").format(
+            staging=sql.Identifier(staging), table=sql.Identifier(table)))
+        # load_seq records the order rows arrived in, so duplicates resolve deterministically
+        cur.execute(sql.SQL("ALTER TABLE {staging} ADD COLUMN load_seq bigserial;").format(staging=sql.Identifier(staging)))
+    else:
+        cur.execute(sql.SQL("TRUNCATE {staging};").format(staging=sql.Identifier(staging)))
+
+    copy_query = sql.SQL("COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)").format(
+        staging=sql.Identifier(staging), columns=sql.SQL(', ').join(map(sql.Identifier, columns)))
+    for start in range(0, len(df), COPY_CHUNK_ROWS):
+        buffer = io.StringIO()
+        df.iloc[start:start + COPY_CHUNK_ROWS].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cur.copy_expert(copy_query, buffer)
+
+def bulk_load(conn, df, on_conflict='nothing', columns=None, table='iam_policies', staging=None, key=None):
+    """COPY the frame into a staging table and merge it into the target in one transaction.
+
+    `staging` names an existing staging table to reuse (see copy_to_staging); by default
+    a temporary one is created for the transaction. `key` is the conflict key (see build_merge_query).
+    Returns a dict with the number of rows sent, rows written and the rows/sec achieved.
+    """
+    if columns is None:
+        columns = load_columns(on_conflict, key)
+    start = time.perf_counter()
+    df = prepare_for_load(df, columns)
+
+    with conn.cursor() as cur:
+        with metrics.stage('copy', rows_in=len(df)):
+            copy_to_staging(cur, df, columns, table=table, staging=staging or 'iam_policies_staging', create=staging is None)
+        with metrics.stage('merge', rows_in=len(df)) as step:
+            cur.execute(build_merge_query(columns, on_conflict=on_conflict, table=table,
+                                          staging=staging or 'iam_policies_staging', key=key))
+            conn.commit()
+            written = step['rows_out'] = cur.rowcount
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        'rows': len(df),
+        'written': written,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(len(df) / elapsed, 1) if elapsed > 0 else None,
+    }
+    logger.info(f"Bulk loaded {stats['rows']} rows ({stats['written']} written) in {stats['seconds']}s "
+                f"-> {stats['rows_per_sec']} rows/sec.")
+    return stats
+
+def load_data_bulk(df, on_conflict='nothing', managed=False, batch_rows=None):
+    """Bulk-load the frame into Supabase through a COPY staging table (see bulk_load).
+
+    managed=True loads into the schema created by ddl.py: through its unlogged staging
+    table, with index deferral and ANALYZE decided by the load size (see ddl.managed_load).
+    With batch_rows, every batch of that many rows is COPY'd, merged and committed on its
+    own, with retries and a checkpoint to resume from (see load_in_batches); managed loads
+    decide index deferral for the whole load, so they can't be batched.
+    """
+    if batch_rows and managed:
+        raise ValueError("A managed load can't be batched (batch_rows)")
+    if batch_rows:
+        try:
+            return load_in_batches(df, lambda conn, batch: bulk_load(conn, batch, on_conflict=on_conflict)['written'],
+                                   batch_rows=batch_rows, params={'loader': 'bulk', 'on_conflict': on_conflict})
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            return None
+
     conn = connect_to_supabase()
-    
+
     if conn is None:
-        return
-    
-    try:
-        # Create a cursor object
-        cur = conn.cursor()
-
-        # The table in Supabase should have the following columns based on your DataFrame
-        insert_query = sql.SQL("""
-            INSERT INTO iam_policies 
-            (policy_id, user_id, role, plan_type, monthly_rate, premium)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (policy_id) DO NOTHING;
-        """)
-
-        # Print the DataFrame to see the columns and structure
-        print(f"Data to be loaded:\n{df.head()}")  # Debugging: Print the first few rows of the DataFrame
-
-        # Ensure that 'monthly_rate' is numeric and handle NaN values by converting them to None (NULL in DB)
-        df['monthly_rate'] = pd.to_numeric(df['monthly_rate'], errors='coerce')  # Convert to numeric, invalid values become NaN
-        df['monthly_rate'] = df['monthly_rate'].where(df['monthly_rate'].notna(), None)  # Replace NaN with None
-
-        # Loop through each row in the DataFrame and insert it into the PostgreSQL table
-        for _, row in df.iterrows():
-            # Ensure the values tuple is packed with the correct number of elements (6 values in total)
-            values = (
-                row['policy_id'],  # policy_id
-                row['user_id'],    # user_id
-                row['role'],       # role
-                row['plan_type'],  # plan_type
-                row['monthly_rate'],  # monthly_rate (now guaranteed to be numeric or None)
-                row['premium'],    # premium (True/False)
-            )
-
-            # Print the values being inserted to debug
-            print(f"Inserting values: {values}")  # Debugging: Print the tuple to see if it's correctly formatted
-            
-            # Execute the insert query with the values
-            cur.execute(insert_query, values)
+        return None
 
-        # Commit the transaction
-        conn.commit()
-        print(f"Data loaded successfully into the Supabase database.")
+    try:
+        if managed:
+            try:
+                from etl import ddl
+            except ImportError:  # Running from inside etl/
+                import ddl
+            return ddl.managed_load(conn, df, on_conflict=on_conflict)
+        return bulk_load(conn, df, on_conflict=on_conflict)
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error(f"Error: {e}")
+        return None
     finally:
-        # Close the cursor and connection
-        cur.close()
-        conn.close()
+        release_connection(conn)  # The pool rolls back anything left uncommitted
+
+def partition_frame(df, partitions):
+    """Hash-partition the rows by policy_id, so every policy_id lands in exactly one partition.
+
+    Rows keep their original order inside a partition, so duplicates resolve the same way
+    as in a serial load.
+    """
+    buckets = pd.util.hash_pandas_object(df['policy_id'], index=False).to_numpy() % partitions
+    return [df[buckets == i] for i in range(partitions)]
+
+def load_data_parallel(df, workers=None, on_conflict='nothing', pool=None, key=None):
+    """Bulk-load hash partitions of the frame over several pooled connections at once.
+
+    Each partition is COPY'd and merged in its own transaction on its own connection.
+    `key` is the conflict key (see build_merge_query).
+    Returns one outcome dict per partition (rows, written, seconds, error).
+    """
+    workers = workers or int(os.environ.get(LOAD_WORKERS_ENV, 4))
+    pool = pool or get_pool()
+    maxconn = getattr(pool, 'maxconn', workers)
+    if workers > maxconn:
+        # The extra partitions wait for a free connection instead of loading in parallel
+        logger.warning(f"{workers} load workers but the pool holds at most {maxconn} connections; "
+                       f"only {maxconn} partitions load at a time (raise $IAM_ETL_POOL_MAX).")
+    start = time.perf_counter()
+
+    def load_partition(index, part):
+        outcome = {'partition': index, 'rows': len(part), 'written': 0, 'seconds': 0.0, 'error': None}
+        if part.empty:
+            return outcome
+        try:
+            # Worker threads have their own stage stack, so their copy/merge steps show up under load_partition
+            with metrics.stage('load_partition', rows_in=len(part)), pool.connection() as conn:
+                stats = bulk_load(conn, part, on_conflict=on_conflict, key=key)
+            outcome.update(written=stats['written'], seconds=stats['seconds'])
+        except Exception as e:
+            outcome['error'] = str(e)
+            logger.error(f"Error loading partition {index}: {e}")
+        return outcome
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        outcomes = list(executor.map(load_partition, range(workers), partition_frame(df, workers)))
+
+    elapsed = time.perf_counter() - start
+    failed = [outcome['partition'] for outcome in outcomes if outcome['error']]
+    logger.info(f"Parallel load of {len(df)} rows over {workers} connections took {elapsed:.3f}s "
+                f"({len(df) / elapsed:.1f} rows/sec), failed partitions: {failed or 'none'}.")
+    return outcomes
+
+def load_changed_rows(df, on_conflict='nothing', workers=None, index=None, key=None, managed=False):
+    """Bulk-load only the rows that are new or changed since the last load.
+
+    Rows are hashed (after the same normalization the loader applies) and compared with
+    the local change index (see change_index.py); unchanged rows are not sent at all.
+    The index is only updated once the load has been committed. Returns the hit/miss counts.
+    `key` and `managed` are passed on to the loader (see load_data_parallel, load_data_bulk).
+    """
+    columns = load_columns(on_conflict, key)
+    index = index or ChangeIndex()
+    with metrics.stage('change_detection', rows_in=len(df)) as step:
+        changed, hashes = index.split(prepare_for_load(df, columns), columns)
+        step['rows_out'] = len(changed)
+
+    if changed.empty:
+        logger.info("No new or changed rows to load.")
+        return index.stats
+
+    if workers:
+        outcomes = load_data_parallel(changed, workers=workers, on_conflict=on_conflict, key=key)
+        committed = all(outcome['error'] is None for outcome in outcomes)
+    else:
+        committed = load_data_bulk(changed, on_conflict=on_conflict, managed=managed) is not None
+
+    if committed:
+        index.record(changed, hashes)
+    else:
+        logger.warning("Load failed; the change index was left untouched so the rows are sent again next run.")
+    return index.stats
 
 # Main function for testing or execution
 def main():
@@ -84,6 +431,8 @@ def main():
     # Columns must be: policy_id, user_id, role, plan_type, monthly_rate, premium
     df = df[['policy_id', 'user_id', 'role', 'plan_type', 'monthly_rate', 'premium']]
 
+    with get_pool().connection() as conn:
+        ensure_loaded_at(conn)
     load_data_to_supabase(df)
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+logger = logging.getLogger('iam_etl.metrics')
+
+# Set to 1 to also record tracemalloc peaks per stage (slows Python allocations down noticeably)
+TRACE_MEMORY_ENV = 'IAM_ETL_TRACE_MEMORY'
+
+def _peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if os.uname().sysname == 'Darwin' else 1024), 1)
+
+class PipelineMetrics:
+    """Wall time, row counts, throughput and memory for every stage and sub-step of a run.
+
+    Stages are recorded with the ``stage()`` context manager; nested stages get dotted
+    names (``transform.encrypt``). Recording the same stage again (e.g. once per chunk or
+    once per load partition) adds to the existing record. Stage nesting is tracked per
+    thread; tracemalloc peaks are process-wide, so they include concurrent threads.
+    """
+
+    def __init__(self, trace_memory=None):
+        if trace_memory is None:
+            trace_memory = os.environ.get(TRACE_MEMORY_ENV, '') not in ('', '0')
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _stack(self, attr):
+        if not hasattr(self._local, attr):
+            setattr(self._local, attr, [])
+        return getattr(self._local, attr)
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Time a stage. Set ``record['rows_out']`` inside the block to report the rows it produced."""
+        names = self._stack('names')
+        peaks = self._stack('peaks')  # Highest tracemalloc peak seen by nested stages, per open stage
+        full_name = '.'.join(names + [name])
+        record = {'rows_in': rows_in, 'rows_out': None}
+        names.append(name)
+        if self.trace_memory:
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - start
+            names.pop()
+            traced_peak = None
+            if self.trace_memory:
+                traced_peak = max(tracemalloc.get_traced_memory()[1], peaks.pop())
+                if peaks:
+                    peaks[-1] = max(peaks[-1], traced_peak)
+            with self._lock:
+                self._record(full_name, record, elapsed, traced_peak)
+
+    def _record(self, name, record, elapsed, traced_peak):
+        existing = self.stages.get(name)
+        if existing is None:
+            existing = self.stages[name] = {
+                'stage': name, 'calls': 0, 'seconds': 0.0, 'rows_in': None, 'rows_out': None,
+                'rows_per_sec': None, 'peak_traced_mb': None, 'peak_rss_mb': None,
+            }
+        existing['calls'] += 1
+        existing['seconds'] = round(existing['seconds'] + elapsed, 6)
+        for key in ('rows_in', 'rows_out'):
+            if record[key] is not None:
+                existing[key] = (existing[key] or 0) + int(record[key])
+        rows = existing['rows_in'] if existing['rows_in'] is not None else existing['rows_out']
+        if rows is not None and existing['seconds'] > 0:
+            existing['rows_per_sec'] = round(rows / existing['seconds'], 1)
+        if traced_peak is not None:
+            existing['peak_traced_mb'] = max(existing['peak_traced_mb'] or 0, round(traced_peak / 2**20, 2))
+        existing['peak_rss_mb'] = _peak_rss_mb()
+
+        # One structured log line per stage call
+        logger.info(json.dumps({'event': 'stage', **existing, 'call_seconds': round(elapsed, 6)}))
+
+    def to_dict(self):
+        with self._lock:
+            stages = [dict(record) for record in self.stages.values()]
+        return {'stages': stages, 'peak_rss_mb': _peak_rss_mb()}
+
+    def write_json(self, path):
+        """Write every stage record to a JSON metrics file."""
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        logger.info(f"Metrics written to '{path}'")
+        return path
+
+# The metrics of the current run. Modules record into it through the module-level stage()
+# so the instrumentation does not have to be passed down through every function.
+_current = None
+
+def current():
+    global _current
+    if _current is None:
+        _current = PipelineMetrics()
+    return _current
+
+def reset(trace_memory=None):
+    """Start a fresh set of metrics (at the start of a pipeline run or Airflow task)."""
+    global _current
+    _current = PipelineMetrics(trace_memory=trace_memory)
+    return _current
+
+def stage(name, rows_in=None):
+    """Shortcut for current().stage(...)."""
+    return current().stage(name, rows_in=rows_in)
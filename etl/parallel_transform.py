@@ -0,0 +1,195 @@
+import copy
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import pandas as pd
+
+try:
+    from etl import metrics
+    from etl.dedup import dedupe_frame
+    from etl.encryption import EncryptionEngine
+    from etl.sampling import FractionSampler, sample_frame
+    from etl.snapshots import SnapshotWriter, SUMMARY_ROWS
+    from etl.storage import _pyarrow, frame_path, write_frame
+    from etl.transform import (
+        clean_and_convert_column, drop_missing, encrypt_columns, write_reshaped,
+        ENCRYPTED_COLUMNS, RESHAPE_COLUMNS, STAGE_OUTPUTS,
+    )
+except ImportError:  # Running from inside etl/ (run_all.py imports modules directly)
+    import metrics
+    from dedup import dedupe_frame
+    from encryption import EncryptionEngine
+    from sampling import FractionSampler, sample_frame
+    from snapshots import SnapshotWriter, SUMMARY_ROWS
+    from storage import _pyarrow, frame_path, write_frame
+    from transform import (
+        clean_and_convert_column, drop_missing, encrypt_columns, write_reshaped,
+        ENCRYPTED_COLUMNS, RESHAPE_COLUMNS, STAGE_OUTPUTS,
+    )
+
+logger = logging.getLogger('iam_etl.parallel_transform')
+
+# Default worker processes, e.g. IAM_ETL_TRANSFORM_WORKERS=8
+WORKERS_ENV = 'IAM_ETL_TRANSFORM_WORKERS'
+
+# Frames cross the process boundary as Arrow IPC streams in shared memory: the parent
+# writes the input once and every worker reads its row range from the same block; each
+# worker hands its outputs back the same way. Nothing is pickled except names and offsets.
+
+def _to_shared(df):
+    """Write df (with its index) into a new shared memory block. Returns (block, size)."""
+    pa = _pyarrow()
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    buffer = sink.getvalue()
+    block = shared_memory.SharedMemory(create=True, size=max(buffer.size, 1))
+    block.buf[:buffer.size] = memoryview(buffer).cast('B')
+    return block, buffer.size
+
+def _read_table(buffer):
+    pa = _pyarrow()
+    return pa.ipc.open_stream(pa.py_buffer(buffer)).read_all()
+
+def _from_shared(name, size, object_columns=()):
+    """Read (a copy of) a frame another process put in shared memory, then free the block."""
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        df = _read_table(bytes(block.buf[:size])).to_pandas()
+    finally:
+        block.close()
+        block.unlink()
+    # Arrow reads text columns back as strings; the ciphertext columns are object columns in-process
+    for column in object_columns:
+        if column in df.columns:
+            df[column] = df[column].astype(object).where(df[column].notna(), None)
+    return df
+
+def _share_result(df):
+    block, size = _to_shared(df)
+    block.close()  # The parent unlinks it once read
+    return block.name, size
+
+def _integer_partials(df):
+    """Per-region integer sums and counts of the reshape columns (exact, so any merge order gives the same result)."""
+    grouped = df.groupby('region', observed=True)[RESHAPE_COLUMNS]
+    sums = grouped.sum().add_suffix('_sum')
+    counts = grouped.count().add_suffix('_count')
+    return pd.concat([sums, counts], axis=1).reset_index()
+
+def _transform_partition(task):
+    """The row-local steps of transform_data for rows [start, stop) of the shared input."""
+    name, size, start, stop, options = task
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        # Numeric columns are views of the shared block, not copies
+        return _transform_rows(_read_table(block.buf[:size]).slice(start, stop - start).to_pandas(), options)
+    finally:
+        block.close()  # Every view is gone with _transform_rows' frame
+
+def _transform_rows(df, options):
+    results = {}
+    if options['partials']:
+        results['partials'] = _integer_partials(df)
+    engine = EncryptionEngine(options['key'], workers=1) if options['key'] is not None else None
+    df = encrypt_columns(df, engine=engine)
+    if options['snapshots'] != 'off':
+        results['before_cleaning'] = df.head(SUMMARY_ROWS) if options['snapshots'] == 'summary' else df.copy()
+    for column in ENCRYPTED_COLUMNS:
+        df = clean_and_convert_column(df, column)
+    if options['snapshots'] != 'off':
+        results['after_cleaning'] = df.head(SUMMARY_ROWS) if options['snapshots'] == 'summary' else df
+    df = drop_missing(df)
+    results['sampled'] = sample_frame(df, options['sampler'])
+    results['transformed'] = df
+    return {key: _share_result(frame) for key, frame in results.items()}
+
+def _merge_partials(partials, regions):
+    """Region means from the partitions' integer sums and counts, laid out like the region pivot_table."""
+    totals = pd.concat(partials).groupby('region', observed=True).sum()
+    means = pd.DataFrame({column: totals[f'{column}_sum'] / totals[f'{column}_count'] for column in RESHAPE_COLUMNS})
+    means = means[sorted(RESHAPE_COLUMNS)]  # pivot_table orders the value columns alphabetically
+    means.index = pd.CategoricalIndex(means.index, categories=regions.categories, name='region') \
+        if isinstance(regions, pd.CategoricalDtype) else means.index
+    return means.sort_index()
+
+def row_partitions(n_rows, partitions):
+    """(start, stop) of `partitions` contiguous, nearly equal row ranges."""
+    bounds = [n_rows * i // partitions for i in range(partitions + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(partitions) if bounds[i] < bounds[i + 1]]
+
+def transform_parallel(df, output_dir='../data', fmt=None, snapshot_level=None, aggregates=None, engine=None,
+                       sampler=None, workers=None, dedup=None):
+    """transform_data over `workers` processes, with the same outputs.
+
+    The row-local steps (encryption, cleaning, dropna, sampling) run per row partition in a
+    process pool; the parent merges the partitions in order, so the frames and files are
+    identical to a single-process run (except AES-GCM ciphertexts, whose nonces are random).
+    Region means are merged from integer partial sums, a sampler runs again over the
+    partitions' samples (a no-op for hash fractions, the global bottom-k for reservoirs),
+    and the aggregate store, if any, is updated once by the parent, as is `dedup`, which
+    needs to see every row.
+    """
+    if workers is None:
+        workers = int(os.environ.get(WORKERS_ENV, os.cpu_count() or 1))
+    if dedup is not None:
+        with metrics.stage('dedup', rows_in=len(df)) as step:
+            df = dedupe_frame(df, dedup)
+            step['rows_out'] = len(df)
+    paths = {name: frame_path(output_dir, name, fmt) for name in STAGE_OUTPUTS}
+    snapshots = SnapshotWriter(snapshot_level)
+    sampler = sampler or FractionSampler(0.5)
+    pivot = aggregates is None and df.shape[0] > 1 and df['region'].nunique() > 1  # Same guard as transform_data
+    # Integer sums are exact in any order; float sums are not, so those are pivoted here as before
+    partials = pivot and all(pd.api.types.is_integer_dtype(df[column]) for column in RESHAPE_COLUMNS)
+
+    with metrics.stage('pivot', rows_in=len(df)) as step:
+        if aggregates is not None:
+            aggregates.update(df)
+            df_reshaped = aggregates.region_means(RESHAPE_COLUMNS)
+        elif pivot and not partials:
+            df_reshaped = df.pivot_table(index=['region'], values=RESHAPE_COLUMNS, aggfunc='mean', observed=True)
+        else:
+            df_reshaped = pd.DataFrame()  # Merged from the partitions' partials below, if pivoting
+        step['rows_out'] = len(df_reshaped)
+
+    with metrics.stage('share', rows_in=len(df)):
+        block, size = _to_shared(df)
+    options = {'partials': partials, 'snapshots': snapshots.level, 'sampler': copy.deepcopy(sampler),
+               'key': engine.key if engine is not None else None}
+    object_columns = [column for column in df.columns if df[column].dtype == object]
+    object_columns += [column + '_enc' for column in ENCRYPTED_COLUMNS]
+    try:
+        with metrics.stage('partitions', rows_in=len(df)) as step:
+            tasks = [(block.name, size, start, stop, options) for start, stop in row_partitions(len(df), workers)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                shared = list(pool.map(_transform_partition, tasks))  # In partition order
+            step['rows_out'] = len(tasks)
+    finally:
+        block.close()
+        block.unlink()
+
+    with metrics.stage('merge', rows_in=len(df)) as step:
+        parts = [{key: _from_shared(name, part_size, object_columns) for key, (name, part_size) in result.items()}
+                 for result in shared]
+        df_out = pd.concat([part['transformed'] for part in parts])
+        df_sampled = sample_frame(pd.concat([part['sampled'] for part in parts]), sampler)
+        if partials:
+            df_reshaped = _merge_partials([part['partials'] for part in parts], df['region'].dtype)
+        for part in parts:
+            if 'before_cleaning' in part:
+                snapshots.submit(part['before_cleaning'], paths['transform_before_cleaning'])
+                snapshots.submit(part['after_cleaning'], paths['transform_after_cleaning'])
+        step['rows_out'] = len(df_out)
+
+    with metrics.stage('write', rows_in=len(df_out) + len(df_sampled) + len(df_reshaped)):
+        write_frame(df_out, paths['transformed'])
+        write_frame(df_sampled, paths['sampled_iam_policies'])
+        write_reshaped(df_reshaped, paths['reshaped_iam_policies'])
+        snapshots.close()
+
+    logger.info(f"Transformed {len(df)} rows in {len(tasks)} partitions over {workers} workers, {len(df_out)} rows kept.")
+    return df_out, df_sampled, df_reshaped
@@ -1,82 +1,414 @@
 import argparse
+import functools
 import importlib
-import numpy as np
+import logging
 import sys
 import os
-import pandas as pd  # <-- Add this import for pandas
 
-def run_extract():
+try:
+    from etl import metrics  # Stage timings for this run (see metrics.py)
+except ImportError:  # Running from inside etl/
+    import metrics
+
+# Intermediate files shared between the steps (the extension follows --format)
+DATA_DIR = '../data'
+
+# Modules whose source is part of each cached stage's key (see stage_cache.py)
+EXTRACT_CODE = ['extract', 'schema', 'storage']
+TRANSFORM_CODE = ['transform', 'schema', 'storage', 'aggregates', 'encryption', 'sampling', 'parallel_transform', 'dedup']
+TRANSFORM_OUTPUTS = ['transformed', 'sampled_iam_policies', 'reshaped_iam_policies']
+
+# The generated rows depend on the seed and on the chunk size (one random stream per chunk),
+# so both are passed to extract_data and are part of the extract step's cache key
+EXTRACT_SEED = 42
+EXTRACT_CHUNK_ROWS = 1_000_000
+
+def etl_module(name):
+    """Import an etl module the way the modules import each other: as etl.<name> when the
+    package is importable (repository root on sys.path), so every module shares one copy of
+    metrics, the connection pool, ..."""
+    try:
+        return importlib.import_module(f'etl.{name}')
+    except ImportError:  # Running from inside etl/
+        return importlib.import_module(name)
+
+def run_extract(output_file, n_rows=10, workers=1, return_df=True):
     try:
         print("Running Extract Step...")
         # Dynamically import and run the extract function from extract.py
-        extract = importlib.import_module('extract')  # assuming extract.py is in the same folder
-        df = extract.extract_data()  # No need to pass CSV file path since it's auto-generated
+        extract = stage_module('extract')
+        with metrics.stage('extract') as step:
+            df = extract.extract_data(output_file, n_rows=n_rows, chunk_size=EXTRACT_CHUNK_ROWS, workers=workers,
+                                      seed=EXTRACT_SEED, return_df=return_df)
+            step['rows_out'] = n_rows
         return df
     except Exception as e:
         print(f"Error during extraction: {e}")
         return None
 
-def run_transform(df):
+def cached_extract(cache, force, output_file, n_rows=10, workers=1, return_df=True):
+    """run_extract, unless the cache holds the output for the same rows, seed, chunk size, format and code.
+
+    Returns (result of run_extract, cache key); the key stands for the extracted data downstream.
+    """
+    storage = etl_module('storage')
+    key = cache.key('extract', params={'rows': n_rows, 'seed': EXTRACT_SEED, 'chunk_size': EXTRACT_CHUNK_ROWS,
+                                       'format': storage.format_of(output_file)}, code=EXTRACT_CODE)
+    if not force and cache.restore(key, {'extracted': output_file}) is not None:
+        print(f"Extract Step unchanged, restored '{output_file}' from the cache.")
+        return (storage.read_frame(output_file) if return_df else output_file), key
+    df = run_extract(output_file, n_rows, workers, return_df)
+    if df is not None:
+        cache.store(key, {'extracted': output_file})
+    return df, key
+
+def transform_outputs(fmt, aggregates=False):
+    """The cached transform outputs. With the aggregate store the reshaped means depend on
+    the store's state, not only on the stage's inputs, so they are never cached."""
+    storage = etl_module('storage')
+    return {name: storage.frame_path(DATA_DIR, name, fmt) for name in TRANSFORM_OUTPUTS
+            if not (aggregates and name == 'reshaped_iam_policies')}
+
+def restore_transform(cache, force, key, fmt, aggregates=False):
+    """Put the cached transform outputs in place. Returns their metadata, or None when the step has to run.
+
+    With the aggregate store the reshaped means are rewritten from its current state.
+    """
+    if cache is None or force:
+        return None
+    outputs = transform_outputs(fmt, aggregates)
+    meta = cache.restore(key, outputs)
+    if meta is not None:
+        print(f"Transform Step unchanged, restored {list(outputs)} from the cache.")
+        if aggregates:
+            transform = stage_module('transform')
+            storage = etl_module('storage')
+            transform.write_reshaped(open_aggregates(True).region_means(transform.RESHAPE_COLUMNS),
+                                     storage.frame_path(DATA_DIR, 'reshaped_iam_policies', fmt))
+    return meta
+
+def store_transform(cache, key, fmt, meta, aggregates=False):
+    if cache is not None:
+        cache.store(key, transform_outputs(fmt, aggregates), meta)
+
+def open_aggregates(enabled):
+    """The local aggregate store the reshape step reads its region means from (None when disabled)."""
+    if not enabled:
+        return None
+    aggregates = etl_module('aggregates')
+    return aggregates.AggregateStore()
+
+def open_engine(encryption, workers=None):
+    """The AES-GCM engine for --encryption aes-gcm (None keeps the base64 encoding)."""
+    if encryption != 'aes-gcm':
+        return None
+    return etl_module('encryption').EncryptionEngine(workers=workers)
+
+def run_transform(df, fmt, snapshot_level=None, aggregates=None, engine=None, sampler=None, workers=1, dedup=None):
     try:
         print("Running Transform Step...")
         # Dynamically import and run the transform function from transform.py
-        transform = importlib.import_module('transform')  # assuming transform.py is in the same folder
-        df_transformed, df_sampled, df_reshaped = transform.transform_data(df)
+        transform = stage_module('transform')
+        if workers > 1:
+            # Same outputs, with the row-local steps spread over worker processes (see parallel_transform.py)
+            transform_data = functools.partial(etl_module('parallel_transform').transform_parallel, workers=workers)
+        else:
+            transform_data = transform.transform_data
+        with metrics.stage('transform', rows_in=len(df)) as step:
+            df_transformed, df_sampled, df_reshaped = transform_data(df, output_dir=DATA_DIR, fmt=fmt, snapshot_level=snapshot_level, aggregates=aggregates, engine=engine, sampler=sampler, dedup=dedup)
+            step['rows_out'] = len(df_transformed)
         return df_transformed, df_sampled, df_reshaped
     except Exception as e:
         print(f"Error during transformation: {e}")
         return None, None, None
 
-def run_load(df_transformed):
+def run_transform_stream(input_file, chunksize, fmt, snapshot_level=None, aggregates=None, engine=None, sampler=None, dedup=None):
+    try:
+        print(f"Running Transform Step in streaming mode (chunks of {chunksize} rows)...")
+        transform = stage_module('transform')
+        storage = etl_module('storage')
+        chunks = storage.iter_frame_chunks(input_file, chunksize)
+        with metrics.stage('transform') as step:
+            result = transform.transform_stream(chunks, output_dir=DATA_DIR, fmt=fmt, snapshot_level=snapshot_level, aggregates=aggregates, engine=engine, sampler=sampler, dedup=dedup)
+            step['rows_in'], step['rows_out'] = result[0], result[1]
+        return result
+    except Exception as e:
+        print(f"Error during transformation: {e}")
+        return None
+
+def run_transform_and_load(input_file, chunksize, fmt, snapshot_level=None, aggregates=None, engine=None, sampler=None,
+                           on_conflict='nothing', connections=1, dedup=None):
+    try:
+        print(f"Running Transform and Load Steps pipelined (chunks of {chunksize} rows over {connections} connections)...")
+        async_load = etl_module('async_load')  # Loads each chunk while the next one is transformed
+        load = stage_module('load')
+        with load.get_pool().connection() as conn:
+            load.ensure_loaded_at(conn)  # Tables created before loaded_at existed get the column once
+        storage = etl_module('storage')
+        chunks = storage.iter_frame_chunks(input_file, chunksize)
+        with metrics.stage('transform_and_load') as step:
+            result, stats = async_load.transform_and_load(chunks, connections=connections, on_conflict=on_conflict, output_dir=DATA_DIR, fmt=fmt,
+                                                          snapshot_level=snapshot_level, aggregates=aggregates, engine=engine, sampler=sampler, dedup=dedup)
+            step['rows_in'], step['rows_out'] = result[0], stats['rows']
+        print(f"Pipelined load: {stats}")
+        return result
+    except Exception as e:
+        print(f"Error during pipelined transform and load: {e}")
+        return None
+
+def run_load(df_transformed, bulk=False, on_conflict='nothing', workers=None, skip_unchanged=False, managed=False, batch_rows=None):
     try:
         print("Running Load Step...")
         # Dynamically import and run the load function from load.py
-        load = importlib.import_module('load')  # assuming load.py is in the same folder
-        load.load_data_to_supabase(df_transformed)  # assuming load_data is the function that loads data
+        load = stage_module('load')
+        # The partitioned table of --managed-schema only has a unique key that includes region
+        key = etl_module('ddl').CONFLICT_KEY if managed else None
+        with load.get_pool().connection() as conn:
+            if managed:
+                print(f"Applied schema migrations: {etl_module('ddl').migrate(conn) or 'none (up to date)'}")
+            else:
+                load.ensure_loaded_at(conn)  # Tables created before loaded_at existed get the column once
+        with metrics.stage('load', rows_in=len(df_transformed)):
+            if skip_unchanged:
+                load.load_changed_rows(df_transformed, on_conflict=on_conflict, workers=workers, key=key, managed=managed)  # Only new/changed rows
+            elif workers:
+                load.load_data_parallel(df_transformed, workers=workers, on_conflict=on_conflict, key=key)  # Hash partitions over N connections
+            elif bulk or managed:
+                load.load_data_bulk(df_transformed, on_conflict=on_conflict, managed=managed, batch_rows=batch_rows)  # COPY into a staging table + one merge
+            else:
+                load.load_data_to_supabase(df_transformed, batch_rows=batch_rows, on_conflict=on_conflict)  # Committed in batches, resumable
+        print(f"Connection pool metrics: {load.get_pool().metrics()}")
     except Exception as e:
         print(f"Error during loading: {e}")
 
-def main():
+def add_common_options(parser):
+    """Options every stage takes: intermediate files, the stage cache, logging and metrics."""
+    parser.add_argument('--format', choices=['csv', 'parquet', 'arrow'], help='Format of the intermediate files (default: $IAM_ETL_FORMAT or csv)')
+    parser.add_argument('--no-cache', action='store_true', help='Neither use nor fill the stage cache; always run every step')
+    parser.add_argument('--force', action='store_true', help='Re-run extract and transform even on a cache hit, and refresh the cached outputs')
+    parser.add_argument('--cache-dir', help='Stage cache directory (default: $IAM_ETL_CACHE_DIR or ../data/cache)')
+    parser.add_argument('--cache-max-mb', type=float, help='Evict least recently used cache entries beyond this size (default: $IAM_ETL_CACHE_MAX_MB or 1024)')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='DEBUG also logs DataFrame heads and every inserted row')
+    parser.add_argument('--metrics-file', default=os.path.join(DATA_DIR, 'pipeline_metrics.json'), help='Where to write the per-stage metrics JSON')
+    parser.add_argument('--trace-memory', action='store_true', help='Record tracemalloc peaks per stage (slower)')
+
+def add_extract_options(parser):
+    """Options of the extract stage."""
+    parser.add_argument('--rows', type=int, default=10, help='Number of synthetic rows to generate in the extract step')
+    parser.add_argument('--extract-workers', type=int, default=1, help='Worker processes used to generate the synthetic data')
+
+def add_transform_options(parser):
+    """Options of the transform stage."""
+    parser.add_argument('--snapshots', choices=['off', 'summary', 'full'], help='Debug snapshots written during transform (default: $IAM_ETL_SNAPSHOTS or full)')
+    parser.add_argument('--export-csv', action='store_true', help='Also export the transformed data as CSV when using parquet/arrow')
+    parser.add_argument('--chunksize', type=int, help='Stream the transform step over iam_policies.csv in chunks of this many rows')
+    parser.add_argument('--transform-workers', type=int, default=1, help='Processes for the row-local transform steps (same outputs; not with --chunksize)')
+    parser.add_argument('--encryption', default='base64', choices=['base64', 'aes-gcm'], help='How the sensitive values of encrypted rows are protected (aes-gcm needs $IAM_ETL_ENCRYPTION_KEY)')
+    parser.add_argument('--encryption-workers', type=int, help='Processes used for AES-GCM encryption (default: $IAM_ETL_ENCRYPTION_WORKERS or 1)')
+    parser.add_argument('--sample-frac', type=float, default=0.5, help='Fraction of policies in sampled_iam_policies, chosen by policy_id hash')
+    parser.add_argument('--sample-size', type=int, help='Fixed-size (reservoir) sample of this many rows instead of a fraction; with --sample-by, this many rows per stratum')
+    parser.add_argument('--sample-by', nargs='+', choices=['region', 'role', 'plan_type'], help='Stratify the sample by these columns')
+    parser.add_argument('--sample-quota', action='append', default=[], help="Fraction or size for one stratum, e.g. 'EU,Admin=0.1' (repeatable, needs --sample-by)")
+    parser.add_argument('--dedup', choices=['first', 'last', 'latest'], help='Drop rows with a repeated policy_id, keeping this one (latest: greatest --dedup-order-by)')
+    parser.add_argument('--dedup-order-by', help="Column that orders the rows of a policy_id for --dedup latest, e.g. 'login_count'")
+    parser.add_argument('--dedup-memory-mb', type=float, help='Memory for dedup state before spilling to disk (default: $IAM_ETL_DEDUP_MEMORY_MB or 256)')
+    parser.add_argument('--aggregates', action='store_true', help="Take the region means in reshaped_iam_policies from the local aggregate store ($IAM_ETL_AGGREGATES) instead of a pivot of this run's rows; they are then cumulative over every policy ever folded into the store")
+
+def add_load_options(parser):
+    """Options of the load stage (--pipelined also needs the transform options)."""
+    parser.add_argument('--bulk', action='store_true', help='Load with COPY into a staging table and a single set-based merge')
+    parser.add_argument('--upsert', action='store_true', help='Update changed rows (ON CONFLICT DO UPDATE) instead of skipping them, with every loader')
+    parser.add_argument('--workers', type=int, help='Bulk load hash partitions over this many connections in parallel')
+    parser.add_argument('--managed-schema', action='store_true', help='Create/migrate the partitioned iam_policies schema (ddl.py) and bulk load into it, deferring indexes on large loads (not over --workers, whose partitions merge into it directly)')
+    parser.add_argument('--batch-rows', type=int, help='Commit the load in batches of this many rows and resume after the last committed batch on a re-run (default: $IAM_ETL_LOAD_BATCH_ROWS or 50000; --bulk loads in one batch without it)')
+    parser.add_argument('--restart-load', action='store_true', help='Ignore the load checkpoint of an earlier failed run and start from the first batch')
+    parser.add_argument('--skip-unchanged', action='store_true', help='Only send rows that are new or changed according to the local change index')
+    parser.add_argument('--pipelined', action='store_true', help='With --chunksize and a load, load each transformed chunk while the next is transformed (psycopg 3, --workers connections)')
+
+def check_load_options(args):
+    """Why the load options can't be combined, or None when they can."""
+    if args.managed_schema and args.pipelined:
+        return "--pipelined loads into the table as it is; it can't be combined with --managed-schema"
+    # Only the row loader and the single-connection bulk load commit in checkpointed batches
+    unbatched = [flag for flag, used in [('--managed-schema', args.managed_schema), ('--workers', args.workers),
+                                         ('--skip-unchanged', args.skip_unchanged), ('--pipelined', args.pipelined)] if used]
+    if args.batch_rows and unbatched:
+        return f"--batch-rows can't be combined with {', '.join(unbatched)}, which load without batches or a checkpoint"
+    return None
+
+# The pipeline stages in order: the module each one runs and the options it takes. A stage's
+# module (and whatever it imports: pandas, numpy, psycopg2, ...) is only imported when the
+# stage runs, so e.g. a load never pays for the extract step's generator (see cli.py).
+STAGES = {
+    'extract': ('extract', add_extract_options),
+    'transform': ('transform', add_transform_options),
+    'load': ('load', add_load_options),
+}
+
+def stage_module(stage):
+    """Import the module of a stage (see STAGES)."""
+    return etl_module(STAGES[stage][0])
+
+def build_parser():
     # Set up argument parsing to allow dynamic execution
     parser = argparse.ArgumentParser(description="Run the ETL pipeline steps")
     parser.add_argument('--extract', action='store_true', help='Run the extract step only')
     parser.add_argument('--transform', action='store_true', help='Run the transform step after extract')
     parser.add_argument('--load', action='store_true', help='Run the load step after transform')
     parser.add_argument('--all', action='store_true', help='Run all steps: extract, transform, and load')
+    add_common_options(parser)
+    for _, add_options in STAGES.values():
+        add_options(parser)
+    return parser
+
+def main(argv=None):
+    run(build_parser().parse_args(argv))
+
+def run(args):
+    """Run the steps selected in args (the options of build_parser; see also cli.py)."""
+    # Structured log lines: one JSON object per stage from metrics.py, plain messages otherwise
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    metrics.reset(trace_memory=args.trace_memory or None)
+
+    error = check_load_options(args)
+    if error:
+        print(f"Error in the load options: {error}")
+        sys.exit(1)
+
+    if args.all or args.extract or args.transform:
+        # Set the random seed for reproducibility (imported here: a load alone needs no numpy)
+        importlib.import_module('numpy').random.seed(42)
+
+    storage = etl_module('storage')
+    fmt = args.format or storage.default_format()
+    extracted_file = storage.frame_path(DATA_DIR, 'iam_policies', fmt)
+    transformed_file = storage.frame_path(DATA_DIR, 'transformed', fmt)
 
-    args = parser.parse_args()
+    # Stage outputs are cached under a hash of their inputs, parameters and code (see stage_cache.py)
+    stage_cache = etl_module('stage_cache')
+    cache = None if args.no_cache else stage_cache.StageCache(args.cache_dir, max_mb=args.cache_max_mb)
+    extract_key = None
+    df_transformed = None
+    loaded = False  # Set when --pipelined already loaded the data during the transform
 
-    # Set the random seed for reproducibility
-    np.random.seed(42)
+    engine = None
+    if args.all or args.transform:
+        try:
+            engine = open_engine(args.encryption, args.encryption_workers)
+        except (ImportError, ValueError) as e:
+            print(f"Error setting up encryption: {e}")
+            sys.exit(1)
+    # Part of the transform's cache key: ciphertexts of another key (or scheme) must not be reused
+    encryption = {'encryption': args.encryption, 'key_id': engine.key_id if engine else None}
+
+    sampler = None
+    try:
+        if args.all or args.transform:
+            sampler = etl_module('sampling').sampler_from_options(args.sample_frac, args.sample_size, args.sample_by, args.sample_quota)
+    except ValueError as e:
+        print(f"Error in the sampling options: {e}")
+        sys.exit(1)
+    sampling = {'sample_frac': args.sample_frac, 'sample_size': args.sample_size,
+                'sample_by': args.sample_by, 'sample_quota': sorted(args.sample_quota)}
+
+    dedup = None
+    if args.dedup and (args.all or args.transform):
+        try:
+            dedup = etl_module('dedup').Deduplicator(args.dedup, order_by=args.dedup_order_by, memory_mb=args.dedup_memory_mb)
+        except ValueError as e:
+            print(f"Error in the dedup options: {e}")
+            sys.exit(1)
+    # The memory budget changes how, not which, rows are kept, so it is not part of the key
+    deduplication = {'dedup': args.dedup, 'dedup_order_by': args.dedup_order_by}
 
     # Handle the options
     if args.all or args.extract:
         # Run the extract step which will auto-generate the CSV file
-        df = run_extract()
+        # With --chunksize the transform step streams from disk, so the frame is not kept in memory
+        # Only an in-memory transform in this run needs the frame back
+        return_df = not args.chunksize and (args.all or args.transform)
+        if cache is not None:
+            df, extract_key = cached_extract(cache, args.force, extracted_file, args.rows, args.extract_workers, return_df=return_df)
+        else:
+            df = run_extract(extracted_file, args.rows, args.extract_workers, return_df=return_df)
         if df is None:
             print("Extraction failed. Exiting...")
             sys.exit(1)
     
-    if args.all or args.transform:
-        if 'df' not in locals():
-            print("Please run extract first, as transformation depends on extraction.")
-            sys.exit(1)
-        df_transformed, df_sampled, df_reshaped = run_transform(df)
-        if df_transformed is None:
-            print("Transformation failed. Exiting...")
+    if (args.all or args.transform) and args.chunksize:
+        # Streaming mode reads the extracted file from disk instead of the in-memory frame
+        if not os.path.exists(extracted_file):
+            print("Error: Extracted data not found. Please run extract first.")
             sys.exit(1)
+        key = None
+        if cache is not None:
+            # Without an extract in this run, the extracted file's content stands for the input
+            input_key = extract_key or stage_cache.file_fingerprint(extracted_file)
+            key = cache.key('transform', inputs=[input_key], code=TRANSFORM_CODE,
+                            params={'format': fmt, 'chunksize': args.chunksize, 'aggregates': args.aggregates, **encryption, **sampling, **deduplication})
+        if restore_transform(cache, args.force, key, fmt, args.aggregates) is None:
+            if args.pipelined and (args.all or args.load):
+                result = run_transform_and_load(extracted_file, args.chunksize, fmt, args.snapshots, open_aggregates(args.aggregates), engine, sampler,
+                                                on_conflict='update' if args.upsert else 'nothing', connections=args.workers or 1, dedup=dedup)
+                loaded = result is not None
+            else:
+                result = run_transform_stream(extracted_file, args.chunksize, fmt, args.snapshots, open_aggregates(args.aggregates), engine, sampler, dedup)
+            if result is None:
+                print("Transformation failed. Exiting...")
+                sys.exit(1)
+            store_transform(cache, key, fmt, {'rows_in': result[0], 'rows_out': result[1]}, args.aggregates)
+    elif args.all or args.transform:
+        if 'df' not in locals():
+            # Transform alone: start from the output of an earlier extract
+            if not os.path.exists(extracted_file):
+                print("Please run extract first, as transformation depends on extraction.")
+                sys.exit(1)
+            df = storage.read_frame(extracted_file)
+            if cache is not None:
+                extract_key = stage_cache.file_fingerprint(extracted_file)
+        key = None
+        if cache is not None:
+            key = cache.key('transform', inputs=[extract_key], code=TRANSFORM_CODE,
+                            params={'format': fmt, 'aggregates': args.aggregates, **encryption, **sampling, **deduplication})
+        if restore_transform(cache, args.force, key, fmt, args.aggregates) is None:
+            df_transformed, df_sampled, df_reshaped = run_transform(df, fmt, args.snapshots, open_aggregates(args.aggregates), engine, sampler, args.transform_workers, dedup)
+            if df_transformed is None:
+                print("Transformation failed. Exiting...")
+                sys.exit(1)
+            store_transform(cache, key, fmt, {'rows_out': len(df_transformed)}, args.aggregates)
+
+    if engine is not None:
+        engine.close()
+
+    if (args.all or args.transform) and args.export_csv and fmt != 'csv':
+        print(f"Exported transformed data to '{storage.export_csv(transformed_file)}'.")
 
-    if args.all or args.load:
-        # Check if transformed.csv exists before loading
-        if not os.path.exists('../data/transformed.csv'):
+    if (args.all or args.load) and not loaded:
+        # Check if the transformed data exists before loading
+        if not os.path.exists(transformed_file):
             print("Error: Transformed data not found. Please run the full pipeline (extract + transform) before loading.")
             sys.exit(1)
         else:
-            # Load the transformed data directly from the CSV
-            df_transformed = pd.read_csv('../data/transformed.csv')
-            print(f"Loaded transformed data from 'transformed.csv'.")
-            run_load(df_transformed)
+            load = stage_module('load')
+            on_conflict = 'update' if args.upsert else 'nothing'
+            if args.managed_schema:
+                columns = load.load_columns(on_conflict, etl_module('ddl').CONFLICT_KEY)
+            else:
+                columns = load.load_columns(on_conflict)
+            if df_transformed is not None:
+                # Transformed in this run: hand the frame over in memory instead of re-reading it
+                df_transformed = df_transformed[columns]
+            else:
+                # Read only the columns the loader writes (arrow files are memory-mapped)
+                df_transformed = storage.read_frame(transformed_file, columns=columns)
+                print(f"Loaded transformed data from '{transformed_file}'.")
+            if args.restart_load:
+                etl_module('checkpoint').LoadCheckpoint().clear()
+            run_load(df_transformed, bulk=args.bulk, on_conflict=on_conflict,
+                     workers=args.workers, skip_unchanged=args.skip_unchanged, managed=args.managed_schema,
+                     batch_rows=args.batch_rows)
 
+    metrics.current().write_json(args.metrics_file)
     print("Pipeline execution completed.")
 
 if __name__ == "__main__":
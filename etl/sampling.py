@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+# Samples are chosen by a hash of this column, so a policy is in or out of the sample
+# regardless of which other rows are in the input or how it is chunked
+SAMPLE_COLUMN = 'policy_id'
+
+def hash_fraction(values, salt=None):
+    """A stable pseudo-random number in [0, 1) per value (salt: 16 characters, to draw a different sample)."""
+    hashes = pd.util.hash_pandas_object(values.astype(str), index=False, **({'hash_key': salt} if salt else {}))
+    return hashes.to_numpy() / 2.0**64
+
+def _stratum(key):
+    # groupby keys and the keys of a quota dict, as tuples: 'EU' -> ('EU',)
+    return key if isinstance(key, tuple) else (key,)
+
+def _quotas(quotas):
+    return {_stratum(key): value for key, value in (quotas or {}).items()}
+
+class FractionSampler:
+    """Keeps every row whose policy_id hashes below the sampling fraction.
+
+    Works chunk by chunk with no state, so a streamed input gives the same sample as the
+    whole frame and the same policies stay sampled from run to run. With `by`, `quotas`
+    gives the fraction per stratum, e.g. {('EU', 'Admin'): 0.1}; other strata use `frac`.
+    """
+
+    def __init__(self, frac=0.5, by=None, quotas=None, column=SAMPLE_COLUMN, salt=None):
+        self.frac = frac
+        self.by = list(by) if by else None
+        self.quotas = _quotas(quotas)
+        self.column = column
+        self.salt = salt
+
+    def update(self, chunk):
+        """The sampled rows of a chunk."""
+        u = hash_fraction(chunk[self.column], self.salt)
+        if not self.by:
+            return chunk[u < self.frac]
+        thresholds = np.full(len(chunk), self.frac, dtype=float)
+        for key, positions in chunk.groupby(self.by, observed=True, sort=False).indices.items():
+            thresholds[positions] = self.quotas.get(_stratum(key), self.frac)
+        return chunk[u < thresholds]
+
+    def result(self):
+        """Rows held back until the end of the stream: none, every row is decided in update()."""
+        return None
+
+class ReservoirSampler:
+    """Fixed-size sample over an unbounded stream: the `size` rows with the smallest policy_id hash.
+
+    Memory stays at `size` rows (per stratum with `by`) however long the stream is, and the
+    sample is deterministic: the same policies win in every run and for any chunking.
+    `size` is a number of rows, or with `by` a dict of rows per stratum (`default` for the rest).
+    """
+
+    def __init__(self, size, by=None, default=0, column=SAMPLE_COLUMN, salt=None):
+        self.by = list(by) if by else None
+        self.sizes = _quotas(size) if isinstance(size, dict) else {}
+        self.default = default if isinstance(size, dict) else size
+        self.column = column
+        self.salt = salt
+        self._kept = None
+
+    def update(self, chunk):
+        """Fold a chunk into the reservoir. Nothing is emitted before the end of the stream."""
+        candidates = chunk.assign(_sample_u=hash_fraction(chunk[self.column], self.salt))
+        if self._kept is not None:
+            candidates = pd.concat([self._kept, candidates])
+        candidates = candidates.sort_values('_sample_u', kind='stable')
+        if not self.by:
+            self._kept = candidates.head(self.default)
+            return None
+        keep = np.zeros(len(candidates), dtype=bool)
+        # Positions within a group are in hash order, so the first `limit` of them are its smallest hashes
+        for key, positions in candidates.groupby(self.by, observed=True, sort=False).indices.items():
+            keep[positions[:self.sizes.get(_stratum(key), self.default)]] = True
+        self._kept = candidates[keep]
+        return None
+
+    def result(self):
+        """The sample, ordered by policy_id."""
+        if self._kept is None:
+            return None
+        return self._kept.drop(columns='_sample_u').sort_values(self.column, kind='stable')
+
+def sample_frame(df, sampler):
+    """Run a whole frame through a sampler (see transform_data)."""
+    parts = [part for part in (sampler.update(df), sampler.result()) if part is not None]
+    return pd.concat(parts) if len(parts) > 1 else parts[0] if parts else df.iloc[:0]
+
+def parse_quota(text):
+    """'EU,Admin=0.1' -> (('EU', 'Admin'), 0.1); the value is checked against the mode in sampler_from_options."""
+    stratum, sep, value = text.rpartition('=')
+    if not sep or not stratum:
+        raise ValueError(f"Expected a quota like 'EU,Admin=0.1', got {text!r}")
+    try:
+        return tuple(stratum.split(',')), float(value)
+    except ValueError:
+        raise ValueError(f"Quota {text!r} is not a number") from None
+
+def sampler_from_options(frac=0.5, size=None, by=None, quotas=()):
+    """The sampler for command-line options: a reservoir of `size` rows, or a hash fraction.
+
+    `by` stratifies either mode; `quotas` ('EU,Admin=0.1' strings) override single strata:
+    a row count ('EU=500') with `size`, a fraction in [0, 1] ('EU=0.1') without it.
+    """
+    quotas = dict(parse_quota(quota) for quota in quotas)
+    if quotas and not by:
+        raise ValueError("Per-stratum quotas need the strata columns (by)")
+    if size is not None:
+        for stratum, value in quotas.items():
+            if value < 0 or not value.is_integer():
+                raise ValueError(f"With a sample size, quotas are row counts; got {value} for {','.join(stratum)}")
+        return ReservoirSampler({stratum: int(value) for stratum, value in quotas.items()} or size, by=by, default=size)
+    for stratum, value in quotas.items():
+        if not 0 <= value <= 1:
+            raise ValueError(f"Without a sample size, quotas are fractions in [0, 1]; got {value:g} for {','.join(stratum)}")
+    return FractionSampler(frac, by=by, quotas=quotas)
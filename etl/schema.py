@@ -0,0 +1,149 @@
+import argparse
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('iam_etl.schema')
+
+# Canonical in-memory types of an IAM policy frame. Applied at extract time and whenever a
+# stage output is read back (see storage.py), so every stage works on the same compact layout.
+# Low-cardinality text fields become categoricals with a fixed category order, so chunks
+# and files produced separately still concatenate into one categorical.
+CATEGORIES = {
+    'role': ['Admin', 'User', 'Manager'],
+    'plan_type': ['Enterprise', 'Standard', 'Basic'],
+    'region': ['US', 'EU', 'APAC'],
+    'data_type': ['encrypted', 'non-encrypted'],
+}
+
+# Small counters get the narrowest integer type that holds their domain
+INTEGER_TYPES = {
+    'monthly_rate': 'int32',
+    'login_count': 'int32',
+    'last_login_days': 'int16',
+}
+
+BOOLEAN_COLUMNS = ['premium']
+
+# Prefixes of the generated IDs (see extract.py), used by IdCodec
+ID_PREFIXES = {'policy_id': 'P', 'user_id': 'U'}
+
+def _categorical(values, known):
+    """Categorical with the known categories first; unexpected values are kept, not turned into NaN."""
+    if isinstance(values.dtype, pd.CategoricalDtype) and list(values.cat.categories[:len(known)]) == known:
+        return values
+    extra = sorted(set(values.dropna().unique()) - set(known))
+    if extra:
+        logger.warning(f"Column '{values.name}' has values outside the schema: {extra}")
+    return values.astype(pd.CategoricalDtype(known + extra))
+
+def _integer(values, dtype):
+    """Downcast to `dtype` (nullable if there are NaNs); leave the column alone if it doesn't fit."""
+    numeric = values if pd.api.types.is_numeric_dtype(values) else pd.to_numeric(values, errors='coerce')
+    if numeric.isna().sum() > values.isna().sum():
+        return values  # Holds non-numeric values (e.g. encrypted strings)
+    present = numeric.dropna()
+    limits = np.iinfo(dtype)
+    if len(present) and ((present % 1 != 0).any() or present.min() < limits.min or present.max() > limits.max):
+        return values
+    if numeric.isna().any():
+        return numeric.astype(dtype.capitalize())  # 'int16' -> nullable 'Int16'
+    return numeric.astype(dtype)
+
+def apply_schema(df):
+    """Return df with the canonical dtypes for every known column it has."""
+    df = df.copy(deep=False)
+    for column, known in CATEGORIES.items():
+        if column in df.columns:
+            df[column] = _categorical(df[column], known)
+    for column, dtype in INTEGER_TYPES.items():
+        if column in df.columns:
+            df[column] = _integer(df[column], dtype)
+    for column in BOOLEAN_COLUMNS:
+        if column in df.columns and df[column].notna().all() and df[column].dtype != bool:
+            df[column] = df[column].astype(bool)
+    return df
+
+class IdCodec:
+    """Integer encoding of an ID column, with the lookup needed to turn it back into strings.
+
+    IDs in the generated format (prefix + fixed-width number, e.g. P0000000042) are encoded
+    arithmetically as their number. Any other IDs fall back to an explicit lookup table:
+    the integer is a position in ``table``.
+    """
+
+    def __init__(self, prefix=None, width=None, table=None):
+        self.prefix = prefix
+        self.width = width
+        self.table = table
+
+    @classmethod
+    def fit(cls, values, prefix=''):
+        values = values.astype(str)
+        width = values.str.len().max() - len(prefix) if len(values) else 0
+        if len(values) and values.str.fullmatch(re.escape(prefix) + r'\d{%d}' % width).all():
+            return cls(prefix=prefix, width=width)
+        return cls(table=pd.Index(values.unique()))
+
+    def encode(self, values):
+        if self.table is not None:
+            codes = self.table.get_indexer(values.astype(str))
+            if (codes < 0).any():
+                raise ValueError(f"{int((codes < 0).sum())} IDs are missing from the lookup table")
+            return codes.astype('int32' if len(self.table) < 2**31 else 'int64')
+        return values.astype(str).str.slice(len(self.prefix)).astype('int64').to_numpy()
+
+    def decode(self, codes):
+        codes = np.asarray(codes)
+        if self.table is not None:
+            return self.table.to_numpy()[codes]
+        return np.char.add(self.prefix, np.char.zfill(codes.astype(str), self.width)).astype(object)
+
+def encode_ids(df):
+    """Replace the ID columns by integers. Returns (frame, {column: IdCodec}) for decode_ids."""
+    df = df.copy(deep=False)
+    codecs = {}
+    for column, prefix in ID_PREFIXES.items():
+        if column in df.columns:
+            codecs[column] = IdCodec.fit(df[column], prefix)
+            df[column] = codecs[column].encode(df[column])
+    return df, codecs
+
+def decode_ids(df, codecs):
+    """Turn integer-encoded ID columns back into their strings."""
+    df = df.copy(deep=False)
+    for column, codec in codecs.items():
+        df[column] = codec.decode(df[column].to_numpy())
+    return df
+
+def memory_report(n_rows=1_000_000, seed=42):
+    """Memory per million rows of a generated frame: raw, with the schema, and with encoded IDs."""
+    try:
+        from etl.extract import generate_chunk
+    except ImportError:  # Running from inside etl/
+        from extract import generate_chunk
+    raw = generate_chunk(0, n_rows, np.random.SeedSequence(seed))
+    # generate_chunk already applies the schema; rebuild the untyped layout it used to produce
+    untyped = raw.astype({column: object for column in CATEGORIES}).astype({column: 'int64' for column in INTEGER_TYPES})
+    typed = apply_schema(untyped)
+    encoded, _ = encode_ids(typed)
+
+    scale = 1_000_000 / n_rows
+    report = pd.DataFrame({
+        layout: frame.memory_usage(deep=True, index=False) * scale / 2**20
+        for layout, frame in [('object/int64', untyped), ('schema', typed), ('schema + encoded ids', encoded)]
+    })
+    report.loc['total'] = report.sum()
+    return report.round(2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the memory used per million rows before and after the schema")
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Rows to generate for the measurement')
+    args = parser.parse_args()
+    print(f"MB per million rows (measured on {args.rows} rows):")
+    print(memory_report(args.rows).to_string())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+try:
+    from etl.storage import FrameWriter
+except ImportError:  # Running from inside etl/ (run_all.py imports modules directly)
+    from storage import FrameWriter
+
+# How much of the debug snapshots (transform_before_cleaning, transform_after_cleaning) to write:
+#   off     - nothing, no copies and no serialization
+#   summary - only the first SUMMARY_ROWS rows of each snapshot
+#   full    - every row (the historical behavior)
+SNAPSHOT_LEVELS = ('off', 'summary', 'full')
+SNAPSHOT_ENV = 'IAM_ETL_SNAPSHOTS'
+SUMMARY_ROWS = 100
+
+logger = logging.getLogger('iam_etl.snapshots')
+
+class SnapshotWriter:
+    """Writes debug snapshots from a background thread so disk I/O overlaps with the transform.
+
+    submit() hands over a private copy of the frame and returns immediately; the queue is
+    bounded, so a slow disk applies backpressure instead of buffering unbounded copies.
+    Submitting to the same path again appends to it (used by the streaming transform).
+    close() waits for pending writes and returns the write-latency report.
+    """
+
+    def __init__(self, level=None, max_pending=2):
+        self.level = level or os.environ.get(SNAPSHOT_ENV, 'full')
+        if self.level not in SNAPSHOT_LEVELS:
+            raise ValueError(f"Unknown snapshot level {self.level!r}, expected one of {SNAPSHOT_LEVELS}")
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._writers = {}
+        self._rows_submitted = {}
+        self._latencies = []
+        self._errors = []
+        self._thread = None
+        if self.level != 'off':
+            self._thread = threading.Thread(target=self._run, name='snapshot-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, df, path):
+        """Queue a snapshot of df to be written to path (format from the extension)."""
+        if self.level == 'off':
+            return
+        path = str(path)
+        if self.level == 'summary':
+            remaining = SUMMARY_ROWS - self._rows_submitted.get(path, 0)
+            if remaining <= 0:
+                return
+            df = df.head(remaining)
+        self._rows_submitted[path] = self._rows_submitted.get(path, 0) + len(df)
+        # Copy, because the transform keeps modifying its frame while the snapshot is being written
+        self._queue.put((path, df.copy()))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            path, df = item
+            start = time.perf_counter()
+            try:
+                if path not in self._writers:
+                    self._writers[path] = FrameWriter(path)
+                self._writers[path].write(df)
+            except Exception as e:
+                self._errors.append(f"{path}: {e}")
+            self._latencies.append(time.perf_counter() - start)
+
+    def close(self):
+        """Flush pending snapshots, close the files and report write latency."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            for writer in self._writers.values():
+                writer.close()
+
+        report = {
+            'level': self.level,
+            'snapshots': len(self._latencies),
+            'write_seconds_total': round(sum(self._latencies), 4),
+            'write_seconds_max': round(max(self._latencies, default=0.0), 4),
+            'errors': self._errors,
+        }
+        if self.level != 'off':
+            logger.info(f"Snapshots flushed: {report['snapshots']} writes, {report['write_seconds_total']}s total, "
+                        f"{report['write_seconds_max']}s max, files: {sorted(self._writers)}")
+        for error in self._errors:
+            logger.error(f"Error writing snapshot {error}")
+        return report
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,156 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+logger = logging.getLogger('iam_etl.stage_cache')
+
+# Where cached stage outputs live and how large the cache may grow,
+# e.g. IAM_ETL_CACHE_DIR=/var/cache/iam_etl IAM_ETL_CACHE_MAX_MB=4096
+CACHE_DIR_ENV = 'IAM_ETL_CACHE_DIR'
+CACHE_MAX_MB_ENV = 'IAM_ETL_CACHE_MAX_MB'
+DEFAULT_CACHE_DIR = '../data/cache'
+DEFAULT_CACHE_MAX_MB = 1024
+
+MANIFEST = 'manifest.json'
+ETL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Bump to invalidate every cache entry when the cache layout itself changes
+CACHE_VERSION = 1
+
+def file_fingerprint(path, block_size=1 << 20):
+    """Content hash of a file."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+def code_version(modules):
+    """Hash of the source of the given etl/ modules, e.g. code_version(['extract', 'schema'])."""
+    digest = hashlib.blake2b(digest_size=20)
+    for module in sorted(modules):
+        digest.update(module.encode())
+        digest.update(file_fingerprint(os.path.join(ETL_DIR, module + '.py')).encode())
+    return digest.hexdigest()
+
+def _size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def _materialize(source, target):
+    """Put a cached file at target. A copy, not a link: the stages rewrite their output files in place."""
+    shutil.copyfile(source, target)
+
+class StageCache:
+    """Content-addressed cache of stage outputs with size-limited LRU eviction.
+
+    An entry is stored under ``key()``, a hash of the stage's inputs, parameters and the
+    source of the code that produces it, so any change to one of them is a miss and an
+    unchanged rerun is a hit. ``restore()`` puts the cached files back where the stage
+    would have written them; ``store()`` keeps a copy of a stage's output files. Every
+    hit refreshes an entry's last use; the least recently used entries are evicted once
+    the cache is larger than ``max_mb``.
+    """
+
+    def __init__(self, root=None, max_mb=None):
+        self.root = str(root or os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR))
+        if max_mb is None:
+            max_mb = float(os.environ.get(CACHE_MAX_MB_ENV, DEFAULT_CACHE_MAX_MB))
+        self.max_bytes = int(max_mb * 2**20)
+        os.makedirs(self.root, exist_ok=True)
+        self.stats = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+
+    def key(self, stage, inputs=(), params=None, code=()):
+        """Cache key of a stage run: inputs are fingerprints (or keys of upstream stages)."""
+        payload = {'version': CACHE_VERSION, 'stage': stage, 'inputs': list(inputs),
+                   'params': params or {}, 'code': code_version(code)}
+        return stage + '-' + hashlib.blake2b(json.dumps(payload, sort_keys=True).encode(), digest_size=20).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    def restore(self, key, targets):
+        """Materialize a cached entry's files at targets ({name: path}). Returns its metadata, or None on a miss."""
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            self.stats['misses'] += 1
+            logger.info(f"Stage cache miss for {key}")
+            return None
+        if set(targets) - set(manifest['files']):
+            self.stats['misses'] += 1
+            logger.info(f"Stage cache entry {key} lacks {sorted(set(targets) - set(manifest['files']))}, treating it as a miss")
+            return None
+        for name, target in targets.items():
+            _materialize(os.path.join(entry, manifest['files'][name]), target)
+        os.utime(os.path.join(entry, MANIFEST))  # Last use, for the LRU eviction
+        self.stats['hits'] += 1
+        logger.info(f"Stage cache hit for {key}, restored {sorted(targets)}")
+        return manifest['meta']
+
+    def store(self, key, files, meta=None):
+        """Keep copies of a stage's output files ({name: path}) under key, then evict down to the size limit."""
+        entry = self._entry(key)
+        partial = f"{entry}.partial-{os.getpid()}"
+        shutil.rmtree(partial, ignore_errors=True)
+        os.makedirs(partial)
+        names = {}
+        for name, path in files.items():
+            names[name] = name + os.path.splitext(str(path))[1]
+            shutil.copyfile(path, os.path.join(partial, names[name]))
+        with open(os.path.join(partial, MANIFEST), 'w') as f:
+            json.dump({'key': key, 'created': time.time(), 'files': names, 'meta': meta or {}}, f, indent=2)
+        # Readers only ever see complete entries
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(partial, entry)
+        self.stats['stored'] += 1
+        self.evict()
+
+    def entries(self):
+        """(last use, size in bytes, key) of every complete entry, least recently used first."""
+        found = []
+        for key in os.listdir(self.root):
+            manifest = os.path.join(self._entry(key), MANIFEST)
+            if '.partial-' not in key and os.path.exists(manifest):
+                found.append((os.path.getmtime(manifest), _size(self._entry(key)), key))
+        return sorted(found)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+            self.stats['evicted'] += 1
+            logger.info(f"Stage cache evicted {key} ({size / 2**20:.1f} MB)")
+        return total
+
+    def clear(self):
+        for _, _, key in self.entries():
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the stage output cache")
+    parser.add_argument('--cache-dir', help=f'Cache directory (default: ${CACHE_DIR_ENV} or {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--clear', action='store_true', help='Remove every cached entry')
+    args = parser.parse_args()
+
+    cache = StageCache(args.cache_dir)
+    if args.clear:
+        cache.clear()
+    entries = cache.entries()
+    for last_use, size, key in entries:
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_use))}  {size / 2**20:10.1f} MB  {key}")
+    print(f"{cache.root}: {len(entries)} entries, {sum(size for _, size, _ in entries) / 2**20:.1f} MB "
+          f"of {cache.max_bytes / 2**20:.0f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+
+import pandas as pd
+
+try:
+    from etl.schema import apply_schema
+except ImportError:  # Running from inside etl/ (run_all.py imports modules directly)
+    from schema import apply_schema
+
+# Intermediate file formats between the pipeline stages, by file extension.
+# 'parquet' and 'arrow' (Arrow IPC) are typed and columnar and need pyarrow; 'csv' stays available for exports.
+FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+# Default format when none is given, e.g. IAM_ETL_FORMAT=arrow
+FORMAT_ENV = 'IAM_ETL_FORMAT'
+
+# Default compression per format. Arrow files stay uncompressed so they can be memory-mapped
+# without copying; pass compression='lz4' or 'zstd' to trade that for smaller files.
+DEFAULT_COMPRESSION = {'parquet': 'zstd', 'arrow': None}
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("The 'parquet' and 'arrow' formats need pyarrow (pip install pyarrow)") from e
+    return pyarrow
+
+def default_format():
+    fmt = os.environ.get(FORMAT_ENV, 'csv')
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r} in {FORMAT_ENV}, expected one of {sorted(FORMATS)}")
+    return fmt
+
+def frame_path(directory, name, fmt=None):
+    """Path of a stage output, e.g. frame_path('../data', 'transformed', 'arrow') -> '../data/transformed.arrow'."""
+    return os.path.join(directory, name + FORMATS[fmt or default_format()])
+
+def format_of(path):
+    """Format of a file, from its extension."""
+    extension = os.path.splitext(str(path))[1]
+    for fmt, known in FORMATS.items():
+        if extension == known:
+            return fmt
+    raise ValueError(f"Cannot tell the format of {path!r}, expected one of {sorted(FORMATS.values())}")
+
+def _typed(df):
+    """Make object columns writable as a single Arrow type.
+
+    Object columns that mix types (e.g. numbers and strings in a hand-edited CSV) are
+    stored as strings (missing values stay null). The transform itself keeps ciphertext in
+    separate '_enc' columns, so its value columns are never mixed.
+    """
+    mixed = [column for column in df.columns if df[column].dtype == object
+             and pd.api.types.infer_dtype(df[column], skipna=True) not in ('string', 'boolean', 'empty')]
+    if not mixed:
+        return df
+    df = df.copy()
+    for column in mixed:
+        df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
+
+class FrameWriter:
+    """Write a frame in one or more chunks to a csv, parquet or arrow file (format from the extension)."""
+
+    def __init__(self, path, compression=None):
+        self.path = str(path)
+        self.fmt = format_of(self.path)
+        self.compression = compression if compression is not None else DEFAULT_COMPRESSION.get(self.fmt)
+        self.rows = 0
+        self._schema = None
+        self._writer = None
+
+    def write(self, df):
+        if self.fmt == 'csv':
+            first = self._schema is None
+            df.to_csv(self.path, mode='w' if first else 'a', header=first, index=False)
+            self._schema = list(df.columns)
+        else:
+            pa = _pyarrow()
+            if self._schema is None:
+                table = pa.Table.from_pandas(_typed(df), preserve_index=False)
+                # Columns that are all-null in the first chunk would otherwise be typed as null
+                self._schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                          for field in table.schema])
+                table = table.cast(self._schema)
+                if self.fmt == 'parquet':
+                    self._writer = pa.parquet.ParquetWriter(self.path, self._schema, compression=self.compression or 'none')
+                else:
+                    options = pa.ipc.IpcWriteOptions(compression=self.compression)
+                    self._writer = pa.ipc.new_file(self.path, self._schema, options=options)
+            else:
+                # Later chunks are cast to the schema of the first one
+                table = pa.Table.from_pandas(_typed(df), preserve_index=False).cast(self._schema)
+            self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        elif self._schema is None and self.fmt == 'csv':
+            open(self.path, 'w').close()  # Nothing was written: leave an empty file behind, like to_csv would
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def write_frame(df, path, compression=None):
+    """Write a whole frame to `path` in the format given by its extension."""
+    with FrameWriter(path, compression=compression) as writer:
+        writer.write(df)
+    return str(path)
+
+def read_frame(path, columns=None):
+    """Read a stage output, optionally only the given columns, with the canonical dtypes (schema.py).
+
+    Arrow files are memory-mapped, so only the pages of the requested columns are read.
+    """
+    fmt = format_of(path)
+    if fmt == 'csv':
+        return apply_schema(pd.read_csv(path, usecols=columns))
+    pa = _pyarrow()
+    if fmt == 'parquet':
+        return apply_schema(pa.parquet.read_table(path, columns=columns).to_pandas())
+    # The mapping stays open for as long as the table's buffers reference it
+    table = pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return apply_schema(table.to_pandas())
+
+def iter_frame_chunks(path, chunk_size):
+    """Yield a stage output as DataFrames of about chunk_size rows, with the canonical dtypes."""
+    fmt = format_of(path)
+    if fmt == 'csv':
+        for chunk in pd.read_csv(path, chunksize=chunk_size):
+            yield apply_schema(chunk)
+        return
+    pa = _pyarrow()
+    if fmt == 'parquet':
+        for batch in pa.parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield apply_schema(batch.to_pandas())
+        return
+    reader = pa.ipc.open_file(pa.memory_map(str(path), 'r'))
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        for start in range(0, batch.num_rows, chunk_size):
+            yield apply_schema(batch.slice(start, chunk_size).to_pandas())
+
+def export_csv(path, csv_path=None):
+    """Export a parquet/arrow stage output to CSV (next to it by default)."""
+    csv_path = csv_path or os.path.splitext(str(path))[0] + FORMATS['csv']
+    with FrameWriter(csv_path) as writer:
+        for chunk in iter_frame_chunks(path, 1_000_000):
+            writer.write(chunk)
+    return csv_path
@@ -1,116 +1,357 @@
 import pandas as pd
 import base64
+import logging
+
+try:
+    from etl import metrics
+    from etl.dedup import dedupe_chunks, dedupe_frame
+    from etl.sampling import FractionSampler, sample_frame
+    from etl.snapshots import SnapshotWriter
+    from etl.storage import FrameWriter, frame_path, write_frame
+except ImportError:  # Running from inside etl/ (run_all.py imports 'transform' directly)
+    import metrics
+    from dedup import dedupe_chunks, dedupe_frame
+    from sampling import FractionSampler, sample_frame
+    from snapshots import SnapshotWriter
+    from storage import FrameWriter, frame_path, write_frame
+
+logger = logging.getLogger('iam_etl.transform')
 
 # Function to "encode" data (simulating encryption)
 def encode_data(data):
     """Simulate encryption by encoding the data using base64."""
     if pd.isna(data):  # Skip NaN values
-        print(f"Skipping encryption for NaN value: {data}")  # Debugging
+        logger.debug(f"Skipping encryption for NaN value: {data}")  # Debugging
         return data
     try:
         encoded_data = base64.b64encode(str(data).encode('utf-8'))
         return encoded_data.decode('utf-8')  # Return as a string
     except Exception as e:
-        print(f"Error encoding data: {data} ({e})")  # Debugging
+        logger.error(f"Error encoding data: {data} ({e})")  # Debugging
         return data
 
+# Columns that hold sensitive values for rows flagged as 'encrypted'
+ENCRYPTED_COLUMNS = ['monthly_rate', 'login_count', 'last_login_days']
+
+# The ciphertext of an encrypted value goes to a companion column ('monthly_rate_enc'), so the
+# value column itself stays numeric (NULL for encrypted rows) instead of mixing numbers and strings
+CIPHERTEXT_SUFFIX = '_enc'
+
+def ciphertext_column(column):
+    """Name of the companion column holding the ciphertext of `column`."""
+    return column + CIPHERTEXT_SUFFIX
+
+def encode_column(values, mask):
+    """Ciphertext for the masked slice of a column (None elsewhere), encoding each distinct value once.
+
+    Produces the same values as calling ``encode_data`` row by row, but the
+    (expensive) encoding runs once per distinct value instead of once per row.
+    """
+    encoded = pd.Series(None, index=values.index, dtype=object)
+    if not mask.any():
+        return encoded
+
+    masked = values[mask]
+    # Encode each distinct value once, then map the results back onto the slice
+    mapping = {value: encode_data(value) for value in masked.dropna().unique()}
+    encoded.loc[mask] = masked.map(mapping)  # NaN values are not in the mapping and stay missing
+    return encoded
+
+def _nullable(values):
+    """Nullable version of an integer column, so masking values out keeps integers integers."""
+    if values.dtype.kind == 'i':
+        return values.astype(values.dtype.name.capitalize())  # 'int32' -> 'Int32'
+    return values
+
+def encrypt_column(values, mask, column, engine):
+    """AES-GCM ciphertext of the masked slice of a column (None elsewhere), see encryption.py."""
+    encrypted = pd.Series(None, index=values.index, dtype=object)
+    if mask.any():
+        masked = values[mask]
+        encrypted.loc[mask] = engine.encrypt(masked.astype(object).where(masked.notna(), None).tolist(), column)
+    return encrypted
+
+def encrypt_columns(df, columns=ENCRYPTED_COLUMNS, engine=None):
+    """Encrypt the given columns for every row whose 'data_type' is 'encrypted'.
+
+    The ciphertext is stored in ``<column>_enc`` and the plaintext is removed from the
+    (numeric) value column, which becomes nullable. Without an EncryptionEngine the
+    ciphertext is the base64 encoding of encode_data.
+    """
+    # Take the mask once and reuse it for every column
+    mask = (df['data_type'] == 'encrypted').to_numpy()
+    for column in columns:
+        if engine is None:
+            df[ciphertext_column(column)] = encode_column(df[column], mask)
+        else:
+            df[ciphertext_column(column)] = encrypt_column(df[column], mask, column, engine)
+        if mask.any():
+            df[column] = _nullable(df[column]).mask(mask)
+    return df
+
+def has_value(df, column):
+    """Rows where `column` has a value, either in clear or as ciphertext."""
+    present = df[column].notna()
+    companion = ciphertext_column(column)
+    if companion in df.columns:
+        present |= df[companion].notna()
+    return present
+
+def drop_missing(df, columns=ENCRYPTED_COLUMNS):
+    """Drop rows missing any of the columns; encrypted values count as present."""
+    keep = pd.Series(True, index=df.index)
+    for column in columns:
+        keep &= has_value(df, column)
+    return df[keep]
+
+# Files written by the transform step (the extension depends on the output format)
+STAGE_OUTPUTS = ['transform_before_cleaning', 'transform_after_cleaning', 'transformed',
+                 'sampled_iam_policies', 'reshaped_iam_policies']
+
+# Columns averaged per region for 'reshaped_iam_policies.csv'
+RESHAPE_COLUMNS = ['monthly_rate', 'login_count']
+
+class RegionAggregator:
+    """Running per-region sums and counts, merged into the same table as the region pivot."""
+
+    def __init__(self, columns=RESHAPE_COLUMNS):
+        self.columns = sorted(columns)  # pivot_table orders the value columns alphabetically
+        self.sums = pd.DataFrame(columns=self.columns, dtype=float)
+        self.counts = pd.DataFrame(columns=self.columns, dtype=float)
+        self.rows = 0
+
+    def update(self, df):
+        """Fold one chunk of (unencrypted) rows into the running totals."""
+        grouped = df.groupby('region', observed=True)[self.columns]  # Only regions present, also for categoricals
+        self.sums = self.sums.add(grouped.sum(), fill_value=0)
+        self.counts = self.counts.add(grouped.count(), fill_value=0)
+        self.rows += df.shape[0]
+
+    def partials(self):
+        """The running sums and counts as one frame (region, statistic, <columns>), e.g. to merge partitions."""
+        partials = pd.concat({'sum': self.sums, 'count': self.counts}, names=['statistic', 'region'])
+        return partials.reset_index().assign(rows=self.rows)
+
+    @classmethod
+    def from_partials(cls, frames, columns=RESHAPE_COLUMNS):
+        """Merge the partials() of several aggregators (e.g. one per partition) into one."""
+        aggregator = cls(columns)
+        for partials in frames:
+            partials = partials.set_index('region')
+            aggregator.sums = aggregator.sums.add(partials[partials['statistic'] == 'sum'][aggregator.columns], fill_value=0)
+            aggregator.counts = aggregator.counts.add(partials[partials['statistic'] == 'count'][aggregator.columns], fill_value=0)
+            aggregator.rows += int(partials['rows'].iloc[0]) if len(partials) else 0
+        return aggregator
+
+    def result(self):
+        """Per-region means, laid out like pivot_table(index=['region'], aggfunc='mean')."""
+        # Same guard as transform_data: only reshape if there is sufficient data
+        if self.rows <= 1 or len(self.sums.index) <= 1:
+            return pd.DataFrame()
+        df_reshaped = self.sums / self.counts
+        df_reshaped.index.name = 'region'
+        return df_reshaped.sort_index()
+
 def clean_and_convert_column(df, column_name):
     """Helper function to clean and convert a column to numeric."""
-    # Skip the conversion of encrypted values (already Base64 encoded)
-    if 'encrypted' in df['data_type'].values:
-        print(f"Skipping numeric conversion for '{column_name}' due to 'encrypted' data type.")
-    else:
-        # Convert to numeric, forcing errors to NaN, and display how many invalid entries are there.
-        df[column_name] = pd.to_numeric(df[column_name], errors='coerce')
-
-    # Count how many NaN values are introduced due to invalid values
-    invalid_count = df[column_name].isna().sum()
+    # Convert to numeric, forcing errors to NaN. Encrypted values live in the '_enc'
+    # companion column, so the value column is always numeric (or convertible) here.
+    df[column_name] = pd.to_numeric(df[column_name], errors='coerce')
+
+    # Count how many NaN values are introduced due to invalid values (encrypted rows don't count)
+    invalid_count = (~has_value(df, column_name)).sum()
     if invalid_count > 0:
-        print(f"Warning: {invalid_count} invalid entries in column '{column_name}' have been converted to NaN.")
+        logger.warning(f"{invalid_count} invalid entries in column '{column_name}' have been converted to NaN.")
     
     return df
 
-def transform_data(df):
-    """Transform the data based on the given rules."""
-    
-    print(f"Initial DataFrame head:\n{df.head()}")  # Debugging: Check initial data
+def _log_head(label, df):
+    """Log the first rows of a frame at DEBUG level (formatting a frame costs time, so only when enabled)."""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"{label}:\n{df.head()}")
 
-    # **Reshape data first** (before encryption) to ensure numeric columns for reshaping
-    print(f"Rows to be reshaped:\n{df.head()}")
+def write_reshaped(df_reshaped, path):
+    """Write the region means with their region labels as a column (the index is not written)."""
+    write_frame(df_reshaped.reset_index() if not df_reshaped.empty else df_reshaped, path)
+
+def transform_data(df, output_dir='../data', fmt=None, snapshot_level=None, aggregates=None, engine=None, sampler=None, dedup=None):
+    """Transform the data based on the given rules.
+
+    Outputs are written to `output_dir` in `fmt` ('csv', 'parquet' or 'arrow', see storage.py).
+    The before/after cleaning debug snapshots are written in the background at
+    `snapshot_level` ('off', 'summary' or 'full', see snapshots.py).
+    With an AggregateStore (see aggregates.py) as `aggregates`, the region means come from
+    the store after folding in this run's delta, instead of a pivot over the whole frame.
+    With an EncryptionEngine as `engine` (see encryption.py) the sensitive values are
+    AES-GCM encrypted instead of base64 encoded.
+    `sampler` picks the rows of sampled_iam_policies (see sampling.py); by default the
+    policies whose policy_id hashes into a 50% fraction.
+    With a Deduplicator as `dedup` (see dedup.py), rows with a repeated policy_id are
+    dropped first, so they count neither in the region means nor in the outputs.
+    Every sub-step is timed in the current run's metrics (see metrics.py).
+    """
+    paths = {name: frame_path(output_dir, name, fmt) for name in STAGE_OUTPUTS}
+    snapshots = SnapshotWriter(snapshot_level)
 
+    _log_head("Initial DataFrame head", df)  # Debugging: Check initial data
+
+    # Drop repeated policy_ids up front (the loader would only skip them after a round trip)
+    if dedup is not None:
+        with metrics.stage('dedup', rows_in=len(df)) as step:
+            df = dedupe_frame(df, dedup)
+            step['rows_out'] = len(df)
+
+    # **Reshape data first** (before encryption) to ensure numeric columns for reshaping
     # Check for enough data to reshape
-    print(f"Unique regions before reshaping: {df['region'].nunique()}")  # Number of unique regions
-    print(f"Missing values in 'region' column before reshaping: {df['region'].isna().sum()}")  # Check missing regions
-
-    # Only reshape if there is sufficient data
-    if df.shape[0] > 1 and df['region'].nunique() > 1:  # Ensure there's enough data left for reshaping
-        # Optional: Reshape the data (example: pivoting or aggregating)
-        try:
-            # Now that the columns are numeric, we can safely compute the mean
-            print(f"Attempting to reshape data with {df['region'].nunique()} unique regions.")
-            df_reshaped = df.pivot_table(index=['region'], values=['monthly_rate', 'login_count'], aggfunc='mean')
-            print(f"Reshaped DataFrame head:\n{df_reshaped.head()}")  # Check reshaped data
-        except Exception as e:
-            print(f"Error during reshaping: {e}")
-            df_reshaped = pd.DataFrame()  # Create an empty DataFrame in case of error
-    else:
-        df_reshaped = pd.DataFrame()  # No data to reshape if we don't have enough rows
+    logger.debug(f"Unique regions before reshaping: {df['region'].nunique()}")  # Number of unique regions
+    logger.debug(f"Missing values in 'region' column before reshaping: {df['region'].isna().sum()}")  # Check missing regions
+
+    with metrics.stage('pivot', rows_in=len(df)) as step:
+        if aggregates is not None:
+            aggregates.update(df)  # Only new and changed rows touch the cube
+            df_reshaped = aggregates.region_means(RESHAPE_COLUMNS)
+        # Only reshape if there is sufficient data
+        elif df.shape[0] > 1 and df['region'].nunique() > 1:  # Ensure there's enough data left for reshaping
+            # Optional: Reshape the data (example: pivoting or aggregating)
+            try:
+                # Now that the columns are numeric, we can safely compute the mean
+                logger.debug(f"Attempting to reshape data with {df['region'].nunique()} unique regions.")
+                df_reshaped = df.pivot_table(index=['region'], values=['monthly_rate', 'login_count'], aggfunc='mean', observed=True)
+                _log_head("Reshaped DataFrame head", df_reshaped)  # Check reshaped data
+            except Exception as e:
+                logger.error(f"Error during reshaping: {e}")
+                df_reshaped = pd.DataFrame()  # Create an empty DataFrame in case of error
+        else:
+            df_reshaped = pd.DataFrame()  # No data to reshape if we don't have enough rows
+        step['rows_out'] = len(df_reshaped)
 
     # **Encrypt the data** after reshaping
-    print(f"Encrypting the data...")
+    logger.info("Encrypting the data...")
 
     # Encrypt the fields where 'data_type' is 'encrypted' (i.e., simulate encryption)
-    df['monthly_rate'] = df.apply(
-        lambda row: encode_data(row['monthly_rate']) if row['data_type'] == 'encrypted' else row['monthly_rate'], axis=1)
-    
-    df['login_count'] = df.apply(
-        lambda row: encode_data(row['login_count']) if row['data_type'] == 'encrypted' else row['login_count'], axis=1)
-    
-    df['last_login_days'] = df.apply(
-        lambda row: encode_data(row['last_login_days']) if row['data_type'] == 'encrypted' else row['last_login_days'], axis=1)
+    with metrics.stage('encrypt', rows_in=len(df)) as step:
+        df = encrypt_columns(df, engine=engine)
+        step['rows_out'] = len(df)
 
     # Debugging: Check data after encryption
-    print(f"Data after encryption:\n{df.head()}")
+    _log_head("Data after encryption", df)
 
     # **Save the data before cleaning** and converting
-    df.to_csv('../data/transform_before_cleaning.csv', index=False)
-    print(f"Data before cleaning and conversion saved to '../data/transform_before_cleaning.csv'")
+    snapshots.submit(df, paths['transform_before_cleaning'])
+    logger.debug(f"Data before cleaning and conversion queued for '{paths['transform_before_cleaning']}'")
 
-    # **Clean and convert** the columns to numeric (but skip `encrypted` data)
-    df = clean_and_convert_column(df, 'monthly_rate')
-    df = clean_and_convert_column(df, 'login_count')
-    df = clean_and_convert_column(df, 'last_login_days')
+    # **Clean and convert** the columns to numeric (encrypted values are in the '_enc' columns)
+    with metrics.stage('clean', rows_in=len(df)) as step:
+        df = clean_and_convert_column(df, 'monthly_rate')
+        df = clean_and_convert_column(df, 'login_count')
+        df = clean_and_convert_column(df, 'last_login_days')
+        step['rows_out'] = len(df)
 
-    print(f"Data after cleaning and conversion to numeric:\n{df.head()}")  # Check data after conversion
+    _log_head("Data after cleaning and conversion to numeric", df)  # Check data after conversion
 
     # **Save the data after cleaning** but before dropping NaNs
-    df.to_csv('../data/transform_after_cleaning.csv', index=False)
-    print(f"Data after cleaning and conversion saved to '../data/transform_after_cleaning.csv'")
+    snapshots.submit(df, paths['transform_after_cleaning'])
+    logger.debug(f"Data after cleaning and conversion queued for '{paths['transform_after_cleaning']}'")
 
-    # **Check how many rows are being dropped** when we remove NaNs
-    print(f"Data before dropping NaNs: {df.shape[0]} rows.")
-    
-    # Remove rows where any of the numeric columns are NaN (check for missing data)
-    df = df.dropna(subset=['monthly_rate', 'login_count', 'last_login_days'])
+    # Remove rows where any of the numeric columns are missing (in clear and encrypted)
+    with metrics.stage('dropna', rows_in=len(df)) as step:
+        df = drop_missing(df)
+        step['rows_out'] = len(df)
 
-    print(f"Data after dropping NaNs:\n{df.head()}")  # Check data after removing NaNs
-    print(f"Remaining data after dropping NaNs: {df.shape[0]} rows.")  # How many rows remain?
+    _log_head("Data after dropping NaNs", df)  # Check data after removing NaNs
+    logger.info(f"Remaining data after dropping NaNs: {df.shape[0]} of {step['rows_in']} rows.")  # How many rows remain?
 
-    # **Sample the data** (take a 50% sample for example)
-    df_sampled = df.sample(frac=0.5, random_state=42)
+    # **Sample the data** (take a 50% sample for example), by policy_id hash so it is stable across runs
+    with metrics.stage('sample', rows_in=len(df)) as step:
+        df_sampled = sample_frame(df, sampler or FractionSampler(0.5))
+        step['rows_out'] = len(df_sampled)
 
     # Debugging: Print transformed data
-    print(f"Transformed DataFrame head:\n{df.head()}")  # Check the transformation
-    print(f"Sampled DataFrame head:\n{df_sampled.head()}")  # Check sampled data
-    print(f"Reshaped DataFrame head:\n{df_reshaped.head()}")  # Check reshaped data
+    _log_head("Transformed DataFrame head", df)  # Check the transformation
+    _log_head("Sampled DataFrame head", df_sampled)  # Check sampled data
+
+    # Save the DataFrames
+    with metrics.stage('write', rows_in=len(df) + len(df_sampled) + len(df_reshaped)):
+        write_frame(df, paths['transformed'])  # Save transformed data to 'transformed'
+        write_frame(df_sampled, paths['sampled_iam_policies'])  # Save sampled data
+        write_reshaped(df_reshaped, paths['reshaped_iam_policies'])  # Save reshaped data
 
-    # Save the DataFrames to CSV files
-    df.to_csv('../data/transformed.csv', index=False)  # Save transformed data to 'transformed.csv'
-    df_sampled.to_csv('../data/sampled_iam_policies.csv', index=False)  # Save sampled data
-    df_reshaped.to_csv('../data/reshaped_iam_policies.csv', index=False)  # Save reshaped data
+        # Wait for the debug snapshots to reach the disk
+        snapshots.close()
 
     # Confirmation message for saved files
-    print("Data saved to '../data/transformed.csv', '../data/sampled_iam_policies.csv', and '../data/reshaped_iam_policies.csv'.")
+    logger.info(f"Data saved to '{paths['transformed']}', '{paths['sampled_iam_policies']}', and '{paths['reshaped_iam_policies']}'.")
 
     # Return transformed data, sampled data, and reshaped data
     return df, df_sampled, df_reshaped
+
+def transform_stream(chunks, output_dir='../data', fmt=None, sample_frac=0.5, snapshot_level=None, aggregates=None, engine=None, sampler=None, on_chunk=None, dedup=None):
+    """Streaming version of transform_data for iterators of chunks, e.g. pd.read_csv(chunksize=...).
+
+    Every chunk is encrypted, cleaned, filtered and sampled on its own and appended to
+    the output files, so peak memory depends on the chunk size and not on the dataset.
+    The region means are kept as running sums and counts (or folded into `aggregates`
+    chunk by chunk) and written once at the end. Rows are sampled by `sampler`
+    (default: a `sample_frac` policy_id hash fraction, the same rows as transform_data).
+    `on_chunk` is called with every transformed chunk once it is written, e.g. to hand
+    it to a loader running concurrently (see async_load.py). With a Deduplicator as
+    `dedup`, repeated policy_ids are dropped from the stream first (rows_in counts the
+    rows after that; see dedup.py for the rows it holds back until the end).
+    """
+    paths = {name: frame_path(output_dir, name, fmt) for name in STAGE_OUTPUTS}
+    writers = {name: FrameWriter(paths[name]) for name in ['transformed', 'sampled_iam_policies']}
+    snapshots = SnapshotWriter(snapshot_level)
+    aggregator = RegionAggregator()
+    sampler = sampler or FractionSampler(sample_frac)
+    rows_in = rows_out = 0
+    if dedup is not None:
+        chunks = dedupe_chunks(chunks, dedup)
+
+    try:
+        for chunk in chunks:
+            rows_in += chunk.shape[0]
+
+            # Aggregate before encryption, while the columns are still numeric.
+            # Sub-steps are timed per chunk and add up in the run's metrics.
+            with metrics.stage('pivot', rows_in=len(chunk)):
+                (aggregator if aggregates is None else aggregates).update(chunk)
+
+            with metrics.stage('encrypt', rows_in=len(chunk)):
+                chunk = encrypt_columns(chunk, engine=engine)
+            snapshots.submit(chunk, paths['transform_before_cleaning'])
+
+            with metrics.stage('clean', rows_in=len(chunk)):
+                for column in ENCRYPTED_COLUMNS:
+                    chunk = clean_and_convert_column(chunk, column)
+            snapshots.submit(chunk, paths['transform_after_cleaning'])
+
+            with metrics.stage('dropna', rows_in=len(chunk)) as step:
+                chunk = drop_missing(chunk)
+                step['rows_out'] = len(chunk)
+            rows_out += chunk.shape[0]
+
+            with metrics.stage('sample', rows_in=len(chunk)) as step:
+                sampled = sampler.update(chunk)  # None while a reservoir holds its rows back
+                step['rows_out'] = 0 if sampled is None else len(sampled)
+
+            with metrics.stage('write', rows_in=len(chunk) + step['rows_out']):
+                writers['transformed'].write(chunk)
+                if sampled is not None:
+                    writers['sampled_iam_policies'].write(sampled)
+            if on_chunk is not None:
+                on_chunk(chunk)
+
+        # Rows a reservoir sampler kept until the end of the stream
+        remaining = sampler.result()
+        if remaining is not None:
+            writers['sampled_iam_policies'].write(remaining)
+    finally:
+        for writer in writers.values():
+            writer.close()
+        snapshots.close()
+
+    df_reshaped = aggregates.region_means(RESHAPE_COLUMNS) if aggregates is not None else aggregator.result()
+    write_reshaped(df_reshaped, paths['reshaped_iam_policies'])  # Same layout as transform_data
+
+    logger.info(f"Streamed {rows_in} rows through the transform step, {rows_out} rows written to '{writers['transformed'].path}'.")
+    return rows_in, rows_out, df_reshaped
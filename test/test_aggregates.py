@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+from etl.aggregates import AggregateStore
+from etl.extract import extract_data
+from etl.transform import transform_data
+
+
+@pytest.fixture
+def policies(tmp_path):
+    return extract_data(tmp_path / 'iam_policies.csv', n_rows=300)
+
+
+def test_region_means_match_pivot_table(tmp_path, policies):
+    store = AggregateStore(tmp_path / 'aggregates.sqlite')
+    store.update(policies)
+    expected = policies.pivot_table(index='region', values=['monthly_rate', 'login_count'], aggfunc='mean', observed=True)
+    expected.index = expected.index.astype(str)
+    pd.testing.assert_frame_equal(store.region_means(), expected.sort_index(), check_names=False, check_index_type=False)
+
+
+def test_rollups_from_cells(tmp_path, policies):
+    store = AggregateStore(tmp_path / 'aggregates.sqlite')
+    store.update(policies)
+    totals = store.rollup([], statistic='sum')
+    assert totals['login_count'].iloc[0] == policies['login_count'].sum()
+    by_cell = store.rollup(['region', 'role', 'plan_type'], statistic='max')
+    expected = policies.groupby(['region', 'role', 'plan_type'], observed=True)['monthly_rate'].max()
+    assert by_cell['monthly_rate'].sort_values().tolist() == expected.sort_values().tolist()
+
+
+def test_same_batch_is_applied_once(tmp_path, policies):
+    store = AggregateStore(tmp_path / 'aggregates.sqlite')
+    assert store.update(policies)
+    assert not store.update(policies.sample(frac=1, random_state=1))  # Same rows, different order
+    assert store.rollup([], statistic='rows')['monthly_rate'].iloc[0] == len(policies)
+
+
+def test_changed_rows_replace_their_old_values(tmp_path, policies):
+    store = AggregateStore(tmp_path / 'aggregates.sqlite')
+    store.update(policies)
+    changed = policies.head(10).copy()
+    changed['monthly_rate'] = 10_000
+    store.update(changed)
+    assert store.stats['rows_retracted'] == 10
+    assert store.rollup([], statistic='max')['monthly_rate'].iloc[0] == 10_000
+
+    # Replaying the original data reverts the change, including the max
+    store.update(policies)
+    assert store.rollup([], statistic='max')['monthly_rate'].iloc[0] == policies['monthly_rate'].max()
+    assert store.rollup([], statistic='sum')['monthly_rate'].iloc[0] == policies['monthly_rate'].sum()
+    assert len(store) == len(policies)
+
+
+def test_transform_writes_region_labels(tmp_path, policies):
+    store = AggregateStore(tmp_path / 'aggregates.sqlite')
+    _, _, df_reshaped = transform_data(policies, output_dir=tmp_path, fmt='csv', snapshot_level='off', aggregates=store)
+    written = pd.read_csv(tmp_path / 'reshaped_iam_policies.csv')
+    assert sorted(written['region']) == sorted(df_reshaped.index) == ['APAC', 'EU', 'US']
@@ -0,0 +1,132 @@
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+
+from etl.async_load import load_pipelined
+
+pytest.importorskip('psycopg')
+
+
+class FakeCopy:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def write(self, data):
+        await asyncio.sleep(self.conn.delay)  # The network round trip
+        self.conn.copied.append(data)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def copy(self, query):
+        return FakeCopy(self.conn)
+
+    async def execute(self, query):
+        if self.conn.fail:
+            raise RuntimeError("connection lost")
+        self.rowcount = len(self.conn.copied[-1].splitlines())
+
+
+class FakeContext:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeAsyncConnection:
+    """Records the COPY payloads of an async connection instead of talking to Postgres."""
+
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.copied = []
+        self.closed = False
+
+    def transaction(self):
+        return FakeContext()
+
+    def pipeline(self):
+        return FakeContext()
+
+    async def execute(self, query):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    async def close(self):
+        self.closed = True
+
+
+def make_chunks(n_chunks=6, rows=5):
+    return [pd.DataFrame({
+        'policy_id': [f'P{c * rows + i:04d}' for i in range(rows)],
+        'user_id': 'U1', 'role': 'Admin', 'plan_type': 'Basic', 'monthly_rate': 50, 'premium': True,
+    }) for c in range(n_chunks)]
+
+
+def run(chunks, connections=1, queue_chunks=2, transform_delay=0.0, **conn_options):
+    conns = []
+
+    async def connect():
+        conns.append(FakeAsyncConnection(**conn_options))
+        return conns[-1]
+
+    def produce(on_chunk):
+        for chunk in chunks:
+            time.sleep(transform_delay)  # The transform's CPU work
+            on_chunk(chunk)
+        return 'transformed'
+
+    result = asyncio.run(load_pipelined(produce, connections=connections, queue_chunks=queue_chunks, connect=connect))
+    return result, conns
+
+
+def test_load_pipelined_loads_every_chunk_in_order():
+    chunks = make_chunks()
+    (result, stats), conns = run(chunks, transform_delay=0.01, delay=0.01)
+
+    assert result == 'transformed'
+    assert stats['rows'] == stats['written'] == 30 and stats['chunks'] == 6
+    assert [line.split(',')[0] for data in conns[0].copied for line in data.splitlines()] == \
+        [policy_id for chunk in chunks for policy_id in chunk['policy_id']]
+    assert conns[0].closed
+    # Transform and load took about as long as each other and ran side by side
+    assert stats['seconds'] < stats['sequential_seconds']
+    assert 0 < stats['overlap_efficiency'] <= 1
+
+
+def test_load_pipelined_applies_backpressure_to_the_transform():
+    (_, stats), _ = run(make_chunks(), queue_chunks=1, delay=0.02)
+    assert stats['producer_blocked_seconds'] > 0.02
+
+
+def test_load_pipelined_partitions_chunks_over_connections():
+    (_, stats), conns = run(make_chunks(), connections=3)
+    assert len(conns) == 3 and stats['rows'] == 30
+    loaded = [line.split(',')[0] for conn in conns for data in conn.copied for line in data.splitlines()]
+    assert sorted(loaded) == sorted(set(loaded)) and len(loaded) == 30
+
+
+def test_load_pipelined_failure_does_not_block_the_transform():
+    with pytest.raises(RuntimeError, match='connection lost'):
+        run(make_chunks(n_chunks=10), queue_chunks=1, fail=True)
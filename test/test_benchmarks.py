@@ -0,0 +1,13 @@
+from benchmarks.bench_pipeline import compare, run_size
+
+
+def test_run_size_reports_every_stage(tmp_path):
+    results = run_size(500, str(tmp_path))
+    assert {'extract', 'transform', 'load'} <= set(results)
+    assert all(rows_per_sec > 0 for rows_per_sec in results.values())
+
+
+def test_compare_flags_drops_beyond_threshold():
+    baseline = {'1000': {'extract': 100.0, 'transform': 100.0}}
+    results = {'1000': {'extract': 85.0, 'transform': 79.0, 'load': 5.0}}
+    assert compare(results, baseline, threshold=0.2) == [('transform', '1000', 100.0, 79.0)]
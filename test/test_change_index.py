@@ -0,0 +1,35 @@
+from etl.change_index import ChangeIndex, hash_rows
+from etl.extract import extract_data
+from etl.load import LOAD_COLUMNS, prepare_for_load
+
+
+def test_split_skips_rows_recorded_before(tmp_path):
+    df = prepare_for_load(extract_data(tmp_path / 'iam_policies.csv', n_rows=50), LOAD_COLUMNS)
+    index = ChangeIndex(tmp_path / 'row_hashes.sqlite')
+
+    changed, hashes = index.split(df, LOAD_COLUMNS)
+    assert len(changed) == 50 and index.stats['new'] == 50
+    index.record(changed, hashes)
+
+    # Same data again: nothing to send
+    changed, _ = index.split(df, LOAD_COLUMNS)
+    assert changed.empty and index.stats['hits'] == 50
+
+    # One changed row, one new row
+    df2 = df.copy()
+    df2.loc[df2.index[3], 'role'] = 'Admin' if df2['role'].iloc[3] != 'Admin' else 'User'
+    df2.loc[df2.index[4], 'policy_id'] = 'P9999999999'
+    changed, _ = index.split(df2, LOAD_COLUMNS)
+    assert sorted(changed['policy_id']) == sorted([df['policy_id'].iloc[3], 'P9999999999'])
+    assert index.stats['changed'] == 1 and index.stats['new'] == 51
+
+
+def test_index_persists_between_runs(tmp_path):
+    df = prepare_for_load(extract_data(tmp_path / 'iam_policies.csv', n_rows=20), LOAD_COLUMNS)
+    index = ChangeIndex(tmp_path / 'row_hashes.sqlite')
+    index.record(df, hash_rows(df, LOAD_COLUMNS))
+    index.close()
+
+    reopened = ChangeIndex(tmp_path / 'row_hashes.sqlite')
+    assert len(reopened) == 20
+    assert reopened.split(df, LOAD_COLUMNS)[0].empty
@@ -0,0 +1,42 @@
+import pandas as pd
+import psycopg2
+import pytest
+
+from etl.checkpoint import LoadCheckpoint, backoff_delays, frame_fingerprint, retry
+
+
+def test_checkpoint_resumes_only_the_same_input(tmp_path):
+    checkpoint = LoadCheckpoint(tmp_path / 'checkpoint.json')
+    df = pd.DataFrame({'policy_id': ['P1', 'P2'], 'monthly_rate': [10, 20]})
+    fingerprint = frame_fingerprint(df)
+
+    assert checkpoint.resume(fingerprint) == (0, 0)
+    checkpoint.commit(fingerprint, 1, 1)
+    assert checkpoint.resume(fingerprint) == (1, 1)
+    assert checkpoint.resume(frame_fingerprint(df.assign(monthly_rate=[10, 21]))) == (0, 0)
+    assert checkpoint.resume(frame_fingerprint(df, {'loader': 'bulk'})) == (0, 0)
+    checkpoint.clear()
+    checkpoint.clear()  # Clearing twice is fine
+    assert checkpoint.read() is None
+
+
+def test_backoff_delays_grow_and_are_capped():
+    delays = backoff_delays(retries=8, base=1.0, cap=5.0)
+    assert len(delays) == 8
+    assert all(0 <= delay <= min(5.0, 2 ** attempt) for attempt, delay in enumerate(delays))
+
+
+def test_retry_gives_up_after_the_retries_and_never_retries_other_errors():
+    slept = []
+
+    def always_down():
+        raise psycopg2.OperationalError("could not connect")
+
+    with pytest.raises(psycopg2.OperationalError):
+        retry(always_down, retries=3, sleep=slept.append)
+    assert len(slept) == 3
+
+    calls = []
+    with pytest.raises(KeyError):
+        retry(lambda: calls.append(1) or {}['missing'], retries=3, sleep=slept.append)
+    assert len(calls) == 1
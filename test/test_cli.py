@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ETL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'etl')
+
+# Imported by the stages that need them, never by the CLI itself
+HEAVY_MODULES = {'numpy', 'pandas', 'pyarrow', 'psycopg2', 'psycopg', 'sklearn', 'cryptography'}
+
+
+def cli(*args, importtime=False):
+    flags = ['-X', 'importtime'] if importtime else []
+    return subprocess.run([sys.executable, *flags, 'cli.py', *args], cwd=ETL_DIR, capture_output=True, text=True)
+
+
+def imported(stderr):
+    return {line.split('|')[-1].strip().split('.')[0] for line in stderr.splitlines() if line.startswith('import time:')}
+
+
+@pytest.mark.parametrize('args', [['--help'], ['extract', '--help'], ['load', '--help'], ['run', '--help']])
+def test_help_imports_no_stage_dependencies(args):
+    result = cli(*args, importtime=True)
+    assert result.returncode == 0
+    assert 'usage: cli.py' in result.stdout
+    assert not imported(result.stderr) & HEAVY_MODULES
+
+
+def test_subcommands_only_take_their_stage_options():
+    assert cli('load', '--bulk', '--help').returncode == 0
+    result = cli('extract', '--bulk')
+    assert result.returncode == 2
+    assert 'unrecognized arguments: --bulk' in result.stderr
+
+
+def test_profile_startup_reports_the_budget():
+    # Fails right away (there is no arrow output to load), after the stage imports
+    result = cli('--profile-startup', 'load', '--format', 'arrow', '--no-cache')
+    assert result.returncode == 1
+    assert 'Transformed data not found' in result.stdout
+    assert 'Startup imports:' in result.stdout and '(budget ' in result.stdout
+    startup, pipeline = result.stdout.split('Startup imports:')[1].split('Pipeline imports:')
+    assert 'pandas' in pipeline and 'pandas' not in startup
@@ -1,26 +1,86 @@
-import psycopg2
-
-# Connect to Supabase
-conn = psycopg2.connect(
-    host="db.prwzydmfrcbepgevmqmu.supabase.co",
-    port=5432,
-    database="postgres",
-    user="etl_user1",
-    password="cyuqD639?TT",
-    sslmode="require"
-)
-
-cur = conn.cursor()
-
-# Optional: print current timestamp
-cur.execute("SELECT NOW();")
-print("Current timestamp:", cur.fetchone()[0])
-
-# Fetch and print first 5 rows from your table
-cur.execute("SELECT * FROM policies LIMIT 5;")  # make sure table name matches exactly
-rows = cur.fetchall()
-for row in rows:
-    print(row)
-
-cur.close()
-conn.close()
+import os
+
+import pytest
+
+from etl.db_pool import ConnectionPool, get_pool, close_pool, DSN_ENV
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query):
+        if self.conn.broken:
+            import psycopg2
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+def test_pool_reuses_connections_and_counts_checkouts():
+    opened = []
+    pool = ConnectionPool(minconn=1, maxconn=2, connect=lambda: opened.append(FakeConnection()) or opened[-1])
+
+    for _ in range(5):
+        with pool.connection():
+            pass
+
+    metrics = pool.metrics()
+    assert len(opened) == 1
+    assert metrics['checkouts'] == 5
+    assert metrics['in_use'] == 0 and metrics['idle'] == 1
+
+
+def test_pool_replaces_broken_connection_on_checkout():
+    pool = ConnectionPool(minconn=1, maxconn=1, connect=FakeConnection)
+    with pool.connection() as conn:
+        conn.broken = True
+
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    assert pool.metrics()['health_check_failures'] == 1
+
+
+def test_pool_times_out_when_exhausted():
+    pool = ConnectionPool(minconn=0, maxconn=1, timeout=0.05, connect=FakeConnection)
+    conn = pool.getconn()
+    with pytest.raises(Exception, match="No database connection available"):
+        pool.getconn()
+    pool.putconn(conn)
+    assert pool.metrics()['timeouts'] == 1
+
+
+@pytest.mark.skipif(not os.environ.get(DSN_ENV), reason=f"set {DSN_ENV} to check connectivity to the database")
+def test_connect_url():
+    try:
+        with get_pool().connection() as conn, conn.cursor() as cur:
+            # Optional: print current timestamp
+            cur.execute("SELECT NOW();")
+            print("Current timestamp:", cur.fetchone()[0])
+
+            # Fetch and print first 5 rows from the table the loader writes to
+            cur.execute("SELECT * FROM iam_policies LIMIT 5;")
+            for row in cur.fetchall():
+                print(row)
+        print("Pool metrics:", get_pool().metrics())
+    finally:
+        close_pool()
@@ -0,0 +1,151 @@
+import os
+
+import pandas as pd
+import pytest
+
+from etl import ddl
+from etl.load import build_merge_query, load_columns, LOAD_COLUMNS
+
+
+def test_plan_load_defers_indexes_only_for_large_loads():
+    assert ddl.plan_load(1_000, 10_000_000) == {'defer_indexes': False, 'analyze': False}
+    # Large in absolute terms but small next to the table: keep maintaining the indexes
+    assert ddl.plan_load(200_000, 10_000_000) == {'defer_indexes': False, 'analyze': True}
+    assert ddl.plan_load(5_000_000, 10_000_000) == {'defer_indexes': True, 'analyze': True}
+    # Into an empty (or never analyzed) table
+    assert ddl.plan_load(ddl.DEFER_MIN_ROWS, 0) == {'defer_indexes': True, 'analyze': True}
+    assert ddl.plan_load(10, 0)['analyze']
+
+
+def test_partitioned_table_needs_region_in_the_conflict_key():
+    assert load_columns('nothing', ddl.CONFLICT_KEY) == LOAD_COLUMNS + ['region']
+    merge = repr(build_merge_query(load_columns('update', ddl.CONFLICT_KEY), on_conflict='update', key=ddl.CONFLICT_KEY))
+    assert "Identifier('region')" in merge
+    with pytest.raises(ValueError):
+        build_merge_query(LOAD_COLUMNS, key=ddl.CONFLICT_KEY)
+
+
+def test_conflict_key_from_environment(monkeypatch):
+    monkeypatch.setenv('IAM_ETL_CONFLICT_KEY', 'policy_id, region')
+    assert load_columns() == LOAD_COLUMNS + ['region']
+
+
+class ScriptedCursor:
+    """Answers the catalog queries of migration 1 for a database with a plain iam_policies table."""
+
+    def __init__(self, null_regions=0, columns=('policy_id', 'user_id', 'role', 'plan_type', 'monthly_rate', 'premium', 'region')):
+        self.null_regions = null_regions
+        self.columns = columns
+        self.statements = []
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        self.statements.append(query if isinstance(query, str) else repr(query))
+        self.last = self.statements[-1]
+
+    def fetchone(self):
+        if 'relkind' in self.last:
+            return ('r',)
+        return (self.null_regions,)
+
+    def fetchall(self):
+        if 'pg_indexes' in self.last:
+            return [('iam_policies_pkey',)]
+        return [(column,) for column in self.columns]
+
+
+def run_migration(cur):
+    """Migration 1's statements, executed as migrate() runs them (the catalog queries aren't listed)."""
+    executed = []
+    for statement in ddl.MIGRATIONS[0][2](cur):
+        executed.append(repr(statement))
+        cur.execute(statement)
+    return executed
+
+
+def test_migration_converts_an_existing_plain_table():
+    executed = run_migration(ScriptedCursor())
+    assert 'RENAME TO' in executed[0] and "Identifier('iam_policies_unpartitioned')" in executed[0]
+    assert "Identifier('iam_policies_pkey_unpartitioned')" in executed[1]
+    assert 'PARTITION BY LIST' in executed[2]
+    insert = next(statement for statement in executed if 'INSERT INTO' in statement)
+    assert "Identifier('loaded_at')" not in insert  # Only the columns the old table has
+    assert executed.index(insert) < next(i for i, statement in enumerate(executed) if 'DROP TABLE' in statement)
+    assert 'CREATE INDEX' in executed[-1]
+
+
+def test_migration_gives_rows_without_a_region_the_unknown_region():
+    insert = next(statement for statement in run_migration(ScriptedCursor(null_regions=3)) if 'INSERT INTO' in statement)
+    assert "SQL('coalesce(')" in insert and "Literal('UNKNOWN')" in insert
+
+
+def test_migration_converts_a_legacy_table_without_a_region_column():
+    cur = ScriptedCursor(null_regions=5, columns=('policy_id', 'user_id', 'role', 'plan_type', 'monthly_rate', 'premium'))
+    executed = run_migration(cur)
+    assert not any('region IS NULL' in statement for statement in cur.statements)  # Never queries the missing column
+    insert = next(statement for statement in executed if 'INSERT INTO' in statement)
+    assert "Identifier('region')" in insert and "Literal('UNKNOWN')" in insert and 'coalesce' not in insert
+
+
+@pytest.mark.skipif(not os.environ.get('IAM_ETL_TEST_DSN'), reason="set IAM_ETL_TEST_DSN to run against a local Postgres")
+def test_migrate_and_managed_load_against_postgres(monkeypatch):
+    psycopg2 = pytest.importorskip('psycopg2')
+    conn = psycopg2.connect(os.environ['IAM_ETL_TEST_DSN'])
+    monkeypatch.setattr(ddl, 'DEFER_MIN_ROWS', 2)  # Defer the indexes even for this tiny load
+    try:
+        with conn.cursor() as cur:
+            # Everything below lives in a throwaway schema
+            cur.execute("CREATE SCHEMA iam_etl_ddl_test; SET search_path TO iam_etl_ddl_test;")
+        conn.commit()
+        assert ddl.migrate(conn) == [1, 2]
+        assert ddl.migrate(conn) == []
+
+        df = pd.DataFrame({
+            'policy_id': ['P001', 'P002', 'P003'], 'user_id': ['U001', 'U002', 'U003'],
+            'role': ['Admin', 'User', 'Manager'], 'plan_type': ['Basic', 'Standard', 'Enterprise'],
+            'monthly_rate': [50, 120, 320], 'premium': [True, False, True], 'region': ['US', 'EU', 'Mars'],
+        })
+        stats = ddl.managed_load(conn, df)
+        assert stats['written'] == 3
+        assert stats['deferred_indexes'] == sorted(ddl.SECONDARY_INDEXES) and stats['analyzed']
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT tableoid::regclass::text, policy_id FROM iam_policies ORDER BY policy_id;")
+            assert cur.fetchall() == [('iam_policies_us', 'P001'), ('iam_policies_eu', 'P002'), ('iam_policies_default', 'P003')]
+            assert set(ddl.SECONDARY_INDEXES) <= ddl.existing_indexes(cur)
+            cur.execute("SELECT relpersistence FROM pg_class WHERE relname = %s;", (ddl.STAGING_TABLE,))
+            assert cur.fetchone() == ('u',)
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS iam_etl_ddl_test CASCADE;")
+        conn.commit()
+        conn.close()
+
+
+@pytest.mark.skipif(not os.environ.get('IAM_ETL_TEST_DSN'), reason="set IAM_ETL_TEST_DSN to run against a local Postgres")
+def test_migrate_converts_an_existing_table_against_postgres():
+    psycopg2 = pytest.importorskip('psycopg2')
+    conn = psycopg2.connect(os.environ['IAM_ETL_TEST_DSN'])
+    try:
+        with conn.cursor() as cur:
+            cur.execute("CREATE SCHEMA iam_etl_ddl_test; SET search_path TO iam_etl_ddl_test;")
+            cur.execute("CREATE TABLE iam_policies (policy_id text PRIMARY KEY, user_id text, role text, plan_type text, "
+                        "monthly_rate integer, premium boolean, region text);")
+            cur.execute("INSERT INTO iam_policies VALUES ('P001', 'U001', 'Admin', 'Basic', 50, true, 'EU'), "
+                        "('P002', 'U002', 'User', 'Basic', 120, false, NULL);")
+        conn.commit()
+        assert ddl.migrate(conn) == [1, 2]
+        with conn.cursor() as cur:
+            assert ddl.table_kind(cur) == 'p'
+            cur.execute("SELECT tableoid::regclass::text, policy_id, loaded_at FROM iam_policies ORDER BY policy_id;")
+            assert cur.fetchall() == [('iam_policies_eu', 'P001', None), ('iam_policies_default', 'P002', None)]
+            cur.execute("SELECT region FROM iam_policies WHERE policy_id = 'P002';")
+            assert cur.fetchone() == (ddl.UNKNOWN_REGION,)
+            assert ddl.table_kind(cur, ddl.UNPARTITIONED_TABLE) is None
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS iam_etl_ddl_test CASCADE;")
+        conn.commit()
+        conn.close()
@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from etl.dedup import BloomFilter, Deduplicator, dedupe_chunks, dedupe_frame, key_hashes
+
+
+def make_frame(n_rows=5000, n_keys=2000):
+    rng = np.random.default_rng(5)
+    return pd.DataFrame({
+        'policy_id': [f'P{i:06d}' for i in rng.integers(0, n_keys, size=n_rows)],
+        'row': np.arange(n_rows),
+        'login_count': rng.integers(20, 800, size=n_rows),
+    })
+
+
+def expected(df, keep):
+    if keep == 'latest':
+        # Greatest login_count per policy_id, the last such row on ties
+        kept = df.sort_values(['login_count', 'row'], kind='stable').drop_duplicates('policy_id', keep='last')
+        return kept.sort_values('row')
+    return df.drop_duplicates('policy_id', keep=keep)
+
+
+def chunked(df, size=500):
+    return [df.iloc[start:start + size] for start in range(0, len(df), size)]
+
+
+@pytest.mark.parametrize('keep', ['first', 'last', 'latest'])
+def test_in_memory_matches_drop_duplicates(keep):
+    df = make_frame()
+    dedup = Deduplicator(keep, order_by='login_count')
+    result = pd.concat(dedupe_chunks(chunked(df), dedup))
+    assert not dedup.spilled
+    assert_frame_equal(result, expected(df, keep))
+    assert dedup.stats['duplicates'] == len(df) - len(result)
+
+
+@pytest.mark.parametrize('keep', ['first', 'last', 'latest'])
+def test_spilled_keeps_the_same_rows(keep, tmp_path):
+    df = make_frame()
+    dedup = Deduplicator(keep, order_by='login_count', memory_mb=0.05, spill_dir=str(tmp_path), partitions=8)
+    result = pd.concat(dedupe_chunks(chunked(df), dedup))
+    assert dedup.spilled
+    assert_frame_equal(result.sort_values('row'), expected(df, keep))
+    assert os.listdir(tmp_path) == []  # Spill files are removed at the end
+
+
+def test_first_streams_new_keys_after_spilling(tmp_path):
+    # Every key is new: the Bloom filter lets (nearly) every row through at once
+    df = make_frame(n_rows=3000, n_keys=10**9)
+    dedup = Deduplicator('first', memory_mb=0.01, spill_dir=str(tmp_path))
+    emitted = sum(len(dedup.update(chunk)) for chunk in chunked(df))
+    remaining = sum(len(chunk) for chunk in dedup.finish())
+    assert dedup.spilled
+    assert emitted + remaining == df['policy_id'].nunique()
+    assert remaining <= 0.05 * len(df)
+
+
+def test_dedupe_frame_and_options():
+    df = make_frame(n_rows=100, n_keys=10)
+    assert_frame_equal(dedupe_frame(df, Deduplicator('last')), expected(df, 'last'))
+    assert dedupe_frame(df.iloc[:0], Deduplicator()).empty
+    with pytest.raises(ValueError):
+        Deduplicator('latest')
+    with pytest.raises(ValueError):
+        Deduplicator('any')
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(8 * 1024)
+    hashes = key_hashes(pd.Series([f'P{i}' for i in range(500)]))
+    bloom.add(hashes)
+    assert bloom.might_contain(hashes).all()
+    others = key_hashes(pd.Series([f'Q{i}' for i in range(500)]))
+    assert bloom.might_contain(others).mean() < 0.1
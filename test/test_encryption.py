@@ -0,0 +1,62 @@
+import base64
+
+import numpy as np
+import pandas as pd
+import pytest
+from cryptography.exceptions import InvalidTag
+
+from etl.encryption import EncryptionEngine, generate_key, load_key
+from etl.transform import encode_data, encrypt_columns, ciphertext_column, ENCRYPTED_COLUMNS
+
+
+def test_round_trip_in_batches_over_workers():
+    values = list(range(1000)) + [None, float('nan'), 12.0]
+    with EncryptionEngine(generate_key(), workers=2, batch_rows=128) as engine:
+        tokens = engine.encrypt(values, 'login_count')
+        assert tokens[1000] is None and tokens[1001] is None
+        assert len(set(tokens[:1000])) == 1000  # Fresh nonce per value
+        decrypted = engine.decrypt(tokens, 'login_count')
+    assert list(decrypted) == [str(value) for value in range(1000)] + [None, None, '12']
+
+
+
+def test_integral_floats_are_encrypted_without_a_decimal_part():
+    # Unlike encode_data, which base64-encodes str(value)
+    with EncryptionEngine(generate_key()) as engine:
+        decrypted = engine.decrypt(engine.encrypt([50.0, 7, 2.5], 'login_count'), 'login_count')
+    assert list(decrypted) == ['50', '7', '2.5']
+    assert base64.b64decode(encode_data(50.0)).decode('utf-8') == '50.0'
+
+
+def test_ciphertext_is_bound_to_its_column():
+    engine = EncryptionEngine(generate_key())
+    tokens = engine.encrypt([520], 'monthly_rate')
+    with pytest.raises(InvalidTag):
+        engine.decrypt(tokens, 'login_count')
+
+
+def test_load_key_formats(monkeypatch):
+    assert load_key('00' * 32) == bytes(32)
+    assert len(load_key(generate_key())) == 32
+    monkeypatch.delenv('IAM_ETL_ENCRYPTION_KEY', raising=False)
+    with pytest.raises(ValueError):
+        load_key()
+    with pytest.raises(ValueError):
+        load_key('c2hvcnQ=')  # 5 bytes
+
+
+def test_encrypt_columns_with_engine():
+    rng = np.random.default_rng(5)
+    df = pd.DataFrame({
+        'monthly_rate': rng.choice([50, 120, 320, 520], size=100),
+        'login_count': rng.integers(20, 800, size=100),
+        'last_login_days': rng.integers(1, 400, size=100),
+        'data_type': rng.choice(['encrypted', 'non-encrypted'], size=100),
+    })
+    engine = EncryptionEngine(generate_key())
+    result = encrypt_columns(df.copy(), engine=engine)
+    encrypted = (df['data_type'] == 'encrypted').to_numpy()
+    for column in ENCRYPTED_COLUMNS:
+        assert result[column][encrypted].isna().all()
+        decrypted = engine.decrypt(result[ciphertext_column(column)][encrypted].tolist(), column)
+        assert list(decrypted) == df[column][encrypted].astype(str).tolist()
@@ -1,4 +1,37 @@
-from etl.extract import extract_data
+import pandas as pd
 
-df = extract_data("data/iam_policies.csv")
-print(df.head())
\ No newline at end of file
+from etl.extract import extract_data, extract_partitions
+from etl.storage import read_frame
+
+
+def test_extract_data(tmp_path):
+    output_file = tmp_path / 'iam_policies.csv'
+    df = extract_data(output_file, n_rows=25, chunk_size=10)
+    print(df.head())
+
+    assert len(df) == 25
+    assert df['policy_id'].is_unique and df['policy_id'].is_monotonic_increasing
+    assert df['policy_id'].iloc[-1] == 'P0000000025'
+    assert df['premium'].dtype == bool
+    assert pd.read_csv(output_file).shape == df.shape
+
+
+def test_extract_data_is_independent_of_worker_count(tmp_path):
+    serial = extract_data(tmp_path / 'serial.csv', n_rows=50, chunk_size=8)
+    parallel = extract_data(tmp_path / 'parallel.csv', n_rows=50, chunk_size=8, workers=3)
+
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert (tmp_path / 'serial.csv').read_bytes() == (tmp_path / 'parallel.csv').read_bytes()
+
+
+def test_extract_data_streams_without_returning_frame(tmp_path):
+    output_file = tmp_path / 'iam_policies.csv'
+    assert extract_data(output_file, n_rows=30, chunk_size=7, return_df=False) == output_file
+    assert sum(len(chunk) for chunk in pd.read_csv(output_file, chunksize=7)) == 30
+
+
+def test_extract_partitions_match_extract_data(tmp_path):
+    paths = extract_partitions(tmp_path / 'parts', n_rows=50, partitions=4, fmt='parquet')
+    assert len(paths) == 4
+    partitioned = pd.concat([read_frame(path) for path in paths], ignore_index=True)
+    pd.testing.assert_frame_equal(partitioned, extract_data(tmp_path / 'all.parquet', n_rows=50, chunk_size=13))
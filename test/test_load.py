@@ -0,0 +1,245 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg2
+import pytest
+
+from etl.checkpoint import LoadCheckpoint
+from etl.load import (
+    bulk_load, build_merge_query, ensure_loaded_at, insert_rows, load_data_bulk, load_data_parallel, load_in_batches, partition_frame,
+    LOAD_COLUMNS, UPSERT_COLUMNS,
+)
+
+
+def make_frame():
+    return pd.DataFrame({
+        'policy_id': ['P001', 'P002', 'P003', 'P001'],
+        'user_id': ['U001', 'U002', 'U003', 'U004'],
+        'role': ['Admin', 'User', 'Manager', 'User'],
+        'plan_type': ['Basic', 'Standard', 'Enterprise', 'Basic'],
+        'monthly_rate': [50, 'MTIw', 320.0, 520],  # 'MTIw' is an encrypted value
+        'premium': [True, False, True, False],
+        'region': ['US', 'EU', 'APAC', 'US'],
+        'login_count': [20, 30, 40, 50],
+        'last_login_days': [1, 2, 3, 4],
+    })
+
+
+class FakeCursor:
+    """Records every statement and COPY payload instead of talking to Postgres."""
+
+    def __init__(self):
+        self.statements = []
+        self.copied = []
+        self.rowcount = 0
+        self.row = None  # What fetchone() returns
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+
+    def fetchone(self):
+        return self.row
+
+    def copy_expert(self, query, buffer):
+        self.statements.append(query)
+        self.copied.append(buffer.read())
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cur = FakeCursor()
+        self.commits = 0
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_bulk_load_copies_frame_and_merges_once():
+    conn = FakeConnection()
+    stats = bulk_load(conn, make_frame())
+
+    assert stats['rows'] == 4
+    assert conn.commits == 1
+    # CREATE staging, ADD load_seq, one COPY chunk, one merge
+    assert len(conn.cur.statements) == 4
+    assert conn.cur.copied == ["P001,U001,Admin,Basic,50,True\n"
+                               "P002,U002,User,Standard,,False\n"
+                               "P003,U003,Manager,Enterprise,320,True\n"
+                               "P001,U004,User,Basic,520,False\n"]
+
+
+class FakePool:
+    def __init__(self):
+        self.connections = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        conn = FakeConnection()
+        with self.lock:
+            self.connections.append(conn)
+        yield conn
+
+
+def test_partition_frame_keeps_duplicate_ids_together():
+    df = pd.concat([make_frame()] * 5, ignore_index=True)
+    parts = partition_frame(df, 3)
+
+    assert sum(len(part) for part in parts) == len(df)
+    owners = {}
+    for index, part in enumerate(parts):
+        assert part.index.is_monotonic_increasing  # Original order is kept inside a partition
+        for policy_id in part['policy_id']:
+            assert owners.setdefault(policy_id, index) == index
+
+
+def test_load_data_parallel_runs_one_transaction_per_partition():
+    pool = FakePool()
+    outcomes = load_data_parallel(make_frame(), workers=2, pool=pool)
+
+    assert [outcome['partition'] for outcome in outcomes] == [0, 1]
+    assert sum(outcome['rows'] for outcome in outcomes) == 4
+    assert all(outcome['error'] is None for outcome in outcomes)
+    assert all(conn.commits == 1 for conn in pool.connections)
+    # Together the partitions send exactly the rows a serial load sends
+    serial = FakeConnection()
+    bulk_load(serial, make_frame())
+    copied = ''.join(''.join(conn.cur.copied) for conn in pool.connections)
+    assert sorted(copied.splitlines()) == sorted(''.join(serial.cur.copied).splitlines())
+
+
+def test_build_merge_query_modes():
+    assert 'DO NOTHING' in repr(build_merge_query(LOAD_COLUMNS))
+    update = repr(build_merge_query(UPSERT_COLUMNS, on_conflict='update'))
+    assert 'DO UPDATE SET' in update and 'IS DISTINCT FROM' in update
+    # loaded_at is stamped on insert and update, but never compared (unchanged rows keep theirs)
+    assert update.count("Identifier('loaded_at')") == 3
+    with pytest.raises(ValueError):
+        build_merge_query(LOAD_COLUMNS, on_conflict='replace')
+
+
+@pytest.mark.skipif(not os.environ.get('IAM_ETL_TEST_DSN'), reason="set IAM_ETL_TEST_DSN to run against a local Postgres")
+@pytest.mark.parametrize('on_conflict, expected_user', [('nothing', 'U001'), ('update', 'U004')])
+def test_bulk_load_against_postgres(on_conflict, expected_user):
+    psycopg2 = pytest.importorskip('psycopg2')
+    conn = psycopg2.connect(os.environ['IAM_ETL_TEST_DSN'])
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE iam_policies (
+                    policy_id text PRIMARY KEY, user_id text, role text, plan_type text,
+                    monthly_rate integer, premium boolean, region text, login_count integer, last_login_days integer,
+                    loaded_at timestamptz
+                );
+            """)
+        conn.commit()
+
+        bulk_load(conn, make_frame(), on_conflict=on_conflict)
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT policy_id, user_id, monthly_rate FROM iam_policies ORDER BY policy_id;")
+            rows = cur.fetchall()
+        assert rows[0] == ('P001', expected_user, 50 if on_conflict == 'nothing' else 520)
+        assert rows[1] == ('P002', 'U002', None)
+        assert len(rows) == 3
+    finally:
+        conn.close()
+
+
+def test_load_in_batches_resumes_after_a_failed_batch(tmp_path):
+    checkpoint = LoadCheckpoint(tmp_path / 'checkpoint.json')
+    df = pd.concat([make_frame()] * 3, ignore_index=True)  # 12 rows, 3 batches of 4
+    written = []
+
+    def fail_third_batch(conn, batch):
+        if batch.index[0] == 8:
+            raise ValueError("not transient")
+        written.append(list(batch.index))
+        return len(batch)
+
+    with pytest.raises(ValueError):
+        load_in_batches(df, fail_third_batch, batch_rows=4, checkpoint=checkpoint, pool=FakePool())
+    assert checkpoint.read()['rows_committed'] == 8
+
+    stats = load_in_batches(df, lambda conn, batch: written.append(list(batch.index)) or len(batch),
+                            batch_rows=4, checkpoint=checkpoint, pool=FakePool())
+    assert stats['resumed_from'] == 8 and stats['batches'] == 1
+    assert written == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 10, 11]]  # No batch sent twice
+    assert checkpoint.read() is None  # Cleared once everything is in
+
+
+def test_load_in_batches_retries_transient_errors(tmp_path):
+    failures = [psycopg2.OperationalError("server closed the connection"), psycopg2.OperationalError("deadlock")]
+    pool, slept = FakePool(), []
+
+    def flaky(conn, batch):
+        if failures:
+            raise failures.pop()
+        return insert_rows(conn, batch)
+
+    stats = load_in_batches(make_frame(), flaky, batch_rows=10, checkpoint=LoadCheckpoint(tmp_path / 'c.json'),
+                            pool=pool, sleep=slept.append)
+    assert stats['retries'] == 2 and stats['written'] == 4
+    assert len(slept) == 2
+    assert len(pool.connections) == 3  # Every attempt on a fresh checkout
+    assert len(pool.connections[-1].cur.statements) == 4
+
+
+def test_load_data_parallel_warns_when_the_pool_is_smaller(caplog):
+    pool = FakePool()
+    pool.maxconn = 2
+    with caplog.at_level('WARNING', logger='iam_etl.load'):
+        load_data_parallel(make_frame(), workers=3, pool=pool)
+    assert 'at most 2 connections' in caplog.text
+
+
+def test_ensure_loaded_at_only_alters_a_table_without_the_column():
+    conn = FakeConnection()
+    ensure_loaded_at(conn)
+    assert len(conn.cur.statements) == 2
+    assert 'ADD COLUMN IF NOT EXISTS' in repr(conn.cur.statements[1])
+
+    conn = FakeConnection()
+    conn.cur.row = (1,)
+    ensure_loaded_at(conn)
+    assert len(conn.cur.statements) == 1  # Only the check
+
+
+def test_insert_rows_uses_the_configured_conflict_key(monkeypatch):
+    monkeypatch.setenv('IAM_ETL_CONFLICT_KEY', 'policy_id,region')
+    conn = FakeConnection()
+    assert insert_rows(conn, make_frame()) == 4
+    query = repr(conn.cur.statements[0])
+    assert "ON CONFLICT (" in query and "Identifier('region')" in query
+    assert conn.commits == 1
+
+
+def test_load_data_parallel_merges_on_the_given_key():
+    pool = FakePool()
+    load_data_parallel(make_frame(), workers=2, pool=pool, key=['policy_id', 'region'])
+    merges = [repr(conn.cur.statements[-1]) for conn in pool.connections]
+    assert all("ON CONFLICT (" in merge and "Identifier('region')" in merge for merge in merges)
+
+
+def test_load_data_bulk_refuses_to_batch_a_managed_load():
+    with pytest.raises(ValueError):
+        load_data_bulk(make_frame(), managed=True, batch_rows=2)
+
+
+def test_insert_rows_upserts_changed_rows():
+    conn = FakeConnection()
+    insert_rows(conn, make_frame().assign(login_count=['MjA=', 30, 40, 50]), on_conflict='update')
+    query = repr(conn.cur.statements[0])
+    assert 'DO UPDATE SET' in query and 'IS DISTINCT FROM' in query
+    assert "Identifier('login_count')" in query
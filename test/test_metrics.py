@@ -0,0 +1,26 @@
+import json
+
+from etl.metrics import PipelineMetrics
+
+
+def test_nested_stages_and_repeated_calls(tmp_path):
+    metrics = PipelineMetrics(trace_memory=True)
+    with metrics.stage('transform', rows_in=100) as step:
+        for _ in range(3):
+            with metrics.stage('encrypt', rows_in=10) as sub:
+                sub['rows_out'] = 10
+                blob = [0] * 10_000
+        step['rows_out'] = 90
+
+    stages = {record['stage']: record for record in metrics.to_dict()['stages']}
+    assert set(stages) == {'transform', 'transform.encrypt'}
+    assert stages['transform.encrypt']['calls'] == 3
+    assert stages['transform.encrypt']['rows_in'] == 30
+    assert stages['transform']['rows_out'] == 90
+    assert stages['transform']['rows_per_sec'] > 0
+    # The parent's peak covers its children's allocations
+    assert stages['transform']['peak_traced_mb'] >= stages['transform.encrypt']['peak_traced_mb'] > 0
+
+    path = metrics.write_json(tmp_path / 'metrics.json')
+    assert len(json.loads(open(path).read())['stages']) == 2
+    del blob
@@ -0,0 +1,38 @@
+import os
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from etl.extract import iter_chunks
+from etl.parallel_transform import row_partitions, transform_parallel
+from etl.sampling import ReservoirSampler
+from etl.transform import transform_data
+
+
+def make_frame(n_rows=2000):
+    return pd.concat(iter_chunks(n_rows, n_rows, seed=3))
+
+
+def test_row_partitions_cover_every_row_once():
+    assert row_partitions(10, 3) == [(0, 3), (3, 6), (6, 10)]
+    assert row_partitions(2, 4) == [(0, 1), (1, 2)]
+
+
+def test_transform_parallel_matches_transform_data(tmp_path):
+    df = make_frame()
+    (tmp_path / 'single').mkdir()
+    (tmp_path / 'parallel').mkdir()
+    expected = transform_data(df.copy(), output_dir=str(tmp_path / 'single'), snapshot_level='full')
+    result = transform_parallel(df.copy(), output_dir=str(tmp_path / 'parallel'), snapshot_level='full', workers=3)
+    for left, right in zip(expected, result):
+        assert_frame_equal(left, right, check_exact=True)
+    for name in sorted(os.listdir(tmp_path / 'single')):
+        assert (tmp_path / 'single' / name).read_bytes() == (tmp_path / 'parallel' / name).read_bytes(), name
+
+
+def test_transform_parallel_reservoir_sample_is_global(tmp_path):
+    df = make_frame()
+    _, expected, _ = transform_data(df.copy(), output_dir=str(tmp_path), snapshot_level='off', sampler=ReservoirSampler(50))
+    _, result, _ = transform_parallel(df.copy(), output_dir=str(tmp_path), snapshot_level='off',
+                                      sampler=ReservoirSampler(50), workers=4)
+    assert_frame_equal(expected, result, check_exact=True)
@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from etl.extract import extract_data
+from etl.sampling import FractionSampler, ReservoirSampler, sample_frame, sampler_from_options
+
+
+def chunks_of(df, size):
+    return [df.iloc[start:start + size] for start in range(0, len(df), size)]
+
+
+def test_fraction_sample_is_stable_and_chunkable(tmp_path):
+    df = extract_data(tmp_path / 'iam_policies.csv', n_rows=2000)
+    whole = sample_frame(df, FractionSampler(0.3))
+    streamed = pd.concat([FractionSampler(0.3).update(chunk) for chunk in chunks_of(df, 333)])
+    pd.testing.assert_frame_equal(whole, streamed)
+    assert 0.25 < len(whole) / len(df) < 0.35
+
+    # Policies stay sampled when other rows come and go
+    subset = sample_frame(df.iloc[500:1500], FractionSampler(0.3))
+    assert set(subset['policy_id']) == set(whole['policy_id']) & set(df['policy_id'].iloc[500:1500])
+
+
+def test_stratified_quotas(tmp_path):
+    df = extract_data(tmp_path / 'iam_policies.csv', n_rows=3000)
+    sampled = sample_frame(df, FractionSampler(0.5, by=['region'], quotas={'EU': 0.0, 'US': 1.0}))
+    assert not (sampled['region'] == 'EU').any()
+    assert (sampled['region'] == 'US').sum() == (df['region'] == 'US').sum()
+
+
+def test_reservoir_is_independent_of_chunking(tmp_path):
+    df = extract_data(tmp_path / 'iam_policies.csv', n_rows=1000)
+    whole = sample_frame(df, ReservoirSampler(50))
+    reservoir = ReservoirSampler(50)
+    for chunk in chunks_of(df, 64):
+        reservoir.update(chunk)
+    assert len(whole) == 50
+    pd.testing.assert_frame_equal(reservoir.result(), whole)
+
+
+def test_stratified_reservoir_sizes(tmp_path):
+    df = extract_data(tmp_path / 'iam_policies.csv', n_rows=1000)
+    reservoir = sampler_from_options(size=10, by=['region', 'role'], quotas=['EU,Admin=25'])
+    for chunk in chunks_of(df, 100):
+        reservoir.update(chunk)
+    sizes = reservoir.result().groupby(['region', 'role'], observed=True).size()
+    assert sizes[('EU', 'Admin')] == 25
+    assert (sizes.drop(('EU', 'Admin')) == 10).all()
+
+
+def test_quotas_must_match_the_sampling_mode():
+    with pytest.raises(ValueError, match='row counts'):
+        sampler_from_options(size=10, by=['region'], quotas=['EU=0.1'])
+    with pytest.raises(ValueError, match='row counts'):
+        sampler_from_options(size=10, by=['region'], quotas=['EU=-5'])
+    with pytest.raises(ValueError, match=r'fractions in \[0, 1\]'):
+        sampler_from_options(frac=0.5, by=['region'], quotas=['EU=500'])
+    assert sampler_from_options(frac=0.5, by=['region'], quotas=['EU=1']).quotas == {('EU',): 1.0}
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from etl.extract import extract_data
+from etl.schema import apply_schema, decode_ids, encode_ids, memory_report
+
+
+def test_extract_frames_use_the_canonical_dtypes(tmp_path):
+    df = extract_data(tmp_path / 'iam_policies.csv', n_rows=30, chunk_size=7)
+    assert isinstance(df['region'].dtype, pd.CategoricalDtype)
+    assert list(df['role'].cat.categories) == ['Admin', 'User', 'Manager']
+    assert df['last_login_days'].dtype == np.int16
+    assert df['login_count'].dtype == np.int32
+
+
+def test_apply_schema_keeps_what_does_not_fit():
+    df = apply_schema(pd.DataFrame({
+        'region': ['US', 'LATAM'],  # Unknown category is kept, not turned into NaN
+        'monthly_rate': [50, 'NTA='],  # Encrypted values: column stays as it is
+        'login_count': [20, np.nan],  # Missing values: nullable integer
+        'last_login_days': [1, 100_000],  # Out of int16 range: left alone
+    }))
+    assert df['region'].tolist() == ['US', 'LATAM']
+    assert df['monthly_rate'].tolist() == [50, 'NTA=']
+    assert str(df['login_count'].dtype) == 'Int32'
+    assert df['last_login_days'].dtype == np.int64
+
+
+def test_encode_ids_round_trip():
+    df = pd.DataFrame({'policy_id': ['P0000000002', 'P0000000010'], 'user_id': ['alice', 'bob']})
+    encoded, codecs = encode_ids(df)
+    assert encoded['policy_id'].tolist() == [2, 10]
+    assert encoded['user_id'].tolist() == [0, 1]  # Positions in the lookup table
+    pd.testing.assert_frame_equal(decode_ids(encoded, codecs), df, check_dtype=False)
+
+
+def test_memory_report_shows_savings():
+    report = memory_report(10_000)
+    assert report.loc['total', 'schema'] < report.loc['total', 'object/int64']
+    assert report.loc['total', 'schema + encoded ids'] <= report.loc['total', 'schema']
@@ -0,0 +1,33 @@
+import pandas as pd
+
+from etl.extract import extract_data
+from etl.snapshots import SnapshotWriter, SUMMARY_ROWS
+
+
+def test_full_snapshot_is_a_copy_taken_at_submit_time(tmp_path):
+    df = extract_data(tmp_path / 'iam_policies.csv', n_rows=30)
+    with SnapshotWriter('full') as snapshots:
+        snapshots.submit(df, tmp_path / 'before.csv')
+        df['monthly_rate'] = -1  # Later changes must not leak into the queued snapshot
+
+    written = pd.read_csv(tmp_path / 'before.csv')
+    assert len(written) == 30
+    assert (written['monthly_rate'] > 0).all()
+
+
+def test_summary_snapshot_keeps_only_the_first_rows_across_chunks(tmp_path):
+    df = extract_data(tmp_path / 'iam_policies.csv', n_rows=SUMMARY_ROWS + 50, chunk_size=60)
+    snapshots = SnapshotWriter('summary')
+    for start in range(0, len(df), 60):
+        snapshots.submit(df.iloc[start:start + 60], tmp_path / 'after.csv')
+    report = snapshots.close()
+
+    assert pd.read_csv(tmp_path / 'after.csv')['policy_id'].tolist() == df['policy_id'].tolist()[:SUMMARY_ROWS]
+    assert report['snapshots'] == 2 and not report['errors']
+
+
+def test_off_writes_nothing(tmp_path):
+    snapshots = SnapshotWriter('off')
+    snapshots.submit(pd.DataFrame({'a': [1]}), tmp_path / 'before.csv')
+    assert snapshots.close()['snapshots'] == 0
+    assert not (tmp_path / 'before.csv').exists()
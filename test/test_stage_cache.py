@@ -0,0 +1,45 @@
+import os
+
+from etl.stage_cache import StageCache
+
+
+def write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    return str(path)
+
+
+def test_key_depends_on_inputs_params_and_code(tmp_path):
+    cache = StageCache(tmp_path / 'cache')
+    key = cache.key('transform', inputs=['abc'], params={'format': 'csv'}, code=['transform'])
+    assert key == cache.key('transform', inputs=['abc'], params={'format': 'csv'}, code=['transform'])
+    assert key != cache.key('transform', inputs=['abd'], params={'format': 'csv'}, code=['transform'])
+    assert key != cache.key('transform', inputs=['abc'], params={'format': 'arrow'}, code=['transform'])
+    assert key != cache.key('transform', inputs=['abc'], params={'format': 'csv'}, code=['transform', 'schema'])
+
+
+def test_store_and_restore(tmp_path):
+    cache = StageCache(tmp_path / 'cache')
+    output = write(tmp_path / 'transformed.csv', 'a,b\n1,2\n')
+    key = cache.key('transform', inputs=['abc'])
+    assert cache.restore(key, {'transformed': output}) is None
+
+    cache.store(key, {'transformed': output}, {'rows_out': 1})
+    os.remove(output)
+    assert cache.restore(key, {'transformed': output}) == {'rows_out': 1}
+    assert open(output).read() == 'a,b\n1,2\n'
+    assert cache.stats == {'hits': 1, 'misses': 1, 'stored': 1, 'evicted': 0}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = StageCache(tmp_path / 'cache', max_mb=2.5 / 1024)  # Room for two 1 KB entries
+    output = write(tmp_path / 'out.csv', 'x' * 1024)
+    keys = [cache.key('extract', params={'rows': n}) for n in range(3)]
+    cache.store(keys[0], {'out': output})
+    cache.store(keys[1], {'out': output})
+    os.utime(os.path.join(cache.root, keys[1], 'manifest.json'), (1, 1))  # keys[1] is now the oldest
+    cache.store(keys[2], {'out': output})
+
+    assert sorted(key for _, _, key in cache.entries()) == sorted([keys[0], keys[2]])
+    assert cache.restore(keys[1], {'out': output}) is None
+    assert cache.stats['evicted'] == 1
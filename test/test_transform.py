@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+from etl.transform import (
+    encode_data, encrypt_columns, transform_stream, RegionAggregator, ENCRYPTED_COLUMNS,
+    ciphertext_column, clean_and_convert_column, drop_missing,
+)
+
+
+def make_frame(n_rows=200):
+    rng = np.random.default_rng(7)
+    return pd.DataFrame({
+        'policy_id': [f'P{i + 1:06d}' for i in range(n_rows)],
+        'monthly_rate': rng.choice([50, 120, 320, 520], size=n_rows),
+        'login_count': rng.integers(20, 800, size=n_rows),
+        'last_login_days': rng.integers(1, 400, size=n_rows),
+        'data_type': rng.choice(['encrypted', 'non-encrypted'], size=n_rows, p=[0.3, 0.7]),
+    })
+
+
+def row_by_row(df):
+    # The original per-row implementation, kept here as the reference for the ciphertext
+    for column in ENCRYPTED_COLUMNS:
+        df[column] = df.apply(
+            lambda row: encode_data(row[column]) if row['data_type'] == 'encrypted' else row[column], axis=1)
+    return df
+
+
+def test_encrypt_columns_matches_encode_data():
+    expected = row_by_row(make_frame())
+    result = encrypt_columns(make_frame())
+    encrypted = (result['data_type'] == 'encrypted').to_numpy()
+    for column in ENCRYPTED_COLUMNS:
+        assert result[ciphertext_column(column)][encrypted].tolist() == expected[column][encrypted].tolist()
+        assert result[ciphertext_column(column)][~encrypted].isna().all()
+
+
+def test_encrypt_columns_keeps_value_columns_numeric():
+    df = make_frame()
+    result = encrypt_columns(df.copy())
+    encrypted = (result['data_type'] == 'encrypted').to_numpy()
+    for column in ENCRYPTED_COLUMNS:
+        assert pd.api.types.is_integer_dtype(result[column])
+        assert result[column][encrypted].isna().all()
+        assert result[column][~encrypted].tolist() == df[column][~encrypted].tolist()
+
+
+def test_encrypt_columns_keeps_nan():
+    df = make_frame(20)
+    df['monthly_rate'] = df['monthly_rate'].astype(float)
+    df.loc[df.index[:5], 'monthly_rate'] = np.nan
+    df.loc[df.index[:5], 'data_type'] = 'encrypted'
+    result = encrypt_columns(df.copy())
+    assert result['monthly_rate_enc'].iloc[:5].isna().all()
+    # Missing in clear and encrypted: dropped like any other missing value
+    assert len(drop_missing(result)) == len(drop_missing(df)) == 15
+
+
+def test_encrypt_columns_without_encrypted_rows_is_noop():
+    df = make_frame(20)
+    df['data_type'] = 'non-encrypted'
+    result = encrypt_columns(df.copy())
+    # The companion columns are always added, so chunks share one layout
+    pd.testing.assert_frame_equal(result[df.columns], df)
+    assert all(result[ciphertext_column(column)].isna().all() for column in ENCRYPTED_COLUMNS)
+
+
+def test_drop_missing_keeps_encrypted_rows():
+    df = encrypt_columns(make_frame())
+    df = clean_and_convert_column(df, 'monthly_rate')
+    assert len(drop_missing(df)) == len(df)
+
+
+def make_regional_frame(n_rows=500):
+    df = make_frame(n_rows)
+    df['region'] = np.random.default_rng(3).choice(['US', 'EU', 'APAC'], size=n_rows)
+    return df
+
+
+def test_region_aggregator_matches_pivot_table():
+    df = make_regional_frame()
+    expected = df.pivot_table(index=['region'], values=['monthly_rate', 'login_count'], aggfunc='mean')
+
+    aggregator = RegionAggregator()
+    for start in range(0, len(df), 64):
+        aggregator.update(df.iloc[start:start + 64])
+
+    pd.testing.assert_frame_equal(aggregator.result(), expected, check_names=False)
+
+
+def test_region_aggregator_partials_merge(tmp_path):
+    df = make_regional_frame()
+    partials = []
+    for partition, start in enumerate(range(0, len(df), 150)):
+        aggregator = RegionAggregator()
+        aggregator.update(df.iloc[start:start + 150])
+        aggregator.partials().to_csv(tmp_path / f'partials-{partition}.csv', index=False)
+        partials.append(pd.read_csv(tmp_path / f'partials-{partition}.csv'))
+
+    whole = RegionAggregator()
+    whole.update(df)
+    pd.testing.assert_frame_equal(RegionAggregator.from_partials(partials).result(), whole.result())
+
+
+def test_transform_stream_matches_transform_data(tmp_path):
+    df = make_regional_frame()
+    df.to_csv(tmp_path / 'input.csv', index=False)
+
+    rows_in, rows_out, df_reshaped = transform_stream(pd.read_csv(tmp_path / 'input.csv', chunksize=100), output_dir=tmp_path)
+
+    assert rows_in == rows_out == len(df)
+    streamed = pd.read_csv(tmp_path / 'transformed.csv')
+    encrypt_columns(pd.read_csv(tmp_path / 'input.csv')).to_csv(tmp_path / 'expected.csv', index=False)
+    expected = pd.read_csv(tmp_path / 'expected.csv')
+    assert streamed.astype(str).values.tolist() == expected.astype(str).values.tolist()
+    reshaped = pd.read_csv(tmp_path / 'reshaped_iam_policies.csv')
+    assert reshaped.shape == (3, 3) and sorted(reshaped['region']) == ['APAC', 'EU', 'US']